@@ -0,0 +1,75 @@
+"""Latency and query count of the admin expense changelist on a large table.
+
+    python benchmarks/bench_admin.py --rows 5000000 --db /tmp/admin.sqlite3
+
+Seeds ``--rows`` expenses (skipped when ``--db`` already holds them) and
+requests the changelist as a superuser: the first and a later page, a
+category filter, the date hierarchy at each level, a search and the
+category autocomplete. Prints the median and worst latency and the number
+of queries per case.
+"""
+import argparse
+import json
+import os
+
+import common
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--db", help="Reuse (or keep) this SQLite file")
+    args = parser.parse_args()
+
+    common.setup_django()
+    db_path = common.use_database(args.db)
+    try:
+        from django.contrib.auth.models import User
+        from django.db import connection
+        from django.test import Client
+        from django.test.utils import CaptureQueriesContext
+        from django.urls import reverse
+        from expenses.models import Category, Expense
+
+        if not Expense.objects.exists():
+            common.seed_expenses(args.rows, users=10)
+        admin, _ = User.objects.get_or_create(
+            username="bench-admin", defaults={"is_staff": True, "is_superuser": True}
+        )
+        client = Client()
+        client.force_login(admin)
+
+        changelist = reverse("admin:expenses_expense_changelist")
+        latest = Expense.objects.order_by("-date", "-id").first().date
+        category = Category.objects.first()
+        cases = [
+            ("changelist", changelist, {}),
+            ("page 50", changelist, {"p": 49}),
+            ("category filter", changelist, {"category__id__exact": category.pk}),
+            ("year", changelist, {"date__year": latest.year}),
+            ("month", changelist, {"date__year": latest.year, "date__month": latest.month}),
+            ("search", changelist, {"q": "dinner"}),
+            (
+                "category autocomplete",
+                reverse("admin:autocomplete"),
+                {"app_label": "expenses", "model_name": "expense", "field_name": "category", "term": category.name[:2]},
+            ),
+        ]
+        for name, url, params in cases:
+            with CaptureQueriesContext(connection) as queries:
+                response = client.get(url, params)
+            query_count = len(queries)
+            assert response.status_code == 200, (name, response.status_code)
+            median_ms, max_ms = common.timed_requests(client, url, args.repeat, **params)
+            print(json.dumps({
+                "case": name, "rows": Expense.objects.count() if name == "changelist" else None,
+                "median_ms": median_ms, "max_ms": max_ms, "queries": query_count,
+            }))
+    finally:
+        if not args.db:
+            os.unlink(db_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""Load-test the async API under ASGI against the sync API under WSGI.
+
+    pip install uvicorn
+    python benchmarks/bench_asgi.py --concurrency 50 200 --requests 2000
+
+Seeds a throwaway database, then serves the project with uvicorn twice: as
+an ASGI app (``expensecrm.asgi``, hitting ``/api/async/...``) and as a WSGI
+app in uvicorn's thread pool (``expensecrm.wsgi``, hitting the REST
+framework views). Using the same server for both keeps the comparison about
+the application path. Each step prints throughput and p50/p99 latency.
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from urllib.parse import urlencode
+
+import common
+
+AGGREGATE_QUERY = urlencode(dict(common.LAST_SEEDED_YEAR, interval="month"))
+ENDPOINTS = {
+    "list": ("/api/expenses/", "/api/async/expenses/"),
+    "aggregate": (f"/api/expenses/aggregate/?{AGGREGATE_QUERY}", f"/api/async/aggregate/?{AGGREGATE_QUERY}"),
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(interface, settings_dir, port, workers):
+    app = "expensecrm.asgi:application" if interface == "asgi" else "expensecrm.wsgi:application"
+    uvicorn_interface = "asgi3" if interface == "asgi" else "wsgi"
+    env = dict(
+        os.environ,
+        DJANGO_SETTINGS_MODULE="bench_settings",
+        PYTHONPATH=os.pathsep.join([str(settings_dir), str(common.PROJECT_DIR)]),
+    )
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", app, "--interface", uvicorn_interface,
+         "--port", str(port), "--workers", str(workers), "--log-level", "warning", "--no-access-log"],
+        cwd=common.PROJECT_DIR, env=env,
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline and process.poll() is None:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError(f"{interface} server did not start on port {port}")
+
+
+async def read_response(reader):
+    head = await reader.readuntil(b"\r\n\r\n")
+    status = int(head.split(b" ", 2)[1])
+    headers = {}
+    for line in head.split(b"\r\n")[1:]:
+        if b":" in line:
+            name, value = line.split(b":", 1)
+            headers[name.strip().lower()] = value.strip()
+    if b"content-length" in headers:
+        await reader.readexactly(int(headers[b"content-length"]))
+    elif headers.get(b"transfer-encoding") == b"chunked":
+        while True:
+            size = int((await reader.readline()).strip(), 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    return status
+
+
+async def client(port, path, token, count, timings, errors):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    request = (
+        f"GET {path} HTTP/1.1\r\nHost: localhost\r\nAuthorization: Token {token}\r\n\r\n"
+    ).encode()
+    try:
+        for _ in range(count):
+            started = time.perf_counter()
+            writer.write(request)
+            status = await read_response(reader)
+            timings.append(time.perf_counter() - started)
+            if status != 200:
+                errors.append(status)
+    finally:
+        writer.close()
+
+
+async def load(port, path, token, concurrency, requests):
+    timings, errors = [], []
+    per_client = max(1, requests // concurrency)
+    started = time.perf_counter()
+    await asyncio.gather(
+        *(client(port, path, token, per_client, timings, errors) for _ in range(concurrency))
+    )
+    elapsed = time.perf_counter() - started
+    timings.sort()
+    return {
+        "requests": len(timings),
+        "errors": len(errors),
+        "rps": round(len(timings) / elapsed, 1),
+        "p50_ms": round(timings[len(timings) // 2] * 1000, 1),
+        "p99_ms": round(timings[int(len(timings) * 0.99) - 1] * 1000, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=50000)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[50, 200])
+    parser.add_argument("--requests", type=int, default=2000, help="Requests per step")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--endpoints", nargs="+", choices=sorted(ENDPOINTS), default=sorted(ENDPOINTS))
+    args = parser.parse_args()
+
+    common.setup_django()
+    db_path = common.use_database()
+    common.seed_expenses(args.rows)
+    from django.contrib.auth.models import User
+    from rest_framework.authtoken.models import Token
+
+    token = Token.objects.create(user=User.objects.get(username="user1")).key
+    settings_dir = Path(tempfile.mkdtemp(prefix="bench-settings-"))
+    (settings_dir / "bench_settings.py").write_text(
+        "from expensecrm.settings import *  # noqa\n"
+        f"DATABASES['default']['NAME'] = {db_path!r}\n"
+        "ALLOWED_HOSTS = ['*']\n"
+        "DEBUG = False\n"
+    )
+
+    try:
+        for interface in ("wsgi", "asgi"):
+            port = free_port()
+            server = start_server(interface, settings_dir, port, args.workers)
+            try:
+                for name in args.endpoints:
+                    path = ENDPOINTS[name][interface == "asgi"]
+                    for concurrency in args.concurrency:
+                        result = asyncio.run(load(port, path, token, concurrency, args.requests))
+                        print(json.dumps(dict(
+                            {"interface": interface, "endpoint": name, "concurrency": concurrency},
+                            **result,
+                        )))
+            finally:
+                server.terminate()
+                server.wait()
+    finally:
+        os.unlink(db_path)
+        (settings_dir / "bench_settings.py").unlink()
+        settings_dir.rmdir()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""Measure export throughput and peak memory for growing table sizes.
+
+    python benchmarks/bench_export.py --rows 10000 100000 1000000
+
+Each size is seeded into its own SQLite file, then exported by a fresh child
+process so that its peak RSS reflects the export alone.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+import common
+
+
+def measure(db_path, fmt, chunk_size):
+    common.setup_django()
+    common.use_database(db_path, migrate=False)
+    from expenses.export import export_chunks
+    from expenses.models import Expense
+
+    rows = Expense.objects.count()
+    started = time.perf_counter()
+    with open(os.devnull, "w") as sink:
+        for chunk in export_chunks(Expense.objects.all(), fmt, chunk_size):
+            sink.write(chunk)
+    elapsed = time.perf_counter() - started
+    print(json.dumps({
+        "rows": rows,
+        "format": fmt,
+        "seconds": round(elapsed, 3),
+        "rows_per_sec": round(rows / elapsed) if elapsed else None,
+        "peak_rss_kb": common.peak_rss_kb(),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--format", choices=["csv", "jsonl"], default="csv")
+    parser.add_argument("--chunk-size", type=int, default=2000)
+    parser.add_argument("--measure", metavar="DB", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        return measure(args.measure, args.format, args.chunk_size)
+
+    common.setup_django()
+    from django.db import connections
+
+    for rows in args.rows:
+        db_path = common.use_database()
+        common.seed_expenses(rows)
+        connections.close_all()
+        try:
+            subprocess.run(
+                [sys.executable, __file__, "--measure", db_path, "--format", args.format,
+                 "--chunk-size", str(args.chunk_size)],
+                check=True,
+            )
+        finally:
+            os.unlink(db_path)
+
+if __name__ == "__main__":
+    main()
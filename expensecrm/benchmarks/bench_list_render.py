@@ -0,0 +1,86 @@
+"""Render time of the expense list with and without cached row fragments.
+
+    python benchmarks/bench_list_render.py --rows 1000
+
+Requests one page of ``--rows`` expenses through the test client with the
+fragment cache off (every row rendered), cold (rendered and stored) and
+warm (served from the cache), then in streaming mode, where it also
+reports the time to the first chunk. Times are the best of ``--repeat``
+requests, per 1k rows.
+"""
+import argparse
+import json
+import os
+import time
+
+import common
+
+
+def timed(client, url, params, repeat, before=None):
+    """Best milliseconds to the first chunk and to the whole body."""
+    first, full = [], []
+    for _ in range(repeat):
+        if before:
+            before()
+        started = time.perf_counter()
+        response = client.get(url, params)
+        if response.streaming:
+            chunks = iter(response.streaming_content)
+            next(chunks)
+            first.append(time.perf_counter() - started)
+            for _ in chunks:
+                pass
+        else:
+            first.append(time.perf_counter() - started)
+        full.append(time.perf_counter() - started)
+        assert response.status_code == 200, response.status_code
+    return min(first) * 1000, min(full) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1000, help="Expenses on the page")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    common.setup_django()
+    db_path = common.use_database()
+    try:
+        common.seed_expenses(args.rows * 2, users=1)
+        from django.conf import settings
+        from django.contrib.auth.models import User
+        from django.core.cache import caches
+        from django.test import Client
+
+        settings.EXPENSE_LIST_MAX_PAGE_SIZE = args.rows
+        # Room for every row of the page, whatever the configured size.
+        caches["fragments"]._max_entries = max(caches["fragments"]._max_entries, args.rows * 10)
+        client = Client()
+        client.force_login(User.objects.get(username="user1"))
+        url, params = "/", {"page_size": args.rows}
+        clear = caches["fragments"].clear
+        scale = 1000 / args.rows
+        modes = [
+            ("uncached", {"EXPENSES_FRAGMENT_CACHE": None}, None),
+            ("cold cache", {}, clear),
+            ("warm cache", {}, None),
+            ("streamed, uncached", {"EXPENSES_FRAGMENT_CACHE": None, "EXPENSE_LIST_STREAMING": True}, None),
+            ("streamed, warm cache", {"EXPENSE_LIST_STREAMING": True}, None),
+        ]
+        defaults = {"EXPENSES_FRAGMENT_CACHE": "fragments", "EXPENSE_LIST_STREAMING": False}
+        for name, overrides, before in modes:
+            for setting, value in dict(defaults, **overrides).items():
+                setattr(settings, setting, value)
+            client.get(url, params)
+            first_ms, full_ms = timed(client, url, params, args.repeat, before)
+            print(json.dumps({
+                "mode": name, "rows": args.rows,
+                "first_byte_ms_per_1k": round(first_ms * scale, 2),
+                "total_ms_per_1k": round(full_ms * scale, 2),
+            }))
+    finally:
+        os.unlink(db_path)
+
+
+if __name__ == "__main__":
+    main()
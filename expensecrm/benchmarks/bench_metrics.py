@@ -0,0 +1,87 @@
+"""Per-request cost of the metrics middleware.
+
+    python benchmarks/bench_metrics.py --rows 20000
+
+Times the same requests with ``MetricsMiddleware``, the query timer and the
+timed template backend switched off and on, alternating the two so drift
+in the machine affects both alike, and prints the median latency of each.
+"""
+import argparse
+import json
+import os
+
+import common
+
+TIMED_GET_TEMPLATE = None
+
+ENDPOINTS = {
+    "list": ("/", {}),
+    "summary": ("/summary/", {}),
+    "api list": ("/api/expenses/", {"page_size": 20}),
+}
+
+
+def configure(client, enabled):
+    from django.conf import settings
+    from django.db import connections
+    from django.template.backends.django import DjangoTemplates
+
+    from expenses import metrics
+
+    middleware = "expenses.middleware.MetricsMiddleware"
+    settings.MIDDLEWARE = [m for m in settings.MIDDLEWARE if m != middleware]
+    if enabled:
+        settings.MIDDLEWARE.insert(0, middleware)
+    client.handler.load_middleware()
+    for connection in connections.all():
+        if metrics.record_query in connection.execute_wrappers:
+            connection.execute_wrappers.remove(metrics.record_query)
+        if enabled:
+            metrics.install_query_timer(None, connection)
+    if enabled:
+        metrics.TimedTemplates.get_template = TIMED_GET_TEMPLATE
+    else:
+        metrics.TimedTemplates.get_template = DjangoTemplates.get_template
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    common.setup_django()
+    db_path = common.use_database()
+    try:
+        common.seed_expenses(args.rows)
+        from django.contrib.auth.models import User
+        from django.test import Client
+        from rest_framework.authtoken.models import Token
+
+        from expenses import metrics
+
+        global TIMED_GET_TEMPLATE
+        TIMED_GET_TEMPLATE = metrics.TimedTemplates.get_template
+        user = User.objects.get(username="user1")
+        client = Client(HTTP_AUTHORIZATION=f"Token {Token.objects.create(user=user).key}")
+        client.force_login(user)
+        for endpoint, (url, params) in ENDPOINTS.items():
+            medians = {False: [], True: []}
+            for _ in range(args.rounds):
+                for enabled in (False, True):
+                    configure(client, enabled)
+                    client.get(url, params)
+                    median, _ = common.timed_requests(client, url, repeat=args.repeat, **params)
+                    medians[enabled].append(median)
+            off, on = min(medians[False]), min(medians[True])
+            print(json.dumps({
+                "endpoint": endpoint, "off_ms": off, "on_ms": on,
+                "overhead_ms": round(on - off, 3), "overhead_pct": round((on - off) / off * 100, 1),
+            }))
+    finally:
+        os.unlink(db_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""Cost of reading a page of expenses as model instances and as rows.
+
+    python benchmarks/bench_rows.py --rows 500
+
+Reads ``--rows`` expenses the old way (``select_related`` model instances
+through ``ExpenseSerializer``) and through ``expenses.rows.expense_rows``
+with ``ExpenseRowSerializer``, checks both produce the same API payload,
+and prints the best time of ``--repeat`` runs for fetching alone and for
+fetching plus serializing, with the peak memory allocated by one run.
+"""
+import argparse
+import json
+import os
+import time
+import tracemalloc
+
+import common
+
+
+def best_ms(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return round(min(timings) * 1000, 2)
+
+
+def peak_kb(func):
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak // 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=500, help="Expenses per page")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    common.setup_django()
+    db_path = common.use_database()
+    try:
+        common.seed_expenses(args.rows * 2, users=1)
+        from django.contrib.auth.models import User
+        from expenses.models import Expense
+        from expenses.rows import expense_rows
+        from expenses.serializers import ExpenseRowSerializer, ExpenseSerializer
+
+        expenses = Expense.objects.for_user(User.objects.get(username="user1")).order_by("-date", "-id")
+        readers = {
+            "instances": (
+                lambda: list(expenses.select_related("category", "user")[: args.rows]),
+                ExpenseSerializer,
+            ),
+            "rows": (lambda: list(expense_rows(expenses)[: args.rows]), ExpenseRowSerializer),
+        }
+        payloads = {
+            name: json.dumps(serializer(fetch(), many=True).data, default=str)
+            for name, (fetch, serializer) in readers.items()
+        }
+        assert payloads["instances"] == payloads["rows"], "payloads differ"
+        for name, (fetch, serializer) in readers.items():
+            serialize = lambda: serializer(fetch(), many=True).data  # noqa: E731
+            print(json.dumps({
+                "read": name, "rows": args.rows,
+                "fetch_ms": best_ms(fetch, args.repeat),
+                "fetch_peak_kb": peak_kb(fetch),
+                "serialize_ms": best_ms(serialize, args.repeat),
+                "serialize_peak_kb": peak_kb(serialize),
+            }))
+    finally:
+        os.unlink(db_path)
+
+
+if __name__ == "__main__":
+    main()
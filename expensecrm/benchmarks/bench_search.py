@@ -0,0 +1,77 @@
+"""Compare indexed description search against the old ``icontains`` scan.
+
+    python benchmarks/bench_search.py --rows 100000 1000000
+
+For each table size, times the first page of results for a common word, a
+rare word and a three-letter prefix, once scoped to one user (the list
+view and API) and once across all users (the admin).
+"""
+import argparse
+import json
+import statistics
+import time
+from collections import Counter
+
+import common
+
+
+def median_ms(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - started) * 1000)
+    return round(statistics.median(timings), 2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[100000, 1000000])
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--page-size", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    common.setup_django()
+    db_path = common.use_database()
+    from django.contrib.auth.models import User
+    from expenses.models import Expense
+    from expenses.search import search
+
+    seeded = 0
+    for rows in sorted(args.rows):
+        common.seed_expenses(rows - seeded, users=args.users, seed=rows)
+        seeded = rows
+        user = User.objects.get(username="user1")
+        words = Counter(
+            word.strip(".").lower()
+            for text in Expense.objects.values_list("description", flat=True)[:5000]
+            for word in text.split()
+            if len(word) > 3
+        ).most_common()
+        terms = {"common": words[0][0], "rare": words[-1][0], "prefix": words[-1][0][:3]}
+        for kind, term in terms.items():
+            for scope, queryset, owner in (
+                ("user", Expense.objects.for_user(user), user),
+                ("all", Expense.objects.all(), None),
+            ):
+                indexed = search(queryset, term, user=owner)[: args.page_size + 1]
+                like = queryset.filter(description__icontains=term).order_by("-date", "-id")[
+                    : args.page_size + 1
+                ]
+                print(json.dumps({
+                    "rows": rows,
+                    "term": kind,
+                    "scope": scope,
+                    "matches": len(list(indexed)),
+                    "indexed_ms": median_ms(lambda: list(indexed.all()), args.repeat),
+                    "like_ms": median_ms(lambda: list(like.all()), args.repeat),
+                }))
+
+    import os
+
+    os.unlink(db_path)
+
+
+if __name__ == "__main__":
+    main()
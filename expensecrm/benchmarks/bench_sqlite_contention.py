@@ -0,0 +1,129 @@
+"""Concurrent writes and summary reads against SQLite, before and after tuning.
+
+    python benchmarks/bench_sqlite_contention.py --threads 4 16 --seconds 10
+
+Each thread loops like a request handler for a random user: it either saves
+an expense (which also upserts the rollup and bumps the data generation) or
+reads that user's category summary, then releases its connection the way
+``request_finished`` does. "stock" is Django's SQLite defaults (rollback
+journal, deferred transactions, a new connection per request); "tuned" is
+the ``DATABASES`` configuration from settings. Each prints operations per
+second, "database is locked" errors and p99 latency per operation type.
+"""
+import argparse
+import json
+import os
+import random
+import threading
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+
+import common
+
+STOCK = {"CONN_MAX_AGE": 0, "OPTIONS": {}}
+
+
+def worker(users, categories, deadline, write_ratio, seed, results):
+    from django.db import OperationalError, close_old_connections, connection
+
+    from expenses.models import Expense, ExpenseRollup
+    from expenses.rollups import category_totals
+
+    rng = random.Random(seed)
+    while time.monotonic() < deadline:
+        user = rng.choice(users)
+        kind = "write" if rng.random() < write_ratio else "read"
+        close_old_connections()
+        started = time.perf_counter()
+        try:
+            if kind == "write":
+                Expense.objects.create(
+                    user=user, category=rng.choice(categories), date=random_day(rng),
+                    description="Contention test", amount=Decimal(rng.randint(100, 9999)) / 100,
+                    payment_method="Card",
+                )
+            else:
+                list(category_totals(ExpenseRollup.objects.for_user(user)))
+        except OperationalError as exc:
+            if "locked" not in str(exc):
+                raise
+            results.append((kind, None))
+        else:
+            results.append((kind, time.perf_counter() - started))
+        finally:
+            close_old_connections()
+    connection.close()
+
+
+def random_day(rng):
+    return date(2024, 1, 1) + timedelta(days=rng.randrange(365))
+
+
+def run(config, threads, seconds, write_ratio, rows):
+    from django.conf import settings
+    from django.contrib.auth.models import User
+    from django.db import connections
+
+    from expenses.models import Category
+
+    settings_dict = connections["default"].settings_dict
+    settings_dict.update(config)
+    db_path = common.use_database()
+    try:
+        common.seed_expenses(rows)
+        users = list(User.objects.filter(username__startswith="user"))
+        categories = list(Category.objects.all())
+        connections.close_all()
+
+        results = []
+        deadline = time.monotonic() + seconds
+        pool = [
+            threading.Thread(target=worker, args=(users, categories, deadline, write_ratio, i, results))
+            for i in range(threads)
+        ]
+        started = time.perf_counter()
+        for thread in pool:
+            thread.start()
+        for thread in pool:
+            thread.join()
+        elapsed = time.perf_counter() - started
+    finally:
+        connections.close_all()
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(db_path + suffix):
+                os.unlink(db_path + suffix)
+
+    summary = {"ops_per_sec": round(sum(1 for _, t in results if t is not None) / elapsed, 1)}
+    for kind in ("write", "read"):
+        timings = sorted(t for k, t in results if k == kind and t is not None)
+        summary[f"{kind}s"] = len(timings)
+        summary[f"{kind}_locked"] = sum(1 for k, t in results if k == kind and t is None)
+        summary[f"{kind}_p99_ms"] = (
+            round(timings[max(0, int(len(timings) * 0.99) - 1)] * 1000, 1) if timings else None
+        )
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--threads", type=int, nargs="+", default=[4, 16])
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--write-ratio", type=float, default=0.3)
+    args = parser.parse_args()
+
+    common.setup_django()
+    from django.db import connections
+
+    tuned = {
+        key: connections["default"].settings_dict[key] for key in ("CONN_MAX_AGE", "OPTIONS")
+    }
+    for name, config in (("stock", STOCK), ("tuned", tuned)):
+        for threads in args.threads:
+            result = run(config, threads, args.seconds, args.write_ratio, args.rows)
+            print(json.dumps(dict({"config": name, "threads": threads}, **result)))
+
+
+if __name__ == "__main__":
+    main()
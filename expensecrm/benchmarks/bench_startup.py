@@ -0,0 +1,84 @@
+"""Cold start of a worker process under each settings profile.
+
+    python benchmarks/bench_startup.py --repeat 5
+
+Starts ``--repeat`` fresh interpreters per profile (``expensecrm.settings``
+and the API-only ``expensecrm.settings_api``). Each one builds the WSGI
+application and then sends a token-authenticated ``GET /api/expenses/``
+straight to it. The script prints the median time to import and set up
+Django, the first request's latency, the whole process's wall time and
+the number of modules loaded.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+PROFILES = ("expensecrm.settings", "expensecrm.settings_api")
+
+
+def child(token):
+    """Run in the measured process: set up, serve one request, report."""
+    started = time.perf_counter()
+    from django.core.wsgi import get_wsgi_application
+
+    application = get_wsgi_application()
+    ready = time.perf_counter()
+    from wsgiref.util import setup_testing_defaults
+
+    environ = {"PATH_INFO": "/api/expenses/", "HTTP_AUTHORIZATION": f"Token {token}", "HTTP_HOST": "localhost"}
+    setup_testing_defaults(environ)
+    statuses = []
+    body = b"".join(application(environ, lambda status, headers: statuses.append(status)))
+    assert statuses[0].startswith("200"), (statuses, body[:200])
+    done = time.perf_counter()
+    print(json.dumps({
+        "setup_ms": (ready - started) * 1000,
+        "first_request_ms": (done - ready) * 1000,
+        "modules": len(sys.modules),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        return child(args.child)
+
+    import common
+
+    common.setup_django()
+    db_path = common.use_database()
+    try:
+        common.seed_expenses(1000, users=1)
+        from django.contrib.auth.models import User
+        from rest_framework.authtoken.models import Token
+
+        token, _ = Token.objects.get_or_create(user=User.objects.get(username="user1"))
+        for profile in PROFILES:
+            env = dict(os.environ, DJANGO_SETTINGS_MODULE=profile, EXPENSECRM_DB_NAME=db_path)
+            runs = []
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                output = subprocess.run(
+                    [sys.executable, __file__, "--child", token.key],
+                    env=env, check=True, capture_output=True, text=True,
+                ).stdout
+                wall_ms = (time.perf_counter() - started) * 1000
+                runs.append(dict(json.loads(output), wall_ms=wall_ms))
+            print(json.dumps({
+                "profile": profile,
+                **{key: round(statistics.median(run[key] for run in runs), 1) for key in runs[0]},
+            }))
+    finally:
+        os.unlink(db_path)
+
+
+if __name__ == "__main__":
+    main()
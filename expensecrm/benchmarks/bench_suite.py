@@ -0,0 +1,217 @@
+"""Time the hot views and API endpoints and compare against a baseline.
+
+    python benchmarks/bench_suite.py --sizes 10000 100000 -o baseline.json
+    python benchmarks/bench_suite.py --sizes 10000 100000 --baseline baseline.json --threshold 25
+
+Each size is seeded reproducibly into its own throwaway SQLite file. Every
+case is then requested through the test client: once to warm up, once to
+count queries, once under ``tracemalloc`` for the peak memory allocated
+while serving it, and ``--repeat`` times for the median and p95 latency.
+Results are written as JSON. With ``--baseline`` the run exits with status
+1 when a case issues more queries than the baseline, or when its median
+latency or peak memory grows by more than ``--threshold`` percent and by
+more than ``--min-delta-ms`` or ``--min-delta-bytes``.
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+
+import common
+
+USERNAME = "user1"
+PASSWORD = "password"  # what seed_data gives every user
+BULK_DELETE_ROWS = 100
+
+
+class Case:
+    """One request to measure; ``prepare`` runs untimed before each one."""
+
+    def __init__(self, name, method, url, data=None, status=200, token=False, repeat=None):
+        self.name = name
+        self.method = method
+        self.url = url
+        self.data = data or {}
+        self.status = status
+        self.token = token
+        self.repeat = repeat
+
+    def prepare(self, user):
+        return self.data
+
+    def request(self, client, data):
+        response = getattr(client, self.method)(self.url, data)
+        assert response.status_code == self.status, (self.name, response.status_code)
+        if response.streaming:
+            b"".join(response.streaming_content)
+        return response
+
+
+class BulkDeleteCase(Case):
+    def prepare(self, user):
+        from expenses.models import Category, Expense
+
+        category = Category.objects.order_by("pk").first()
+        created = Expense.objects.bulk_create(
+            Expense(user=user, date="2024-01-01", category=category, amount="1.00",
+                    description="bench", payment_method="Cash")
+            for _ in range(BULK_DELETE_ROWS)
+        )
+        return {"selected_expenses": [expense.pk for expense in created]}
+
+
+CASES = [
+    Case("expense_list", "get", "/"),
+    Case("expense_list_search", "get", "/", {"q": "coffee"}),
+    Case("expense_summary", "get", "/summary/"),
+    BulkDeleteCase("expense_bulk_delete", "post", "/bulk-delete/", status=302),
+    Case("api_expense_list", "get", "/api/expenses/", {"page_size": 50}, token=True),
+    Case("api_expense_aggregate", "get", "/api/expenses/aggregate/",
+         dict(common.LAST_SEEDED_YEAR, interval="month"), token=True),
+    # Dominated by password hashing, which is slow on purpose.
+    Case("api_login", "post", "/api/login/", {"email": USERNAME, "password": PASSWORD}, repeat=5),
+]
+
+
+def measure(case, clients, user, repeat):
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    client = clients[case.token]
+    case.request(client, case.prepare(user))
+    data = case.prepare(user)
+    with CaptureQueriesContext(connection) as queries:
+        case.request(client, data)
+    query_count = len(queries)  # read before the next request resets the log
+
+    data = case.prepare(user)
+    tracemalloc.start()
+    try:
+        case.request(client, data)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    timings = []
+    for _ in range(case.repeat or repeat):
+        data = case.prepare(user)
+        started = time.perf_counter()
+        case.request(client, data)
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return {
+        "queries": query_count,
+        "median_ms": round(statistics.median(timings), 3),
+        # Nearest rank: the smallest timing at least 95% of them do not exceed.
+        "p95_ms": round(timings[math.ceil(0.95 * len(timings)) - 1], 3),
+        "peak_kb": round(peak / 1024, 1),
+    }
+
+
+def run(sizes, repeat, names):
+    common.setup_django()
+    from django.contrib.auth.models import User
+    from django.core.cache import caches
+    from django.db import connections
+    from django.test import Client
+    from rest_framework.authtoken.models import Token
+
+    results = {}
+    for size in sizes:
+        db_path = common.use_database()
+        try:
+            common.seed_expenses(size)
+            for cache in caches.all():
+                cache.clear()
+            user = User.objects.get(username=USERNAME)
+            session = Client()
+            session.force_login(user)
+            api = Client(HTTP_AUTHORIZATION=f"Token {Token.objects.create(user=user).key}")
+            for case in CASES:
+                if names and case.name not in names:
+                    continue
+                result = measure(case, {False: session, True: api}, user, repeat)
+                results[f"{size}/{case.name}"] = result
+                print(json.dumps(dict({"size": size, "case": case.name}, **result)), file=sys.stderr)
+        finally:
+            connections.close_all()
+            os.unlink(db_path)
+    return results
+
+
+def compare(results, baseline, threshold, min_delta_ms, min_delta_bytes):
+    """Regressions of ``results`` against ``baseline``, as readable lines."""
+    regressions = []
+    for key, result in sorted(results.items()):
+        before = baseline.get(key)
+        if before is None:
+            continue
+        if result["queries"] > before["queries"]:
+            regressions.append(f"{key}: {before['queries']} -> {result['queries']} queries")
+        limit = 1 + threshold / 100
+        slower = result["median_ms"] - before["median_ms"]
+        if result["median_ms"] > before["median_ms"] * limit and slower > min_delta_ms:
+            regressions.append(f"{key}: median {before['median_ms']} -> {result['median_ms']} ms")
+        grown = (result["peak_kb"] - before["peak_kb"]) * 1024
+        if result["peak_kb"] > before["peak_kb"] * limit and grown > min_delta_bytes:
+            regressions.append(f"{key}: peak memory {before['peak_kb']} -> {result['peak_kb']} KiB")
+    return regressions
+
+
+def environment():
+    import django
+    import sqlite3
+
+    return {
+        "python": platform.python_version(),
+        "django": django.get_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "machine": platform.machine(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000],
+                        help="Expense counts to seed, e.g. 10000 100000 1000000")
+    parser.add_argument("--cases", nargs="+", choices=[case.name for case in CASES])
+    parser.add_argument("--repeat", type=int, default=30)
+    parser.add_argument("-o", "--output", help="Write the results here instead of stdout")
+    parser.add_argument("--baseline", help="Results of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=20.0,
+                        help="Allowed growth of latency and memory, in percent")
+    parser.add_argument("--min-delta-ms", type=float, default=1.0,
+                        help="Ignore latency changes smaller than this")
+    parser.add_argument("--min-delta-bytes", type=int, default=64 * 1024,
+                        help="Ignore peak memory changes smaller than this")
+    args = parser.parse_args()
+
+    report = {"environment": environment(), "repeat": args.repeat,
+              "results": run(args.sizes, args.repeat, args.cases)}
+    text = json.dumps(report, indent=2, sort_keys=True) + "\n"
+    if args.output:
+        with open(args.output, "w") as output:
+            output.write(text)
+    else:
+        sys.stdout.write(text)
+
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            before = json.load(baseline)
+        if before.get("environment") != report["environment"]:
+            print("warning: baseline was recorded in a different environment", file=sys.stderr)
+        regressions = compare(report["results"], before["results"], args.threshold, args.min_delta_ms, args.min_delta_bytes)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions beyond {args.threshold}% against {args.baseline}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
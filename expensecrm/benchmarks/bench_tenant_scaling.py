@@ -0,0 +1,62 @@
+"""Show that one user's page latency does not grow with other tenants' data.
+
+    python benchmarks/bench_tenant_scaling.py --tenants 10 100 1000
+
+A fixed user owns ``--own-rows`` expenses; every step adds more tenants
+with ``--rows-per-tenant`` expenses each and times that user's list and
+summary pages.
+"""
+import argparse
+import json
+
+import common
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tenants", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--own-rows", type=int, default=2000)
+    parser.add_argument("--rows-per-tenant", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    common.setup_django()
+    db_path = common.use_database()
+    from django.contrib.auth.models import User
+    from django.test import Client
+    from django.urls import reverse
+    from expenses.models import Expense
+
+    common.seed_expenses(args.own_rows, users=1, username_prefix="owner")
+    client = Client()
+    client.force_login(User.objects.get(username="owner1"))
+
+    seeded = 0
+    for tenants in sorted(args.tenants):
+        # Tenants are seeded cumulatively: tenant<N> rows from earlier steps stay.
+        common.seed_expenses(
+            (tenants - seeded) * args.rows_per_tenant, users=tenants,
+            username_prefix="tenant", seed=tenants,
+        )
+        seeded = tenants
+        list_ms = common.timed_requests(client, reverse("expense_list"), args.repeat)
+        summary_ms = common.timed_requests(
+            client, reverse("expense_summary"), args.repeat, start_date="2000-01-01"
+        )
+        print(json.dumps({
+            "tenants": tenants,
+            "total_rows": Expense.objects.count(),
+            "own_rows": args.own_rows,
+            "list_median_ms": list_ms[0],
+            "list_max_ms": list_ms[1],
+            "summary_median_ms": summary_ms[0],
+            "summary_max_ms": summary_ms[1],
+        }))
+
+    import os
+
+    os.unlink(db_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""Queries and latency per API request with and without the token cache.
+
+    python benchmarks/bench_token_auth.py --rows 20000
+
+Runs the same token-authenticated requests through DRF's
+``TokenAuthentication`` and through ``CachedTokenAuthentication`` and prints
+the queries each request issues (and how many touch ``authtoken_token``)
+along with the median and worst latency.
+"""
+import argparse
+import json
+import os
+
+import common
+
+ENDPOINTS = {
+    "list": ("/api/expenses/", {"page_size": 20}),
+    "aggregate": ("/api/expenses/aggregate/", dict(common.LAST_SEEDED_YEAR, interval="month")),
+    "async list": ("/api/async/expenses/", {"page_size": 20}),
+}
+
+
+def queries_per_request(client, url, params):
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    client.get(url, params)  # warm the caches
+    with CaptureQueriesContext(connection) as queries:
+        response = client.get(url, params)
+    assert response.status_code == 200, response.status_code
+    return len(queries), sum(1 for query in queries if "authtoken_token" in query["sql"])
+
+
+class NoCache:
+    """Stands in for the token cache of the async views."""
+
+    def get(self, key):
+        return None
+
+    async def aget(self, key):
+        return None
+
+    def set(self, key, user):
+        pass
+
+    async def aset(self, key, user):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    common.setup_django()
+    db_path = common.use_database()
+    try:
+        common.seed_expenses(args.rows)
+        from django.contrib.auth.models import User
+        from rest_framework.authentication import TokenAuthentication
+        from rest_framework.authtoken.models import Token
+        from rest_framework.test import APIClient
+        from rest_framework.views import APIView
+
+        from expenses import async_views
+        from expenses.authentication import CachedTokenAuthentication
+        from expenses.cache import token_cache
+
+        token = Token.objects.create(user=User.objects.get(username="user1"))
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Token {token.key}")
+        original = async_views.token_cache
+        for name, auth_class in (("uncached", TokenAuthentication), ("cached", CachedTokenAuthentication)):
+            # Views copy the default authentication classes when the class is defined.
+            APIView.authentication_classes = [auth_class]
+            async_views.token_cache = original if auth_class is CachedTokenAuthentication else NoCache()
+            token_cache.clear()
+            for endpoint, (url, params) in ENDPOINTS.items():
+                total, auth = queries_per_request(client, url, params)
+                median, worst = common.timed_requests(client, url, repeat=args.repeat, **params)
+                print(json.dumps({
+                    "auth": name, "endpoint": endpoint, "queries": total, "token_queries": auth,
+                    "median_ms": median, "max_ms": worst,
+                }))
+    finally:
+        os.unlink(db_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""Shared setup for the scripts in this directory.
+
+Benchmarks run against throwaway SQLite files so they never touch the
+configured database. Import this module before any Django model.
+"""
+import io
+import os
+import resource
+import sys
+import tempfile
+from pathlib import Path
+
+PROJECT_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(PROJECT_DIR))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "expensecrm.settings")
+
+import django  # noqa: E402
+
+
+def setup_django():
+    from django.conf import settings
+
+    settings.ALLOWED_HOSTS = ["*"]
+    django.setup()
+
+
+def use_database(db_path=None, migrate=True):
+    """Switch the default connection to another SQLite file."""
+    from django.core.management import call_command
+    from django.db import connections
+
+    if db_path is None:
+        handle, db_path = tempfile.mkstemp(suffix=".sqlite3", prefix="bench-")
+        os.close(handle)
+    connections.close_all()
+    connections["default"].settings_dict["NAME"] = str(db_path)
+    if migrate:
+        call_command("migrate", verbosity=0)
+    return str(db_path)
+
+
+# The last year of what seed_expenses() inserts: seeded runs of seed_data end
+# on its SEED_END_DATE. Pass it to endpoints whose default range ends today.
+LAST_SEEDED_YEAR = {"start_date": "2024-01-01", "end_date": "2024-12-31"}
+
+
+def seed_expenses(count, users=10, categories=5, days=1460, seed=0, username_prefix="user"):
+    """Insert ``count`` reproducible expenses through ``seed_data``."""
+    from django.core.management import call_command
+
+    call_command(
+        "seed_data", expenses=count, users=users, categories=categories, days=days,
+        seed=seed, username_prefix=username_prefix, verbosity=0, stdout=io.StringIO(),
+    )
+
+
+def timed_requests(client, url, repeat=20, **params):
+    """Median and worst wall time in milliseconds of ``repeat`` GETs."""
+    import statistics
+    import time
+
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        response = client.get(url, params)
+        timings.append((time.perf_counter() - started) * 1000)
+        assert response.status_code == 200, response.status_code
+    return round(statistics.median(timings), 2), round(max(timings), 2)
+
+
+def peak_rss_kb():
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is bytes on macOS and kilobytes elsewhere.
+    return usage // 1024 if sys.platform == "darwin" else usage
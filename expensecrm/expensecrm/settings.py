@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -43,7 +44,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "expenses.middleware.MetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
+    "expensecrm.staticfiles.StaticFilesMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
@@ -56,7 +59,8 @@ ROOT_URLCONF = "expensecrm.urls"
 
 TEMPLATES = [
     {
-        "BACKEND": "django.template.backends.django.DjangoTemplates",
+        "BACKEND": "expenses.metrics.TimedTemplates",
+        "NAME": "django",
         "DIRS": [BASE_DIR / "templates"],
         "APP_DIRS": True,
         "OPTIONS": {
@@ -76,13 +80,83 @@ WSGI_APPLICATION = "expensecrm.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
-DATABASES = {
-    "default": {
-        "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "db.sqlite3",
-    }
+# Built from the environment: EXPENSECRM_DB_ENGINE ("sqlite", the default,
+# "postgresql" or a backend path) and EXPENSECRM_DB_NAME, _USER, _PASSWORD,
+# _HOST, _PORT and _CONN_MAX_AGE (seconds a connection is reused across
+# requests; 0 closes it after each). Setting EXPENSECRM_REPLICA_DB_NAME or
+# EXPENSECRM_REPLICA_DB_HOST adds a "replica" alias, configured by the same
+# variables with the REPLICA_ prefix and falling back to the primary's
+# values, that expenses.routers sends the list, summary, aggregation and
+# export reads to.
+#
+# expensecrm.sqlite_backend is the stock SQLite backend plus per-connection
+# pragmas and BEGIN IMMEDIATE transactions. WAL lets readers carry on while
+# one request writes, and busy_timeout makes writers queue for the lock
+# instead of failing with "database is locked". Each pragma can be
+# overridden with EXPENSECRM_SQLITE_<NAME>; "" keeps SQLite's default.
+SQLITE_OPTIONS = {
+    "transaction_mode": os.environ.get("EXPENSECRM_SQLITE_TRANSACTION_MODE", "IMMEDIATE"),
+    "pragmas": {
+        "journal_mode": os.environ.get("EXPENSECRM_SQLITE_JOURNAL_MODE", "wal"),
+        "synchronous": os.environ.get("EXPENSECRM_SQLITE_SYNCHRONOUS", "normal"),
+        "busy_timeout": os.environ.get("EXPENSECRM_SQLITE_BUSY_TIMEOUT", "5000"),
+        "mmap_size": os.environ.get("EXPENSECRM_SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)),
+        # Negative sizes are in KiB: a 64 MiB page cache per connection.
+        "cache_size": os.environ.get("EXPENSECRM_SQLITE_CACHE_SIZE", "-65536"),
+        "temp_store": os.environ.get("EXPENSECRM_SQLITE_TEMP_STORE", "memory"),
+    },
 }
 
+_ENGINES = {
+    "sqlite": "expensecrm.sqlite_backend",
+    "postgresql": "django.db.backends.postgresql",  # needs psycopg
+}
+
+
+def database_from_env(prefix, defaults):
+    """``(values, DATABASES entry)`` from ``{prefix}ENGINE``, ``{prefix}NAME``..."""
+    env = {key: os.environ.get(prefix + key, default) for key, default in defaults.items()}
+    engine = _ENGINES.get(env["ENGINE"], env["ENGINE"])
+    database = {
+        "ENGINE": engine,
+        "NAME": env["NAME"],
+        "CONN_MAX_AGE": int(env["CONN_MAX_AGE"]),
+        "CONN_HEALTH_CHECKS": True,
+    }
+    if engine == _ENGINES["sqlite"]:
+        database["OPTIONS"] = dict(SQLITE_OPTIONS)
+    else:
+        database.update(
+            USER=env["USER"], PASSWORD=env["PASSWORD"], HOST=env["HOST"], PORT=env["PORT"]
+        )
+    return env, database
+
+
+_primary_env, _primary = database_from_env(
+    "EXPENSECRM_DB_",
+    {
+        "ENGINE": "sqlite",
+        "NAME": str(BASE_DIR / "db.sqlite3"),
+        "USER": "",
+        "PASSWORD": "",
+        "HOST": "",
+        "PORT": "",
+        "CONN_MAX_AGE": "600",
+    },
+)
+DATABASES = {"default": _primary}
+if os.environ.get("EXPENSECRM_REPLICA_DB_NAME") or os.environ.get("EXPENSECRM_REPLICA_DB_HOST"):
+    _, DATABASES["replica"] = database_from_env("EXPENSECRM_REPLICA_DB_", _primary_env)
+    # Tests run against the primary only.
+    DATABASES["replica"]["TEST"] = {"MIRROR": "default"}
+
+DATABASE_ROUTERS = ["expenses.routers.PrimaryReplicaRouter"]
+
+# Aliases the hot read paths may use, and how long after a write a user
+# keeps reading from the primary. Keep it above the worst replica lag.
+EXPENSES_REPLICA_DATABASES = [alias for alias in DATABASES if alias != "default"]
+EXPENSES_REPLICA_STICKY_SECONDS = 10
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -121,6 +195,26 @@ STATIC_ROOT = BASE_DIR / 'staticfiles'
 STATIC_URL = "static/"
 STATICFILES_DIRS = [BASE_DIR / "static"]
 
+# The React frontend, built by "npm run build:django" in frontend/. Its files
+# are collected under static/frontend/ and its page is served at /app/.
+FRONTEND_DIST_DIR = Path(
+    os.environ.get("EXPENSECRM_FRONTEND_DIST_DIR", BASE_DIR.parent / "frontend" / "dist")
+)
+if FRONTEND_DIST_DIR.is_dir():
+    STATICFILES_DIRS.append(("frontend", FRONTEND_DIST_DIR))
+
+# collectstatic fingerprints file names and writes gzip (and, with the brotli
+# package, brotli) copies, which expensecrm.staticfiles.StaticFilesMiddleware
+# serves. Fingerprinted files are cached for a year; others for
+# STATIC_MAX_AGE seconds. Files under STATIC_IMMUTABLE_PREFIXES are
+# fingerprinted by their own build.
+STORAGES = {
+    "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"},
+    "staticfiles": {"BACKEND": "expensecrm.staticfiles.CompressedManifestStaticFilesStorage"},
+}
+STATIC_MAX_AGE = 60
+STATIC_IMMUTABLE_PREFIXES = ["frontend/assets/"]
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
@@ -128,7 +222,7 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": [
-        "rest_framework.authentication.TokenAuthentication",
+        "expenses.authentication.CachedTokenAuthentication",
     ],
     "DEFAULT_PERMISSION_CLASSES": [
         "rest_framework.permissions.IsAuthenticated",
@@ -138,3 +232,122 @@ REST_FRAMEWORK = {
 LOGIN_URL = "login"
 LOGIN_REDIRECT_URL = "/"
 LOGOUT_REDIRECT_URL = "login"
+
+# Expense list keyset pagination
+EXPENSE_LIST_PAGE_SIZE = 50
+EXPENSE_LIST_MAX_PAGE_SIZE = 500
+# Send the list page as a streamed response, flushing rows as they render.
+EXPENSE_LIST_STREAMING = False
+
+# The admin changelist shows an estimated count, not COUNT(*), for an
+# unfiltered table larger than this.
+EXPENSE_ADMIN_EXACT_COUNT_LIMIT = 100000
+
+# Maximum number of expenses accepted by one bulk API request
+EXPENSE_API_BULK_LIMIT = 1000
+
+# Bulk edit/delete: ids accepted per action, and ids per UPDATE/DELETE
+# statement (SQLite allows 32766 parameters, older builds only 999).
+EXPENSE_BULK_MAX_IDS = 100000
+EXPENSE_BULK_CHUNK_SIZE = 500
+
+# Background jobs, run by "manage.py run_workers". The HTML bulk delete and
+# import hand work above these sizes to a job; the API does when a request
+# passes "background": true.
+EXPENSE_BULK_BACKGROUND_IDS = 5000
+EXPENSE_IMPORT_BACKGROUND_BYTES = 1024 * 1024
+EXPENSES_JOB_PROCESSES = 2
+EXPENSES_JOB_MAX_ATTEMPTS = 3
+# Seconds before the first retry; doubled for each further attempt.
+EXPENSES_JOB_RETRY_DELAY = 10
+# Seconds without a heartbeat before a running job counts as abandoned.
+EXPENSES_JOB_TIMEOUT = 300
+EXPENSES_JOB_RETENTION_DAYS = 7
+EXPENSES_JOB_LIST_LIMIT = 50
+# Uploads waiting to be imported and finished exports.
+EXPENSES_JOB_FILES_DIR = os.environ.get("EXPENSECRM_JOB_FILES_DIR", str(BASE_DIR / "job_files"))
+
+# Receipt checks ("manage.py check_receipts", or a job queued by run_workers
+# every EXPENSES_RECEIPT_CHECK_INTERVAL seconds; None turns that off).
+# Receipts are stored in EXPENSES_RECEIPT_DIR under their SHA-256; set
+# EXPENSES_RECEIPT_ACCEL_REDIRECT to an internal nginx location aliasing it
+# to have nginx send the files.
+EXPENSES_RECEIPT_DIR = os.environ.get("EXPENSECRM_RECEIPT_DIR", str(BASE_DIR / "receipts"))
+EXPENSES_RECEIPT_ACCEL_REDIRECT = os.environ.get("EXPENSECRM_RECEIPT_ACCEL_REDIRECT", "")
+EXPENSES_RECEIPT_CHECK_INTERVAL = 3600
+# Downloads in flight at once, and at once from one host.
+EXPENSES_RECEIPT_CONCURRENCY = 16
+EXPENSES_RECEIPT_PER_HOST = 4
+EXPENSES_RECEIPT_TIMEOUT = 15
+EXPENSES_RECEIPT_MAX_BYTES = 10 * 1024 * 1024
+EXPENSES_RECEIPT_BATCH_SIZE = 500
+EXPENSES_RECEIPT_RECHECK_DAYS = 7
+# Seconds before a broken link is tried again; doubled for each failure.
+EXPENSES_RECEIPT_RETRY_DELAY = 3600
+EXPENSES_RECEIPT_THUMBNAIL_SIZE = (320, 320)
+# Links resolving to loopback or private addresses are refused, so users
+# can't make the server fetch from the internal network.
+EXPENSES_RECEIPT_ALLOW_PRIVATE = False
+
+# "default" holds the aggregates and summaries. Expense list rows get their
+# own alias so that rendering a large page cannot evict them, and so that
+# it can be sized in rows: each entry is one expense (a table row and a
+# card, about 1.5 KB), so the default 20000 entries hold 40 pages of 500
+# rows in about 30 MB per process. Local memory is per process; point the
+# aliases at Redis or Memcached to share them between workers. "tokens" must
+# be shared for token revocation to reach every worker.
+EXPENSES_FRAGMENT_CACHE_ENTRIES = int(os.environ.get("EXPENSECRM_FRAGMENT_CACHE_ENTRIES", "20000"))
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "default",
+    },
+    "fragments": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "fragments",
+        "OPTIONS": {"MAX_ENTRIES": EXPENSES_FRAGMENT_CACHE_ENTRIES},
+    },
+    "tokens": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "tokens",
+        # 10000 tokens: each is stored with a pointer from its user.
+        "OPTIONS": {"MAX_ENTRIES": 20000},
+    },
+}
+
+# Category cache: name a CACHES alias to share invalidations between
+# processes; without one each process's copy expires after the timeout.
+EXPENSES_CATEGORY_CACHE = None
+EXPENSES_CATEGORY_CACHE_TIMEOUT = 300
+
+# Token -> user cache for API authentication. Deleting a token or
+# deactivating a user drops the entry from the "tokens" alias, so every
+# process sharing that alias stops accepting it at once. None keeps a
+# per-process LRU of EXPENSES_TOKEN_CACHE_SIZE entries instead, which is only
+# safe with a single process: elsewhere a revoked token keeps working until
+# EXPENSES_TOKEN_CACHE_TIMEOUT.
+EXPENSES_TOKEN_CACHE = "tokens"
+EXPENSES_TOKEN_CACHE_SIZE = 10000
+EXPENSES_TOKEN_CACHE_TIMEOUT = 300
+
+# Cache for per-user aggregates, keyed on the user's data generation.
+EXPENSES_AGGREGATE_CACHE = "default"
+EXPENSES_AGGREGATE_CACHE_TIMEOUT = 3600
+
+# Rendered expense list rows, keyed on the expense and the owner's data
+# generation. None renders every row on every request.
+EXPENSES_FRAGMENT_CACHE = "fragments"
+EXPENSES_FRAGMENT_CACHE_TIMEOUT = 3600
+
+# Longest series the aggregation API returns, e.g. ~5 years of days
+EXPENSE_AGGREGATE_MAX_PERIODS = 2000
+
+# Request metrics at /metrics: staff users or "Authorization: Bearer <token>"
+# may read them. Requests slower than EXPENSES_SLOW_REQUEST_SECONDS are
+# logged to "expenses.slow_requests" with their slowest queries.
+EXPENSES_METRICS_TOKEN = os.environ.get("EXPENSECRM_METRICS_TOKEN", "")
+EXPENSES_SLOW_REQUEST_SECONDS = float(os.environ.get("EXPENSECRM_SLOW_REQUEST_SECONDS", "1.0"))
+EXPENSES_SLOW_REQUEST_QUERIES = 5
+
+# Text search configuration used for the PostgreSQL full-text index
+EXPENSE_SEARCH_CONFIG = "english"
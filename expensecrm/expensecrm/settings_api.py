@@ -0,0 +1,32 @@
+"""Settings for processes that only serve the JSON API.
+
+Start API workers with ``DJANGO_SETTINGS_MODULE=expensecrm.settings_api``.
+Everything comes from ``expensecrm.settings`` except that the admin,
+sessions, messages and static files apps, the middleware only the HTML
+pages need and the browsable API renderer are left out, so a cold worker
+imports and sets up less. Clients authenticate with ``Authorization:
+Token ...``; ``/metrics`` takes its bearer token.
+"""
+from .settings import *  # noqa: F401,F403
+from .settings import INSTALLED_APPS, REST_FRAMEWORK
+
+HTML_ONLY_APPS = {
+    "django.contrib.admin",
+    "django.contrib.sessions",
+    "django.contrib.messages",
+    "django.contrib.staticfiles",
+}
+INSTALLED_APPS = [app for app in INSTALLED_APPS if app not in HTML_ONLY_APPS]
+
+MIDDLEWARE = [
+    "expenses.middleware.MetricsMiddleware",
+    "django.middleware.security.SecurityMiddleware",
+    "django.middleware.common.CommonMiddleware",
+]
+
+ROOT_URLCONF = "expensecrm.urls_api"
+
+REST_FRAMEWORK = dict(
+    REST_FRAMEWORK,
+    DEFAULT_RENDERER_CLASSES=["rest_framework.renderers.JSONRenderer"],
+)
@@ -0,0 +1,62 @@
+"""SQLite backend tuned for a web server with concurrent writers.
+
+Identical to ``django.db.backends.sqlite3`` except for two extra keys in
+``DATABASES[...]["OPTIONS"]``:
+
+``pragmas``
+    A mapping of ``PRAGMA`` names to values applied to every new connection,
+    e.g. ``{"journal_mode": "wal", "busy_timeout": 5000}``. ``None`` skips a
+    pragma.
+
+``transaction_mode``
+    ``"DEFERRED"`` (SQLite's default), ``"IMMEDIATE"`` or ``"EXCLUSIVE"``.
+    A deferred transaction that reads before it writes has to upgrade its
+    lock, and SQLite fails that upgrade with "database is locked" straight
+    away instead of waiting out ``busy_timeout``. ``IMMEDIATE`` takes the
+    write lock at ``BEGIN``, where the timeout applies.
+"""
+import re
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.sqlite3 import base
+
+PRAGMA_NAME_RE = re.compile(r"^[a-z_]+$")
+PRAGMA_VALUE_RE = re.compile(r"^(-?\d+|[A-Za-z_]+)$")
+TRANSACTION_MODES = ("DEFERRED", "IMMEDIATE", "EXCLUSIVE")
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def get_connection_params(self):
+        kwargs = super().get_connection_params()
+        kwargs.pop("pragmas", None)
+        kwargs.pop("transaction_mode", None)
+        return kwargs
+
+    @property
+    def pragmas(self):
+        pragmas = []
+        for name, value in (self.settings_dict["OPTIONS"].get("pragmas") or {}).items():
+            if value is None or value == "":
+                continue
+            value = str(value)
+            if not PRAGMA_NAME_RE.match(name) or not PRAGMA_VALUE_RE.match(value):
+                raise ImproperlyConfigured(f"Invalid SQLite pragma: {name} = {value!r}")
+            pragmas.append((name, value))
+        return pragmas
+
+    @property
+    def transaction_mode(self):
+        mode = (self.settings_dict["OPTIONS"].get("transaction_mode") or "DEFERRED").upper()
+        if mode not in TRANSACTION_MODES:
+            raise ImproperlyConfigured(f"Invalid SQLite transaction_mode: {mode!r}")
+        return mode
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for name, value in self.pragmas:
+            # journal_mode answers with a row; fetch it so the statement completes.
+            conn.execute(f"PRAGMA {name} = {value}").fetchall()
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute(f"BEGIN {self.transaction_mode}")
@@ -0,0 +1,188 @@
+"""Fingerprinted, precompressed static files.
+
+``CompressedManifestStaticFilesStorage`` is Django's manifest storage (file
+names carry a hash of their content, and ``{% static %}`` looks them up in
+``staticfiles.json``) that also writes a ``.gz`` copy of every text file
+during ``collectstatic``, and a ``.br`` copy when the ``brotli`` package is
+installed.
+
+``StaticFilesMiddleware`` serves ``STATIC_ROOT`` from the application
+server for deployments without a web server in front of it. It picks the
+smallest variant the client accepts. Fingerprinted names are cached for a
+year as ``immutable``, as is anything under ``STATIC_IMMUTABLE_PREFIXES``
+(the frontend bundle, which Vite fingerprints itself); other names for
+``STATIC_MAX_AGE`` seconds. Behind nginx, serve ``STATIC_ROOT`` with
+``gzip_static on`` (and ``brotli_static on``) instead.
+"""
+import gzip
+import mimetypes
+import os
+from pathlib import Path
+from urllib.parse import urlsplit
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.files.base import ContentFile
+from django.http import FileResponse
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_EXTENSIONS = {
+    ".css", ".js", ".mjs", ".map", ".json", ".svg", ".html", ".txt", ".xml", ".ico", ".webmanifest",
+}
+# Smaller files gain less than the extra request headers cost.
+MIN_COMPRESS_SIZE = 256
+IMMUTABLE = "public, max-age=31536000, immutable"
+# Preferred first.
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+
+def compressed_variants(data):
+    """``{suffix: bytes}`` of the encodings worth keeping for ``data``."""
+    variants = {".gz": gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants[".br"] = brotli.compress(data, quality=11)
+    # Keep a variant only if it saves at least 5%.
+    return {suffix: body for suffix, body in variants.items() if len(body) < len(data) * 0.95}
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    def stored_name(self, name):
+        # Before the first collectstatic (development, tests) there is no
+        # manifest to look fingerprinted names up in.
+        if not self.hashed_files and not self.exists(self.manifest_name):
+            return name
+        return super().stored_name(name)
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+        names = set(paths) | set(self.hashed_files.values())
+        for name in sorted(names):
+            if Path(name).suffix.lower() not in COMPRESSIBLE_EXTENSIONS or not self.exists(name):
+                continue
+            with self.open(name) as source:
+                data = source.read()
+            if len(data) < MIN_COMPRESS_SIZE:
+                continue
+            for suffix, body in compressed_variants(data).items():
+                self.delete(name + suffix)
+                self._save(name + suffix, ContentFile(body))
+                yield name, name + suffix, True
+
+
+def accepted_encodings(header):
+    """Codings named in an ``Accept-Encoding`` header, less those with ``q=0``."""
+    accepted = set()
+    for part in header.split(","):
+        coding, *params = part.split(";")
+        quality = 1.0
+        for param in params:
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if quality > 0:
+            accepted.add(coding.strip().lower())
+    return accepted
+
+
+class StaticFile:
+    __slots__ = ("path", "content_type", "encodings", "cache_control")
+
+    def __init__(self, path, cache_control):
+        self.path = path
+        self.content_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        self.encodings = [
+            (coding, path + suffix) for coding, suffix in ENCODINGS if os.path.exists(path + suffix)
+        ]
+        self.cache_control = cache_control
+
+    def response(self, accept_encoding):
+        accepted = accepted_encodings(accept_encoding) if self.encodings else ()
+        for coding, path in self.encodings:
+            if coding in accepted:
+                response = FileResponse(open(path, "rb"), content_type=self.content_type)
+                response["Content-Encoding"] = coding
+                break
+        else:
+            response = FileResponse(open(self.path, "rb"), content_type=self.content_type)
+        if self.encodings:
+            response["Vary"] = "Accept-Encoding"
+        response["Cache-Control"] = self.cache_control
+        return response
+
+
+def index_static_root(root, url_prefix, immutable_names):
+    """``{url path: StaticFile}`` for every collected file under ``root``."""
+    files = {}
+    short = f"public, max-age={settings.STATIC_MAX_AGE}"
+    immutable_prefixes = tuple(settings.STATIC_IMMUTABLE_PREFIXES)
+    for directory, _, names in os.walk(root):
+        for filename in names:
+            if filename.endswith((".gz", ".br")):
+                continue
+            path = os.path.join(directory, filename)
+            name = Path(os.path.relpath(path, root)).as_posix()
+            immutable = name in immutable_names or name.startswith(immutable_prefixes)
+            cache_control = IMMUTABLE if immutable else short
+            files[url_prefix + name] = StaticFile(path, cache_control)
+    return files
+
+
+def fingerprinted_names(storage):
+    """Collected names that carry a content hash, from the storage's manifest."""
+    hashed = getattr(storage, "hashed_files", None) or {}
+    return {stored for original, stored in hashed.items() if stored != original}
+
+
+class StaticFilesMiddleware:
+    """Serve collected static files; put it right after ``SecurityMiddleware``.
+
+    The file list is read once at startup, so restart after collectstatic.
+    Unused when ``STATIC_ROOT`` has not been collected.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        from django.contrib.staticfiles.storage import staticfiles_storage
+
+        root = settings.STATIC_ROOT
+        if not root or not os.path.isdir(root):
+            raise MiddlewareNotUsed
+        prefix = urlsplit(settings.STATIC_URL).path
+        self.prefix = prefix if prefix.startswith("/") else "/" + prefix
+        self.files = index_static_root(root, self.prefix, fingerprinted_names(staticfiles_storage))
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def find(self, request):
+        if request.method not in ("GET", "HEAD") or not request.path_info.startswith(self.prefix):
+            return None
+        return self.files.get(request.path_info)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        static_file = self.find(request)
+        if static_file is not None:
+            return static_file.response(request.headers.get("Accept-Encoding", ""))
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        static_file = self.find(request)
+        if static_file is not None:
+            return static_file.response(request.headers.get("Accept-Encoding", ""))
+        return await self.get_response(request)
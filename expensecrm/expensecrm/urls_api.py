@@ -0,0 +1,6 @@
+"""URLs of the API-only profile (``expensecrm.settings_api``)."""
+from django.urls import include, path
+
+urlpatterns = [
+    path('', include('expenses.api_urls')),
+]
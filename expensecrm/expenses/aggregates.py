@@ -0,0 +1,182 @@
+"""Time-series aggregation of the ``ExpenseRollup`` table for dashboard charts.
+
+Buckets are calendar dates, like ``Expense.date``; the project time zone
+decides which day is "today" when no range is given. Every period in the
+range appears in the result, with zeros where nothing was spent.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import F, Sum
+from django.db.models.functions import TruncDay, TruncMonth, TruncWeek
+from django.utils import timezone
+
+from .filters import parse_expense_filters
+from .rollups import from_cents
+
+INTERVALS = {"day": TruncDay, "week": TruncWeek, "month": TruncMonth}
+
+# group_by -> (key lookup, label lookup)
+GROUPS = {
+    "category": ("category_id", "category__name"),
+    "payment_method": ("payment_method", "payment_method"),
+    "user": ("user_id", "user__username"),
+}
+
+
+def period_start(day, interval):
+    if interval == "week":
+        return day - timedelta(days=day.weekday())
+    if interval == "month":
+        return day.replace(day=1)
+    return day
+
+
+def next_period(start, interval):
+    if interval == "week":
+        return start + timedelta(days=7)
+    if interval == "month":
+        return (start + timedelta(days=32)).replace(day=1)
+    return start + timedelta(days=1)
+
+
+def periods(start, end, interval):
+    current = period_start(start, interval)
+    while current <= end:
+        yield current
+        current = next_period(current, interval)
+
+
+def parse_aggregate_params(params):
+    """Clean ``interval``, ``group_by`` and the usual expense filters.
+
+    Without dates the range is the year up to today in the project time zone.
+    """
+    filters = parse_expense_filters(params)
+    interval = params.get("interval") or None
+    if interval is not None and interval not in INTERVALS:
+        raise ValidationError(f"Invalid interval: {interval!r}")
+    group_by = params.get("group_by") or None
+    if group_by is not None and group_by not in GROUPS:
+        raise ValidationError(f"Invalid group_by: {group_by!r}")
+    end = filters.setdefault("end_date", timezone.localdate())
+    start = filters.setdefault("start_date", end - timedelta(days=365))
+    if start > end:
+        raise ValidationError("start_date must not be after end_date")
+    if interval is not None:
+        count = sum(1 for _ in periods(start, end, interval))
+        if count > settings.EXPENSE_AGGREGATE_MAX_PERIODS:
+            raise ValidationError(
+                f"At most {settings.EXPENSE_AGGREGATE_MAX_PERIODS} periods per request"
+            )
+    return filters, interval, group_by
+
+
+def grouped_rows(rollups, filters, interval=None, group_by=None):
+    """The filtered rollup queryset and its ``values()`` grouping.
+
+    The grouping is ``None`` when there is nothing to group by; the caller
+    then aggregates the filtered queryset as a whole.
+    """
+    rollups = rollups.filter(day__gte=filters["start_date"], day__lte=filters["end_date"])
+    if "category" in filters:
+        rollups = rollups.filter(category_id=filters["category"])
+
+    columns = {}
+    if group_by is not None:
+        key, label = GROUPS[group_by]
+        columns.update(key=F(key), label=F(label))
+    if interval is not None:
+        columns["period"] = INTERVALS[interval]("day")
+    if not columns:
+        return rollups, None
+    return rollups, (
+        rollups.values(**columns)
+        .annotate(cents=Sum("total_cents"), n=Sum("count"))
+        .filter(n__gt=0)
+        .order_by()
+    )
+
+
+def aggregate(rollups, filters, interval=None, group_by=None):
+    """Totals of ``rollups`` per ``group_by`` value and, optionally, per period.
+
+    Returns one series per group (a single ``"All"`` series without
+    ``group_by``). With an ``interval`` each series also carries ``totals``
+    and ``counts`` lists aligned with the returned ``periods``.
+    """
+    rollups, rows = grouped_rows(rollups, filters, interval, group_by)
+    if rows is None:
+        rows = [rollups.aggregate(cents=Sum("total_cents"), n=Sum("count"))]
+    return build_payload(rows, filters, interval, group_by)
+
+
+async def aaggregate(rollups, filters, interval=None, group_by=None):
+    rollups, rows = grouped_rows(rollups, filters, interval, group_by)
+    if rows is None:
+        rows = [await rollups.aaggregate(cents=Sum("total_cents"), n=Sum("count"))]
+    else:
+        rows = [row async for row in rows]
+    return build_payload(rows, filters, interval, group_by)
+
+
+def amount(cents):
+    # A decimal string, like every other amount the API returns; JSON
+    # numbers would pass through binary floats.
+    return str(from_cents(cents))
+
+
+def build_payload(rows, filters, interval, group_by):
+    buckets = list(periods(filters["start_date"], filters["end_date"], interval)) if interval else []
+    index = {period: i for i, period in enumerate(buckets)}
+    series = {}
+    for row in rows:
+        if not row["n"]:
+            continue
+        key = row.get("key")
+        entry = series.get(key)
+        if entry is None:
+            entry = series[key] = {
+                "key": key,
+                "label": row.get("label", "All"),
+                "total_cents": 0,
+                "count": 0,
+            }
+            if interval:
+                entry["cents"] = [0] * len(buckets)
+                entry["counts"] = [0] * len(buckets)
+        entry["total_cents"] += row["cents"]
+        entry["count"] += row["n"]
+        if interval:
+            i = index[row["period"]]
+            entry["cents"][i] += row["cents"]
+            entry["counts"][i] += row["n"]
+
+    if not series and group_by is None:
+        series[None] = {"key": None, "label": "All", "total_cents": 0, "count": 0}
+        if interval:
+            series[None].update(cents=[0] * len(buckets), counts=[0] * len(buckets))
+    result = []
+    for entry in sorted(series.values(), key=lambda entry: -entry["total_cents"]):
+        item = {
+            "key": entry["key"],
+            "label": entry["label"],
+            "total": amount(entry["total_cents"]),
+            "count": entry["count"],
+        }
+        if interval:
+            item["totals"] = [amount(cents) for cents in entry["cents"]]
+            item["counts"] = entry["counts"]
+        result.append(item)
+
+    payload = {
+        "interval": interval,
+        "group_by": group_by,
+        "start_date": filters["start_date"].isoformat(),
+        "end_date": filters["end_date"].isoformat(),
+        "series": result,
+    }
+    if interval:
+        payload["periods"] = [period.isoformat() for period in buckets]
+    return payload
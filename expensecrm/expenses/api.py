@@ -1,9 +1,35 @@
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from rest_framework import status
+from rest_framework import generics, permissions, status
+from rest_framework.exceptions import ValidationError
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
 from django.contrib.auth.models import User
 from django.contrib.auth import authenticate
-from rest_framework.authtoken.models import Token
+from django.http import FileResponse, Http404
+from django.shortcuts import get_object_or_404
+from . import bulk, generations, jobs, receipts
+from .aggregates import aggregate, parse_aggregate_params
+from .authentication import issue_token
+from .cache import category_cache, token_cache
+from .models import Category, Expense, ExpenseRollup, Job
+from .pagination import ExpenseKeysetPagination
+from .routers import replica_reads
+from .rows import expense_rows
+from .search import search
+from .serializers import (
+    BulkDeleteSerializer,
+    BulkEditSerializer,
+    CategorySerializer,
+    ExpenseRowSerializer,
+    ExpenseSerializer,
+    ExportJobSerializer,
+    JobSerializer,
+    ReceiptLinkSerializer,
+    category_errors,
+)
 
 class SignupAPIView(APIView):
     permission_classes = []
@@ -16,8 +42,7 @@ class SignupAPIView(APIView):
         if User.objects.filter(username=email).exists():
             return Response({"error": "User already exists"}, status=status.HTTP_400_BAD_REQUEST)
         user = User.objects.create_user(username=email, email=email, password=password)
-        token, created = Token.objects.get_or_create(user=user)
-        return Response({"token": token.key, "user": {"id": user.id, "email": user.username, "name": user.username}}, status=status.HTTP_201_CREATED)
+        return Response({"token": issue_token(user, created=True), "user": {"id": user.id, "email": user.username, "name": user.username}}, status=status.HTTP_201_CREATED)
 
 class LoginAPIView(APIView):
     permission_classes = []
@@ -27,7 +52,256 @@ class LoginAPIView(APIView):
         password = request.data.get("password")
         user = authenticate(username=email, password=password)
         if user is not None:
-            token, created = Token.objects.get_or_create(user=user)
-            return Response({"token": token.key, "user": {"id": user.id, "email": user.username, "name": user.username}})
+            return Response({"token": issue_token(user), "user": {"id": user.id, "email": user.username, "name": user.username}})
         return Response({"error": "Invalid credentials"}, status=status.HTTP_400_BAD_REQUEST)
 
+class ExpenseFieldsMixin:
+    """Honour ``?fields=a,b`` on read requests."""
+
+    def get_serializer(self, *args, **kwargs):
+        fields = self.request.query_params.get("fields")
+        if fields and self.request.method == "GET":
+            kwargs["fields"] = [name.strip() for name in fields.split(",") if name.strip()]
+        return super().get_serializer(*args, **kwargs)
+
+
+@method_decorator(replica_reads, name="get")
+class ExpenseListCreateAPIView(ExpenseFieldsMixin, generics.ListCreateAPIView):
+    serializer_class = ExpenseSerializer
+    pagination_class = ExpenseKeysetPagination
+
+    def get_serializer_class(self):
+        return ExpenseRowSerializer if self.request.method == "GET" else ExpenseSerializer
+
+    def get_queryset(self):
+        expenses = Expense.objects.for_user(self.request.user)
+        if self.request.method != "GET":
+            return expenses.select_related("category")
+        self.search_text = self.request.query_params.get("q", "").strip()
+        if self.search_text:
+            expenses = search(expenses, self.search_text, user=self.request.user)
+        return expense_rows(expenses)
+
+    def perform_create(self, serializer):
+        serializer.save(user=self.request.user)
+
+
+class ExpenseDetailAPIView(ExpenseFieldsMixin, generics.RetrieveUpdateDestroyAPIView):
+    serializer_class = ExpenseSerializer
+
+    def get_queryset(self):
+        return Expense.objects.for_user(self.request.user).select_related("category")
+
+
+class ExpenseReceiptAPIView(APIView):
+    """The last check of the expense's receipt link and the stored file."""
+
+    def get(self, request, pk):
+        expense = get_object_or_404(Expense.objects.for_user(request.user), pk=pk)
+        link = receipts.link_for(expense.receipt_link)
+        if link is None:
+            raise Http404
+        return Response(ReceiptLinkSerializer(link).data)
+
+
+class ReceiptFileAPIView(APIView):
+    def get(self, request, sha256, thumbnail=False):
+        return receipts.receipt_response(request, sha256, thumbnail)
+
+
+def bulk_target(serializer):
+    return {name: serializer.validated_data[name] for name in ("ids", "filter") if name in serializer.validated_data}
+
+
+def job_accepted(job):
+    data = JobSerializer(job).data
+    return Response({"job": data}, status=status.HTTP_202_ACCEPTED, headers={"Location": data["status_url"]})
+
+
+class ExpenseBulkAPIView(APIView):
+    """Create, update or delete many expenses in one request and transaction."""
+
+    def get_items(self, request):
+        items = request.data
+        if not isinstance(items, list) or not items:
+            raise ValidationError({"error": "Expected a non-empty list of expenses"})
+        if len(items) > settings.EXPENSE_API_BULK_LIMIT:
+            raise ValidationError(
+                {"error": f"At most {settings.EXPENSE_API_BULK_LIMIT} expenses per request"}
+            )
+        return items
+
+    def get_serializer_context(self):
+        return {"request": self.request, "categories": category_cache.by_id()}
+
+    def post(self, request):
+        serializer = ExpenseSerializer(
+            data=self.get_items(request), many=True, context=self.get_serializer_context()
+        )
+        serializer.is_valid(raise_exception=True)
+        with category_errors():
+            expenses = Expense.objects.bulk_create(
+                Expense(user=request.user, **item) for item in serializer.validated_data
+            )
+        return Response(ExpenseSerializer(expenses, many=True).data, status=status.HTTP_201_CREATED)
+
+    def patch(self, request):
+        items = self.get_items(request)
+        try:
+            ids = [int(item["id"]) for item in items]
+        except (KeyError, TypeError, ValueError):
+            raise ValidationError({"error": "Every expense needs an integer id"})
+        expenses = (
+            Expense.objects.for_user(request.user).select_related("category").in_bulk(ids)
+        )
+        missing = sorted(set(ids) - set(expenses))
+        if missing:
+            return Response({"error": "Expenses not found", "ids": missing}, status=status.HTTP_404_NOT_FOUND)
+
+        context = self.get_serializer_context()
+        errors, fields = [], set()
+        for pk, item in zip(ids, items):
+            serializer = ExpenseSerializer(expenses[pk], data=item, partial=True, context=context)
+            if serializer.is_valid():
+                for name, value in serializer.validated_data.items():
+                    setattr(expenses[pk], name, value)
+                fields.update(serializer.validated_data)
+                errors.append({})
+            else:
+                errors.append(serializer.errors)
+        if any(errors):
+            return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+        if fields:
+            with category_errors():
+                Expense.objects.bulk_update(expenses.values(), sorted(fields))
+        return Response(ExpenseSerializer(expenses.values(), many=True).data)
+
+    def delete(self, request):
+        serializer = BulkDeleteSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        if serializer.validated_data["background"]:
+            return job_accepted(jobs.enqueue("bulk_delete", request.user, **bulk_target(serializer)))
+        deleted = bulk.bulk_delete(
+            Expense.objects.for_user(request.user),
+            ids=serializer.validated_data.get("ids"),
+            filters=serializer.validated_data.get("filter"),
+        )
+        return Response({"deleted": deleted})
+
+
+class ExpenseBulkEditAPIView(APIView):
+    """Set category, payment method and/or date on many expenses at once.
+
+    Targets ``ids``, everything matching ``filter`` or, with ``all``, every
+    expense of the user; runs as chunked
+    ``UPDATE`` statements in one transaction.
+    """
+
+    def post(self, request):
+        serializer = BulkEditSerializer(
+            data=request.data, context={"request": request, "categories": category_cache.by_id()}
+        )
+        serializer.is_valid(raise_exception=True)
+        if serializer.validated_data["background"]:
+            values = dict(serializer.validated_data["values"])
+            if "category" in values:
+                values["category"] = values["category"].pk
+            return job_accepted(
+                jobs.enqueue("bulk_edit", request.user, values=values, **bulk_target(serializer))
+            )
+        with category_errors():
+            updated = bulk.bulk_edit(
+                Expense.objects.for_user(request.user),
+                serializer.validated_data["values"],
+                ids=serializer.validated_data.get("ids"),
+                filters=serializer.validated_data.get("filter"),
+            )
+        return Response({"updated": updated})
+
+
+class ExpenseExportJobAPIView(APIView):
+    """Queue an export to a file, fetched from the job once it is done."""
+
+    def post(self, request):
+        serializer = ExportJobSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return job_accepted(jobs.enqueue("export", request.user, **serializer.validated_data))
+
+
+class JobListAPIView(generics.ListAPIView):
+    serializer_class = JobSerializer
+
+    def get_queryset(self):
+        return Job.objects.for_user(self.request.user).order_by("-created_at")[: settings.EXPENSES_JOB_LIST_LIMIT]
+
+
+class JobDetailAPIView(generics.RetrieveAPIView):
+    """Poll this for ``status`` and ``progress``/``total``."""
+
+    serializer_class = JobSerializer
+
+    def get_queryset(self):
+        return Job.objects.for_user(self.request.user)
+
+
+class JobDownloadAPIView(JobDetailAPIView):
+    def get(self, request, *args, **kwargs):
+        job = self.get_object()
+        result = job.result or {}
+        if job.status != Job.SUCCEEDED or not result.get("path"):
+            raise Http404
+        try:
+            file = open(jobs.job_file(result["path"]), "rb")
+        except FileNotFoundError:
+            raise Http404
+        return FileResponse(
+            file, as_attachment=True, filename=result["path"], content_type=result.get("content_type")
+        )
+
+
+def all_users(request):
+    return request.user.is_staff and request.query_params.get("scope") == "all"
+
+
+def aggregate_etag(request, *args, **kwargs):
+    return None if all_users(request) else generations.etag(request)
+
+
+def aggregate_last_modified(request, *args, **kwargs):
+    return None if all_users(request) else generations.last_modified(request)
+
+
+class ExpenseAggregateAPIView(APIView):
+    """Chart data: totals per ``interval`` period and/or ``group_by`` value.
+
+    Staff can pass ``scope=all`` to aggregate every user's expenses.
+    """
+
+    @method_decorator(replica_reads)
+    @method_decorator(condition(etag_func=aggregate_etag, last_modified_func=aggregate_last_modified))
+    def get(self, request):
+        try:
+            filters, interval, group_by = parse_aggregate_params(request.query_params)
+        except DjangoValidationError as exc:
+            raise ValidationError({"error": exc.messages[0]})
+        if all_users(request):
+            return Response(aggregate(ExpenseRollup.objects.all(), filters, interval, group_by))
+        rollups = ExpenseRollup.objects.for_user(request.user)
+        params = dict(filters, interval=interval or "", group_by=group_by or "")
+        return Response(
+            generations.cached(
+                request, "aggregate", params, lambda: aggregate(rollups, filters, interval, group_by)
+            )
+        )
+
+
+class CategoryListCreateAPIView(generics.ListCreateAPIView):
+    queryset = Category.objects.all()
+    serializer_class = CategorySerializer
+
+
+class CacheStatsAPIView(APIView):
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        return Response({"categories": category_cache.stats(), "tokens": token_cache.stats()})
@@ -0,0 +1,33 @@
+"""JSON API routes, shared by the full site and the API-only profile."""
+from django.urls import path
+
+from . import api, async_views, views
+
+urlpatterns = [
+    path('api/signup/', api.SignupAPIView.as_view(), name='api_signup'),
+    path('api/login/', api.LoginAPIView.as_view(), name='api_login'),
+    path('api/expenses/', api.ExpenseListCreateAPIView.as_view(), name='api_expense_list'),
+    path('api/expenses/aggregate/', api.ExpenseAggregateAPIView.as_view(), name='api_expense_aggregate'),
+    path('api/expenses/bulk/', api.ExpenseBulkAPIView.as_view(), name='api_expense_bulk'),
+    path('api/expenses/bulk/edit/', api.ExpenseBulkEditAPIView.as_view(), name='api_expense_bulk_edit'),
+    path('api/expenses/export/', api.ExpenseExportJobAPIView.as_view(), name='api_expense_export'),
+    path('api/expenses/<int:pk>/', api.ExpenseDetailAPIView.as_view(), name='api_expense_detail'),
+    path('api/expenses/<int:pk>/receipt/', api.ExpenseReceiptAPIView.as_view(), name='api_expense_receipt'),
+    path('api/receipts/<str:sha256>/', api.ReceiptFileAPIView.as_view(), name='api_receipt_file'),
+    path(
+        'api/receipts/<str:sha256>/thumbnail/',
+        api.ReceiptFileAPIView.as_view(),
+        {'thumbnail': True},
+        name='api_receipt_thumbnail',
+    ),
+    path('api/categories/', api.CategoryListCreateAPIView.as_view(), name='api_category_list'),
+    path('api/async/expenses/', async_views.expense_list, name='api_async_expense_list'),
+    path('api/async/summary/', async_views.expense_summary, name='api_async_summary'),
+    path('api/async/aggregate/', async_views.expense_aggregate, name='api_async_aggregate'),
+    path('api/async/export/', async_views.expense_export, name='api_async_export'),
+    path('api/jobs/', api.JobListAPIView.as_view(), name='api_job_list'),
+    path('api/jobs/<int:pk>/', api.JobDetailAPIView.as_view(), name='api_job_detail'),
+    path('api/jobs/<int:pk>/download/', api.JobDownloadAPIView.as_view(), name='api_job_download'),
+    path('api/cache-stats/', api.CacheStatsAPIView.as_view(), name='api_cache_stats'),
+    path('metrics', views.metrics, name='metrics'),
+]
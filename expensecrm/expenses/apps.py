@@ -4,3 +4,12 @@ from django.apps import AppConfig
 class ExpensesConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "expenses"
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+        from django.db.models.signals import post_migrate
+
+        from . import metrics, search, signals, tasks  # noqa: F401
+
+        post_migrate.connect(search.repair, sender=self)
+        connection_created.connect(metrics.install_query_timer)
@@ -0,0 +1,183 @@
+"""Async JSON versions of the read-heavy expense endpoints.
+
+Under an ASGI server these views await the async ORM interface instead of
+holding a worker thread for the whole request. They return the same
+payloads as the REST framework views in ``api.py`` and accept the same
+token (or session) authentication.
+"""
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.contrib import auth
+from django.contrib.auth.models import AnonymousUser
+from django.core.exceptions import ValidationError
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from rest_framework.authtoken.models import Token
+
+from . import generations
+from .aggregates import aaggregate, parse_aggregate_params
+from .cache import token_cache
+from .export import FORMATS, aexport_chunks
+from .filters import filter_expenses, parse_expense_filters
+from .models import Expense, ExpenseRollup
+from .pagination import InvalidCursor, akeyset_page, aranked_page, get_page_size
+from .rollups import category_totals, from_cents
+from .routers import aread_database, pin, reads_from
+from .search import search
+from .rows import expense_rows
+from .serializers import ExpenseRowSerializer
+
+
+def error(message, status):
+    return JsonResponse({"detail": message}, status=status)
+
+
+async def aauthenticate(request):
+    """The user behind the ``Authorization: Token`` header or the session.
+
+    Returns ``None`` for an unknown token or an inactive user.
+    """
+    keyword, _, key = request.headers.get("Authorization", "").partition(" ")
+    if keyword.lower() == "token":
+        key = key.strip()
+        user = await token_cache.aget(key)
+        if user is None:
+            token = await Token.objects.select_related("user").filter(key=key).afirst()
+            if token is None or not token.user.is_active:
+                return None
+            user = token.user
+            await token_cache.aset(key, user)
+        return user
+    if not hasattr(request, "session"):
+        # The API-only profile runs without sessions.
+        return AnonymousUser()
+    return await sync_to_async(auth.get_user)(request)
+
+
+def async_api_view(view):
+    """Authenticate like the REST framework views and allow GET/HEAD only.
+
+    The view reads from a replica unless the user wrote recently.
+    """
+
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if request.method not in ("GET", "HEAD"):
+            return error(f'Method "{request.method}" not allowed.', 405)
+        user = await aauthenticate(request)
+        if user is None:
+            return error("Invalid token.", 401)
+        if not user.is_authenticated:
+            return error("Authentication credentials were not provided.", 401)
+        request.user = user
+        with reads_from(await aread_database(request)):
+            return await view(request, *args, **kwargs)
+
+    return wrapper
+
+
+async def not_modified(request):
+    """A 304 response when the client's copy matches what :func:`with_validators` sends."""
+    await generations.acurrent(request)
+    updated_at = generations.last_modified(request)
+    return get_conditional_response(
+        request,
+        etag=f'"{generations.etag(request)}"',
+        last_modified=int(updated_at.timestamp()) if updated_at else None,
+    )
+
+
+def with_validators(response, request):
+    response["ETag"] = f'"{generations.etag(request)}"'
+    updated_at = generations.last_modified(request)
+    if updated_at is not None:
+        response["Last-Modified"] = http_date(int(updated_at.timestamp()))
+    return response
+
+
+@async_api_view
+async def expense_list(request):
+    expenses = Expense.objects.for_user(request.user)
+    try:
+        filters = parse_expense_filters(request.GET)
+    except ValidationError as exc:
+        return error(exc.messages[0], 400)
+    expenses = filter_expenses(expenses, filters)
+    query = request.GET.get("q", "").strip()
+    paginate = akeyset_page
+    if query:
+        expenses = search(expenses, query, user=request.user)
+        paginate = aranked_page
+    try:
+        page = await paginate(expense_rows(expenses), request.GET.get("cursor"), get_page_size(request))
+    except InvalidCursor:
+        return error("Invalid cursor.", 404)
+    next_url = None
+    if page.has_next:
+        params = request.GET.copy()
+        params["cursor"] = page.next_cursor
+        next_url = request.build_absolute_uri(f"?{params.urlencode()}")
+    results = ExpenseRowSerializer(page.object_list, many=True).data
+    return JsonResponse({"next": next_url, "results": results})
+
+
+@async_api_view
+async def expense_summary(request):
+    try:
+        filters = parse_expense_filters(request.GET)
+    except ValidationError as exc:
+        return error(exc.messages[0], 400)
+    response = await not_modified(request)
+    if response is not None:
+        return response
+    rollup = ExpenseRollup.objects.for_user(request.user)
+    if "start_date" in filters:
+        rollup = rollup.filter(day__gte=filters["start_date"])
+    if "end_date" in filters:
+        rollup = rollup.filter(day__lte=filters["end_date"])
+
+    async def summarize():
+        return [
+            {"category": row["category__name"], "total": from_cents(row["cents"])}
+            async for row in category_totals(rollup)
+        ]
+
+    params = {name: filters.get(name, "") for name in ("start_date", "end_date")}
+    summary = await generations.acached(request, "summary_json", params, summarize)
+    overall = sum((row["total"] for row in summary), from_cents(0))
+    return with_validators(JsonResponse({"summary": summary, "overall": overall}), request)
+
+
+@async_api_view
+async def expense_aggregate(request):
+    try:
+        filters, interval, group_by = parse_aggregate_params(request.GET)
+    except ValidationError as exc:
+        return error(exc.messages[0], 400)
+    response = await not_modified(request)
+    if response is not None:
+        return response
+    rollups = ExpenseRollup.objects.for_user(request.user)
+    params = dict(filters, interval=interval or "", group_by=group_by or "")
+    payload = await generations.acached(
+        request, "aggregate", params, lambda: aaggregate(rollups, filters, interval, group_by)
+    )
+    return with_validators(JsonResponse(payload), request)
+
+
+@async_api_view
+async def expense_export(request):
+    fmt = request.GET.get("format", "csv")
+    if fmt not in FORMATS:
+        return error("Unsupported export format", 400)
+    try:
+        filters = parse_expense_filters(request.GET)
+    except ValidationError as exc:
+        return error(exc.messages[0], 400)
+    expenses = pin(filter_expenses(Expense.objects.for_user(request.user), filters))
+    _, content_type, extension = FORMATS[fmt]
+    response = StreamingHttpResponse(aexport_chunks(expenses, fmt), content_type=content_type)
+    response["Content-Disposition"] = f'attachment; filename="expenses.{extension}"'
+    return response
@@ -0,0 +1,35 @@
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from .cache import token_cache
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """``TokenAuthentication`` that skips the token/user query on a cache hit.
+
+    Unknown tokens and inactive users are looked up every time and rejected
+    as before. ``request.auth`` is an unsaved ``Token`` carrying the key.
+    """
+
+    def authenticate_credentials(self, key):
+        user = token_cache.get(key)
+        if user is not None:
+            return user, Token(key=key, user=user)
+        user, token = super().authenticate_credentials(key)
+        token_cache.set(key, user)
+        return user, token
+
+
+def issue_token(user, created=False):
+    """The key of ``user``'s token, created if needed, without a query when cached.
+
+    Pass ``created=True`` for a user saved in this request, who cannot have one.
+    """
+    key = None if created else token_cache.key_for(user)
+    if key is None:
+        if created:
+            key = Token.objects.create(user=user).key
+        else:
+            key = Token.objects.get_or_create(user=user)[0].key
+        token_cache.set(key, user)
+    return key
@@ -0,0 +1,57 @@
+"""Set-based bulk edits and deletes of one user's expenses.
+
+An action targets either explicit ids or everything matching the usual
+expense filters. Ids are applied ``EXPENSE_BULK_CHUNK_SIZE`` at a time so no
+statement exceeds the database's parameter limit; a filter is a single
+``UPDATE``/``DELETE``. Either way the whole action is one transaction, and
+the rollups and data generations follow through ``ExpenseQuerySet``.
+"""
+from django.conf import settings
+from django.db import transaction
+
+from . import generations, rollups
+from .filters import filter_expenses
+
+EDITABLE_FIELDS = ("category", "payment_method", "date")
+
+
+def targets(queryset, ids=None, filters=None):
+    """Querysets covering ``ids`` in chunks, or the one matching ``filters``."""
+    if ids is None:
+        yield filter_expenses(queryset, filters or {})
+        return
+    ids = sorted(set(ids))
+    size = settings.EXPENSE_BULK_CHUNK_SIZE
+    for start in range(0, len(ids), size):
+        yield queryset.filter(pk__in=ids[start : start + size])
+
+
+def bulk_edit(queryset, values, ids=None, filters=None):
+    """Set ``values`` on the targeted expenses; returns how many changed."""
+    unknown = set(values) - set(EDITABLE_FIELDS)
+    if unknown:
+        raise ValueError(f"Cannot bulk edit {', '.join(sorted(unknown))}")
+    updated, deltas, users = 0, rollups.new_deltas(), set()
+    with transaction.atomic(using=queryset.db):
+        for chunk in targets(queryset, ids, filters):
+            rows, chunk_deltas, chunk_users = chunk.update_deltas(**values)
+            updated += rows
+            rollups.merge_deltas(deltas, chunk_deltas)
+            users |= chunk_users
+        # Chunks share buckets; applying the merged deltas writes each once.
+        rollups.apply_deltas(deltas, using=queryset.db)
+        generations.bump(users, using=queryset.db)
+    return updated
+
+
+def bulk_delete(queryset, ids=None, filters=None):
+    """Delete the targeted expenses; returns how many were deleted."""
+    deleted, deltas = 0, rollups.new_deltas()
+    with transaction.atomic(using=queryset.db):
+        for chunk in targets(queryset, ids, filters):
+            rows, chunk_deltas = chunk.delete_deltas()
+            deleted += rows
+            rollups.merge_deltas(deltas, chunk_deltas)
+        rollups.apply_deltas(deltas, using=queryset.db)
+        generations.bump(generations.users_in(deltas), using=queryset.db)
+    return deleted
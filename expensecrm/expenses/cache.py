@@ -0,0 +1,272 @@
+"""Caches of categories and API tokens.
+
+Categories are read on almost every page but rarely change, so each process
+keeps one copy ordered by name. ``post_save``/``post_delete`` on
+``Category`` invalidate it. When ``EXPENSES_CATEGORY_CACHE`` names a Django
+cache alias, a version token stored there lets a change made by one process
+invalidate every other process; otherwise copies expire after
+``EXPENSES_CATEGORY_CACHE_TIMEOUT`` seconds. Either way a stale copy only
+costs a query: an id it lacks is looked up in the database, and a write
+that references a category deleted since is rejected by
+:func:`category_writes`.
+"""
+import copy
+import hashlib
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import caches
+from django.db import IntegrityError, transaction
+
+VERSION_KEY = "expenses:categories:version"
+TOKEN_KEY_PREFIX = "expenses:token:"
+CATEGORY_GONE = "This category no longer exists."
+
+
+class CategoryGone(Exception):
+    """A category that passed validation was deleted before the write committed."""
+
+
+class CategoryCache:
+    def __init__(self):
+        self._entry = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _backend(self):
+        alias = getattr(settings, "EXPENSES_CATEGORY_CACHE", None)
+        return caches[alias] if alias else None
+
+    def _version(self, backend):
+        if backend is None:
+            return None
+        version = backend.get(VERSION_KEY)
+        if version is None:
+            backend.add(VERSION_KEY, uuid.uuid4().hex, None)
+            version = backend.get(VERSION_KEY)
+        return version
+
+    def _load(self):
+        backend = self._backend()
+        version = self._version(backend)
+        entry = self._entry
+        timeout = getattr(settings, "EXPENSES_CATEGORY_CACHE_TIMEOUT", 300)
+        if entry is not None and entry[0] == version and time.monotonic() - entry[1] < timeout:
+            self.hits += 1
+            return entry[2]
+        with self._lock:
+            self.misses += 1
+            Category = apps.get_model("expenses", "Category")
+            categories = tuple(Category.objects.all())
+            by_id = {category.pk: category for category in categories}
+            self._entry = (version, time.monotonic(), (categories, by_id))
+        return categories, by_id
+
+    def categories(self):
+        """All categories ordered by name."""
+        return self._load()[0]
+
+    def by_id(self):
+        return self._load()[1]
+
+    def get(self, pk):
+        """The category ``pk``, or ``None`` if it does not exist.
+
+        Another process may have created it since this copy was loaded, so a
+        miss is checked against the database and, if found, reloads the copy.
+        """
+        category = self._load()[1].get(pk)
+        if category is None:
+            Category = apps.get_model("expenses", "Category")
+            category = Category.objects.filter(pk=pk).first()
+            if category is not None:
+                self._entry = None
+        return category
+
+    def name(self, pk):
+        category = self.get(pk)
+        return category.name if category is not None else None
+
+    def invalidate(self):
+        self._entry = None
+        backend = self._backend()
+        if backend is not None:
+            backend.delete(VERSION_KEY)
+
+    def stats(self):
+        entry = self._entry
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(entry[2][0]) if entry is not None else 0,
+        }
+
+
+category_cache = CategoryCache()
+
+
+@contextmanager
+def category_writes(using=None):
+    """Run expense writes in one transaction; raise ``CategoryGone`` on a dangling category.
+
+    Categories are validated against ``category_cache``, which may still hold
+    one another process has deleted. The foreign key catches that when the
+    transaction commits.
+    """
+    try:
+        with transaction.atomic(using=using):
+            yield
+    except IntegrityError as exc:
+        category_cache.invalidate()
+        raise CategoryGone(CATEGORY_GONE) from exc
+
+
+class TokenCache:
+    """Token key -> user, so token authentication needs no query per request.
+
+    Entries live for ``EXPENSES_TOKEN_CACHE_TIMEOUT`` seconds in the
+    ``EXPENSES_TOKEN_CACHE`` alias, so a deleted token or a deactivated user is
+    dropped for every process sharing it. With the setting ``None`` they live
+    in a per-process LRU of ``EXPENSES_TOKEN_CACHE_SIZE`` entries, which other
+    processes cannot invalidate. Only valid tokens of active users are stored.
+    Callers get their own copy of the user.
+    """
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._user_keys = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _backend(self):
+        alias = getattr(settings, "EXPENSES_TOKEN_CACHE", None)
+        return caches[alias] if alias else None
+
+    def _timeout(self):
+        return getattr(settings, "EXPENSES_TOKEN_CACHE_TIMEOUT", 300)
+
+    def _cache_key(self, key):
+        return TOKEN_KEY_PREFIX + hashlib.sha256(key.encode()).hexdigest()
+
+    def _user_cache_key(self, user_id):
+        return f"{TOKEN_KEY_PREFIX}user:{user_id}"
+
+    def _local_get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] <= time.monotonic():
+                self._discard(key)
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry[0] if entry is not None else None
+
+    def _local_set(self, key, user):
+        size = getattr(settings, "EXPENSES_TOKEN_CACHE_SIZE", 10000)
+        with self._lock:
+            self._discard(key)
+            self._entries[key] = (user, time.monotonic() + self._timeout())
+            self._user_keys.setdefault(user.pk, set()).add(key)
+            while len(self._entries) > size:
+                self._discard(next(iter(self._entries)))
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            keys = self._user_keys.get(entry[0].pk, set())
+            keys.discard(key)
+            if not keys:
+                self._user_keys.pop(entry[0].pk, None)
+
+    def _found(self, user):
+        if user is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return copy.copy(user)
+
+    def get(self, key):
+        """The active user for token ``key``, or ``None`` when not cached."""
+        backend = self._backend()
+        if backend is None:
+            return self._found(self._local_get(key))
+        return self._found(backend.get(self._cache_key(key)))
+
+    async def aget(self, key):
+        backend = self._backend()
+        if backend is None:
+            return self._found(self._local_get(key))
+        return self._found(await backend.aget(self._cache_key(key)))
+
+    def set(self, key, user):
+        backend = self._backend()
+        if backend is None:
+            self._local_set(key, user)
+        else:
+            backend.set_many(
+                {self._cache_key(key): user, self._user_cache_key(user.pk): key}, self._timeout()
+            )
+
+    async def aset(self, key, user):
+        backend = self._backend()
+        if backend is None:
+            self._local_set(key, user)
+        else:
+            await backend.aset_many(
+                {self._cache_key(key): user, self._user_cache_key(user.pk): key}, self._timeout()
+            )
+
+    def key_for(self, user):
+        """A cached token key of ``user``, or ``None``."""
+        backend = self._backend()
+        if backend is None:
+            with self._lock:
+                keys = self._user_keys.get(user.pk)
+                key = next(iter(keys)) if keys else None
+            return key if key is not None and self._local_get(key) is not None else None
+        key = backend.get(self._user_cache_key(user.pk))
+        return key if key is not None and backend.get(self._cache_key(key)) is not None else None
+
+    def invalidate(self, key):
+        with self._lock:
+            self._discard(key)
+        backend = self._backend()
+        if backend is not None:
+            backend.delete(self._cache_key(key))
+
+    def invalidate_user(self, user_id, using="default"):
+        with self._lock:
+            for key in list(self._user_keys.get(user_id, ())):
+                self._discard(key)
+        backend = self._backend()
+        if backend is not None:
+            # Other processes may have cached tokens this one never saw.
+            Token = apps.get_model("authtoken", "Token")
+            keys = set(Token.objects.using(using).filter(user_id=user_id).values_list("key", flat=True))
+            cached = backend.get(self._user_cache_key(user_id))
+            if cached:
+                keys.add(cached)
+            backend.delete_many(
+                [self._cache_key(key) for key in keys] + [self._user_cache_key(user_id)]
+            )
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._user_keys.clear()
+        backend = self._backend()
+        if backend is not None:
+            backend.clear()
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
+
+
+token_cache = TokenCache()
@@ -0,0 +1,102 @@
+"""Constant-memory CSV and JSON-lines export of expenses.
+
+Rows are read as tuples with ``values_list(...).iterator()`` and encoded into
+buffers of roughly ``BUFFER_SIZE`` characters, so memory use depends on the
+chunk size and not on the number of rows exported.
+"""
+import csv
+import io
+import itertools
+import json
+
+from asgiref.sync import sync_to_async
+
+EXPORT_COLUMNS = (
+    ("id", "id"),
+    ("date", "date"),
+    ("category", "category__name"),
+    ("user", "user__username"),
+    ("description", "description"),
+    ("amount", "amount"),
+    ("payment_method", "payment_method"),
+    ("receipt_link", "receipt_link"),
+)
+HEADER = tuple(name for name, _ in EXPORT_COLUMNS)
+
+DEFAULT_CHUNK_SIZE = 2000
+BUFFER_SIZE = 64 * 1024
+
+
+def export_rows(queryset, chunk_size=DEFAULT_CHUNK_SIZE):
+    return (
+        queryset.order_by("date", "id")
+        .values_list(*(lookup for _, lookup in EXPORT_COLUMNS))
+        .iterator(chunk_size=chunk_size)
+    )
+
+
+async def aexport_row_chunks(queryset, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Lists of up to ``chunk_size`` export rows, fetched in a worker thread.
+
+    ``aiterator()`` on a ``values_list()`` queryset runs the query on the
+    event loop in Django 4.2.0, so this drives the sync iterator instead.
+    """
+    rows = export_rows(queryset, chunk_size)
+    fetch = sync_to_async(lambda: list(itertools.islice(rows, chunk_size)))
+    while True:
+        chunk = await fetch()
+        if not chunk:
+            return
+        yield chunk
+
+
+def csv_chunks(rows, header=True):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(HEADER)
+    for row in rows:
+        writer.writerow(row)
+        if buffer.tell() >= BUFFER_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def jsonl_chunks(rows, header=True):
+    lines, size = [], 0
+    for row in rows:
+        line = json.dumps(dict(zip(HEADER, row)), default=str)
+        lines.append(line)
+        size += len(line) + 1
+        if size >= BUFFER_SIZE:
+            yield "\n".join(lines) + "\n"
+            lines, size = [], 0
+    if lines:
+        yield "\n".join(lines) + "\n"
+
+
+FORMATS = {
+    "csv": (csv_chunks, "text/csv", "csv"),
+    "jsonl": (jsonl_chunks, "application/x-ndjson", "jsonl"),
+}
+
+
+def export_chunks(queryset, fmt="csv", chunk_size=DEFAULT_CHUNK_SIZE):
+    encode = FORMATS[fmt][0]
+    return encode(export_rows(queryset, chunk_size))
+
+
+async def aexport_chunks(queryset, fmt="csv", chunk_size=DEFAULT_CHUNK_SIZE):
+    """Async counterpart of :func:`export_chunks`."""
+    encode = FORMATS[fmt][0]
+    header = True
+    async for rows in aexport_row_chunks(queryset, chunk_size):
+        for chunk in encode(rows, header=header):
+            yield chunk
+        header = False
+    if header:
+        # Nothing matched: still send the CSV header.
+        for chunk in encode([], header=True):
+            yield chunk
@@ -0,0 +1,40 @@
+from datetime import date
+
+from django.core.exceptions import ValidationError
+
+
+def parse_expense_filters(params):
+    """Clean the ``category``/``start_date``/``end_date`` query parameters.
+
+    ``params`` is any mapping, e.g. ``request.GET`` or command options.
+    Raises ``ValidationError`` for malformed values.
+    """
+    filters = {}
+    category = params.get("category")
+    if category not in (None, ""):
+        try:
+            filters["category"] = int(category)
+        except (TypeError, ValueError):
+            raise ValidationError(f"Invalid category: {category!r}")
+    for name in ("start_date", "end_date"):
+        value = params.get(name)
+        if value in (None, ""):
+            continue
+        if isinstance(value, date):
+            filters[name] = value
+            continue
+        try:
+            filters[name] = date.fromisoformat(value)
+        except (TypeError, ValueError):
+            raise ValidationError(f"Invalid {name}: {value!r}")
+    return filters
+
+
+def filter_expenses(queryset, filters):
+    if "category" in filters:
+        queryset = queryset.filter(category_id=filters["category"])
+    if "start_date" in filters:
+        queryset = queryset.filter(date__gte=filters["start_date"])
+    if "end_date" in filters:
+        queryset = queryset.filter(date__lte=filters["end_date"])
+    return queryset
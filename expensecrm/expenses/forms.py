@@ -1,12 +1,51 @@
 from django import forms
 from django.contrib.auth.forms import UserCreationForm, AuthenticationForm
 from django.contrib.auth.models import User
+from django.forms.models import ModelChoiceIterator
+from .cache import category_cache
 from .models import Expense, Category
 
+
+class CachedCategoryIterator(ModelChoiceIterator):
+    def __iter__(self):
+        if self.field.empty_label is not None:
+            yield ("", self.field.empty_label)
+        for category in category_cache.categories():
+            yield self.choice(category)
+
+    def __len__(self):
+        return len(category_cache.categories()) + (self.field.empty_label is not None)
+
+    def __bool__(self):
+        return self.field.empty_label is not None or bool(category_cache.categories())
+
+
+class CachedCategoryChoiceField(forms.ModelChoiceField):
+    """Category choices rendered and looked up from ``category_cache``."""
+
+    iterator = CachedCategoryIterator
+
+    def to_python(self, value):
+        if value in self.empty_values:
+            return None
+        try:
+            category = category_cache.get(int(value))
+        except (TypeError, ValueError):
+            category = None
+        if category is None:
+            raise forms.ValidationError(
+                self.error_messages["invalid_choice"],
+                code="invalid_choice",
+                params={"value": value},
+            )
+        return category
+
+
 class ExpenseForm(forms.ModelForm):
     class Meta:
         model = Expense
         fields = ["date", "category", "description", "amount", "payment_method", "receipt_link"]
+        field_classes = {"category": CachedCategoryChoiceField}
         widgets = {
             "date": forms.DateInput(attrs={"type": "date", "class": "form-control"}),
             "category": forms.Select(attrs={"class": "form-select"}),
@@ -17,6 +56,45 @@ class ExpenseForm(forms.ModelForm):
         }
 
 
+class ExpenseBulkEditForm(forms.Form):
+    """Values to set on the selected expenses; blank fields are left alone."""
+
+    category = CachedCategoryChoiceField(
+        queryset=Category.objects.all(),
+        required=False,
+        empty_label="Keep category",
+        widget=forms.Select(attrs={"class": "form-select"}),
+    )
+    payment_method = forms.ChoiceField(
+        choices=[("", "Keep payment method")] + Expense.PAYMENT_METHOD_CHOICES,
+        required=False,
+        widget=forms.Select(attrs={"class": "form-select"}),
+    )
+    date = forms.DateField(
+        required=False, widget=forms.DateInput(attrs={"type": "date", "class": "form-control"})
+    )
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if not self.values():
+            raise forms.ValidationError("Choose something to change.")
+        return cleaned_data
+
+    def values(self):
+        return {
+            name: value
+            for name, value in self.cleaned_data.items()
+            if value not in (None, "")
+        }
+
+
+class ExpenseImportForm(forms.Form):
+    file = forms.FileField(
+        label="CSV file",
+        widget=forms.ClearableFileInput(attrs={"class": "form-control", "accept": ".csv,text/csv"}),
+    )
+
+
 class CategoryForm(forms.ModelForm):
     class Meta:
         model = Category
@@ -0,0 +1,59 @@
+"""Cached per-expense markup for the expense list.
+
+Each expense is drawn twice, as a table row and as a card for narrow
+screens. Rows missing from the cache are rendered together in one pass of
+``expense_fragments.html`` and split on a separator afterwards. Each pair
+is cached under the key ``{% cache %}`` would use for ``expense_row``
+varied on the expense id, the owner's data generation and username. Any
+write to the owner's expenses or to a category moves the generation on, so
+stale markup is never served and nothing needs explicit invalidation.
+Lookups go through ``get_many`` once per chunk of rows, not once per row.
+"""
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.utils import make_template_fragment_key
+from django.template.loader import get_template
+from django.utils.safestring import mark_safe
+
+TEMPLATE = "expenses/expense_fragments.html"
+# Escaped content can never produce this.
+SEPARATOR = "<!--expense-fragment-->"
+# Rows looked up and rendered per round trip to the cache.
+CHUNK_SIZE = 100
+
+
+def fragment_key(expense, version):
+    return make_template_fragment_key("expense_row", [expense.pk, version, expense.username or ""])
+
+
+def fragment_chunks(expenses, version):
+    """Yield lists of ``(row_html, card_html)`` for ``expenses``, in order.
+
+    ``expenses`` are rows from :func:`expenses.rows.expense_rows`.
+    """
+    alias = settings.EXPENSES_FRAGMENT_CACHE
+    cache = caches[alias] if alias else None
+    expenses = list(expenses)
+    for start in range(0, len(expenses), CHUNK_SIZE):
+        chunk = expenses[start : start + CHUNK_SIZE]
+        keys = [fragment_key(expense, version) for expense in chunk]
+        fragments = cache.get_many(keys) if cache else {}
+        missing = [(key, expense) for key, expense in zip(keys, chunk) if key not in fragments]
+        if missing:
+            rendered = render_missing([expense for _, expense in missing])
+            missing = {key: pair for (key, _), pair in zip(missing, rendered)}
+            fragments.update(missing)
+            if cache:
+                cache.set_many(missing, settings.EXPENSES_FRAGMENT_CACHE_TIMEOUT)
+        yield [fragments[key] for key in keys]
+
+
+def render_missing(expenses):
+    parts = get_template(TEMPLATE).render({"expenses": expenses}).split(SEPARATOR)
+    return list(zip(parts[0:-1:2], parts[1:-1:2]))
+
+
+def render_fragments(expenses, version):
+    """All table rows and all cards of ``expenses``, as two safe strings."""
+    pairs = [pair for chunk in fragment_chunks(expenses, version) for pair in chunk]
+    return mark_safe("".join(row for row, _ in pairs)), mark_safe("".join(card for _, card in pairs))
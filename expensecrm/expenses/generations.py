@@ -0,0 +1,153 @@
+"""Per-user data generations and the aggregate cache keyed on them.
+
+Every write to a user's expenses bumps that user's ``DataGeneration`` in the
+same transaction. Aggregates cached under ``(user, name, filters,
+generation)`` therefore go stale the moment the data does, without any
+explicit cache invalidation. Generations are derived from the clock, so a
+bump that is rolled back is never handed out again.
+"""
+import hashlib
+import time
+from datetime import datetime
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+from django.db.models import Case, F, Value, When
+from django.utils import timezone
+from django.utils.http import urlencode
+
+from .models import DataGeneration
+
+# Three parameters per row keeps each upsert well under SQLite's variable limit.
+BUMP_BATCH_SIZE = 300
+
+
+def users_in(deltas):
+    """User ids of the rollup buckets in ``deltas``."""
+    return {bucket[2] for bucket in deltas}
+
+
+def next_generation():
+    return time.time_ns() // 1000
+
+
+def bump(user_ids, using="default"):
+    user_ids = sorted(pk for pk in set(user_ids) if pk is not None)
+    for start in range(0, len(user_ids), BUMP_BATCH_SIZE):
+        _upsert(user_ids[start : start + BUMP_BATCH_SIZE], using)
+
+
+def _upsert(user_ids, using):
+    connection = connections[using]
+    qn = connection.ops.quote_name
+    table = qn(DataGeneration._meta.db_table)
+    generation = next_generation()
+    updated_at = connection.ops.adapt_datetimefield_value(timezone.now())
+    placeholders = ", ".join(["(%s, %s, %s)"] * len(user_ids))
+    params = []
+    for user_id in user_ids:
+        params.extend([user_id, generation, updated_at])
+    current = f"{table}.{qn('generation')}"
+    sql = (
+        f"INSERT INTO {table} ({qn('user_id')}, {qn('generation')}, {qn('updated_at')}) "
+        f"VALUES {placeholders} "
+        f"ON CONFLICT ({qn('user_id')}) DO UPDATE SET "
+        f"{qn('generation')} = CASE WHEN {current} < excluded.{qn('generation')} "
+        f"THEN excluded.{qn('generation')} ELSE {current} + 1 END, "
+        f"{qn('updated_at')} = excluded.{qn('updated_at')}"
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+
+
+def bump_all(using="default"):
+    """Move every user forward, e.g. after a change to shared categories."""
+    generation = next_generation()
+    DataGeneration.objects.using(using).update(
+        generation=Case(
+            When(generation__lt=generation, then=Value(generation)),
+            default=F("generation") + 1,
+        ),
+        updated_at=timezone.now(),
+    )
+
+
+def current(request):
+    """``(generation, updated_at)`` for the requesting user, once per request."""
+    if not hasattr(request, "_expense_generation"):
+        row = None
+        if request.user.is_authenticated:
+            row = (
+                DataGeneration.objects.filter(user_id=request.user.pk)
+                .values_list("generation", "updated_at")
+                .first()
+            )
+        request._expense_generation = row or (0, None)
+    return request._expense_generation
+
+
+async def acurrent(request):
+    if not hasattr(request, "_expense_generation"):
+        row = None
+        if request.user.is_authenticated:
+            row = await (
+                DataGeneration.objects.filter(user_id=request.user.pk)
+                .values_list("generation", "updated_at")
+                .afirst()
+            )
+        request._expense_generation = row or (0, None)
+    return request._expense_generation
+
+
+def cache_key(request, name, params):
+    generation, _ = current(request)
+    digest = hashlib.md5(urlencode(sorted(params.items())).encode()).hexdigest()
+    return f"expenses:{name}:{request.user.pk}:{generation}:{digest}"
+
+
+def cached(request, name, params, compute):
+    """Return ``compute()`` from the cache for this user, filters and generation."""
+    cache = caches[settings.EXPENSES_AGGREGATE_CACHE]
+    key = cache_key(request, name, params)
+    value = cache.get(key)
+    if value is None:
+        value = compute()
+        cache.set(key, value, settings.EXPENSES_AGGREGATE_CACHE_TIMEOUT)
+    return value
+
+
+async def acached(request, name, params, compute):
+    """Async :func:`cached`; ``compute`` is a coroutine function."""
+    await acurrent(request)
+    cache = caches[settings.EXPENSES_AGGREGATE_CACHE]
+    key = cache_key(request, name, params)
+    value = await cache.aget(key)
+    if value is None:
+        value = await compute()
+        await cache.aset(key, value, settings.EXPENSES_AGGREGATE_CACHE_TIMEOUT)
+    return value
+
+
+def ends_today(request):
+    """Whether the requested range has no ``end_date`` and so runs up to today.
+
+    Such a response changes at midnight as well as with the generation.
+    """
+    return not request.GET.get("end_date")
+
+
+def etag(request, *args, **kwargs):
+    generation, _ = current(request)
+    tag = f"{request.user.pk}-{generation}"
+    if ends_today(request):
+        tag += f"-{timezone.localdate().isoformat()}"
+    return tag
+
+
+def last_modified(request, *args, **kwargs):
+    updated_at = current(request)[1]
+    if updated_at is not None and ends_today(request):
+        midnight = datetime.combine(timezone.localdate(), datetime.min.time())
+        updated_at = max(updated_at, timezone.make_aware(midnight))
+    return updated_at
@@ -0,0 +1,148 @@
+"""Batched CSV import of expenses.
+
+Rows are streamed from the file, validated in batches with the field rules
+of ``ExpenseForm`` and inserted with ``bulk_create``, all inside a single
+transaction. Rejected rows are collected with their line number and
+errors instead of aborting the import.
+"""
+import csv
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+
+from .forms import ExpenseForm
+from .models import Category, Expense
+
+REQUIRED_COLUMNS = ("date", "category", "description", "amount", "payment_method")
+OPTIONAL_COLUMNS = ("receipt_link",)
+ERROR_COLUMNS = ("line", "errors") + REQUIRED_COLUMNS + OPTIONAL_COLUMNS
+DEFAULT_BATCH_SIZE = 1000
+
+
+class ImportFormatError(ValueError):
+    pass
+
+
+class RejectedRow:
+    def __init__(self, line, row, errors):
+        self.line = line
+        self.row = row
+        self.errors = errors
+
+    def as_csv_row(self):
+        return [self.line, "; ".join(self.errors)] + [
+            self.row.get(column, "") for column in REQUIRED_COLUMNS + OPTIONAL_COLUMNS
+        ]
+
+
+class ImportResult:
+    def __init__(self):
+        self.created = 0
+        self.categories_created = 0
+        self.rejected = []
+
+
+class ExpenseImporter:
+    def __init__(self, user=None, batch_size=DEFAULT_BATCH_SIZE, using="default"):
+        self.user = user
+        self.batch_size = batch_size
+        self.using = using
+        self.fields = {
+            name: field for name, field in ExpenseForm.base_fields.items() if name != "category"
+        }
+        self.category_max_length = Category._meta.get_field("name").max_length
+        self.category_ids = None
+
+    def clean_batch(self, rows):
+        """Validate ``(line, row)`` pairs, yielding ``(line, row, values, errors)``.
+
+        Each distinct value of a column is cleaned once per batch; statement
+        exports repeat the same dates, amounts and payment methods a lot.
+        """
+        columns = list(self.fields) + ["category"]
+        stripped = [{name: (row.get(name) or "").strip() for name in columns} for _, row in rows]
+        outcomes = {}
+        for name, field in self.fields.items():
+            cache = outcomes[name] = {}
+            for raw in stripped:
+                value = raw[name]
+                if value in cache:
+                    continue
+                try:
+                    cache[value] = (field.clean(value), ())
+                except ValidationError as exc:
+                    cache[value] = (None, [f"{name}: {message}" for message in exc.messages])
+
+        for (line, row), raw in zip(rows, stripped):
+            values, errors = {}, []
+            for name in self.fields:
+                values[name], field_errors = outcomes[name][raw[name]]
+                errors.extend(field_errors)
+            category = raw["category"]
+            if not category:
+                errors.append("category: This field is required.")
+            elif len(category) > self.category_max_length:
+                errors.append(
+                    f"category: Ensure this value has at most {self.category_max_length} characters."
+                )
+            values["category"] = category
+            yield line, row, values, errors
+
+    def resolve_categories(self, names, result):
+        missing = set(names) - set(self.category_ids)
+        if not missing:
+            return
+        Category.objects.using(self.using).bulk_create(
+            [Category(name=name) for name in missing], ignore_conflicts=True
+        )
+        created = Category.objects.using(self.using).filter(name__in=missing)
+        self.category_ids.update(created.values_list("name", "id"))
+        result.categories_created += len(missing)
+
+    def flush(self, rows, result):
+        valid = []
+        for line, row, values, errors in self.clean_batch(rows):
+            if errors:
+                result.rejected.append(RejectedRow(line, row, errors))
+            else:
+                valid.append(values)
+        rows.clear()
+        if not valid:
+            return
+        self.resolve_categories({values["category"] for values in valid}, result)
+        expenses = []
+        for values in valid:
+            values = dict(values, category_id=self.category_ids[values.pop("category")])
+            expenses.append(Expense(user=self.user, **values))
+        Expense.objects.using(self.using).bulk_create(expenses)
+        result.created += len(expenses)
+
+    def run(self, lines):
+        """Import rows from an iterable of CSV text lines."""
+        reader = csv.DictReader(lines)
+        if reader.fieldnames is None:
+            raise ImportFormatError("The file is empty.")
+        reader.fieldnames = [name.strip().lower() for name in reader.fieldnames]
+        missing = [column for column in REQUIRED_COLUMNS if column not in reader.fieldnames]
+        if missing:
+            raise ImportFormatError(f"Missing columns: {', '.join(missing)}")
+
+        result = ImportResult()
+        with transaction.atomic(using=self.using):
+            self.category_ids = dict(
+                Category.objects.using(self.using).values_list("name", "id")
+            )
+            batch = []
+            for row in reader:
+                batch.append((reader.line_num, row))
+                if len(batch) >= self.batch_size:
+                    self.flush(batch, result)
+            self.flush(batch, result)
+        return result
+
+
+def write_error_report(rejected, out):
+    writer = csv.writer(out)
+    writer.writerow(ERROR_COLUMNS)
+    for row in rejected:
+        writer.writerow(row.as_csv_row())
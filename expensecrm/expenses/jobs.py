@@ -0,0 +1,172 @@
+"""A database-backed job queue run by ``manage.py run_workers``.
+
+Jobs are rows of :class:`~expenses.models.Job`. A worker claims one with a
+conditional ``UPDATE ... WHERE status = 'queued'``, so several worker
+processes, or boxes sharing a PostgreSQL database, never run a job twice,
+and nothing beyond the database is needed. Tasks are plain functions
+registered with :func:`task`; they receive the job and its ``params`` and
+return a JSON-serializable result. A task that raises is retried with
+exponential backoff until ``max_attempts``; raise :class:`JobFailed` to
+fail at once.
+"""
+import os
+import socket
+import time
+import traceback
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Job
+
+TASKS = {}
+
+# Write progress at most this often, in seconds.
+PROGRESS_INTERVAL = 0.5
+
+
+class JobFailed(Exception):
+    """Fail the job without retrying; the message is shown to the user."""
+
+
+def task(name):
+    def register(func):
+        TASKS[name] = func
+        return func
+
+    return register
+
+
+def enqueue(kind, user=None, max_attempts=None, **params):
+    if kind not in TASKS:
+        raise ValueError(f"Unknown job kind {kind!r}")
+    return Job.objects.create(
+        kind=kind,
+        user=user,
+        params=params,
+        max_attempts=max_attempts or settings.EXPENSES_JOB_MAX_ATTEMPTS,
+        run_after=timezone.now(),
+    )
+
+
+def worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def claim(worker):
+    """Mark the next due job as running for ``worker`` and return it."""
+    now = timezone.now()
+    due = (
+        Job.objects.filter(status=Job.QUEUED, run_after__lte=now)
+        .order_by("run_after", "pk")
+        .values_list("pk", flat=True)
+    )
+    # Another worker may win the race for a row; try the next one.
+    for pk in due[:10]:
+        claimed = Job.objects.filter(pk=pk, status=Job.QUEUED).update(
+            status=Job.RUNNING,
+            worker=worker,
+            attempts=F("attempts") + 1,
+            started_at=now,
+            heartbeat_at=now,
+        )
+        if claimed:
+            return Job.objects.get(pk=pk)
+    return None
+
+
+def heartbeat(pks):
+    if pks:
+        Job.objects.filter(pk__in=pks, status=Job.RUNNING).update(heartbeat_at=timezone.now())
+
+
+def report_progress(job, done, total=None, force=False):
+    """Record how far ``job`` has got; cheap enough to call per chunk."""
+    now = time.monotonic()
+    if not force and now - getattr(job, "_progress_reported", 0) < PROGRESS_INTERVAL:
+        return
+    job._progress_reported = now
+    job.progress, job.total = done, total if total is not None else job.total
+    Job.objects.filter(pk=job.pk).update(
+        progress=job.progress, total=job.total, heartbeat_at=timezone.now()
+    )
+
+
+def execute(pk):
+    """Run the claimed job ``pk`` to completion; returns its new status."""
+    job = Job.objects.select_related("user").get(pk=pk)
+    try:
+        func = TASKS[job.kind]
+    except KeyError:
+        return finish(job, Job.FAILED, error=f"Unknown job kind {job.kind!r}")
+    try:
+        result = func(job, **job.params)
+    except JobFailed as exc:
+        return finish(job, Job.FAILED, error=str(exc))
+    except Exception:
+        error = traceback.format_exc()
+        if job.attempts < job.max_attempts:
+            delay = settings.EXPENSES_JOB_RETRY_DELAY * 2 ** (job.attempts - 1)
+            Job.objects.filter(pk=job.pk).update(
+                status=Job.QUEUED,
+                run_after=timezone.now() + timedelta(seconds=delay),
+                error=error,
+                worker="",
+            )
+            return Job.QUEUED
+        return finish(job, Job.FAILED, error=error)
+    return finish(job, Job.SUCCEEDED, result=result)
+
+
+def finish(job, status, result=None, error=""):
+    updates = {"status": status, "result": result, "error": error, "finished_at": timezone.now()}
+    if status == Job.SUCCEEDED and job.total is not None:
+        updates["progress"] = job.total
+    Job.objects.filter(pk=job.pk).update(**updates)
+    return status
+
+
+def requeue_stale():
+    """Give jobs whose worker stopped sending heartbeats back to the queue."""
+    now = timezone.now()
+    stale = Job.objects.filter(
+        status=Job.RUNNING,
+        heartbeat_at__lt=now - timedelta(seconds=settings.EXPENSES_JOB_TIMEOUT),
+    )
+    failed = stale.filter(attempts__gte=F("max_attempts")).update(
+        status=Job.FAILED, error="The worker running this job stopped.", finished_at=now
+    )
+    return failed + stale.update(status=Job.QUEUED, run_after=now, worker="")
+
+
+def purge(before=None):
+    """Delete finished jobs, and the files they wrote, older than the retention."""
+    if before is None:
+        before = timezone.now() - timedelta(days=settings.EXPENSES_JOB_RETENTION_DAYS)
+    old = Job.objects.filter(status__in=[Job.SUCCEEDED, Job.FAILED], finished_at__lt=before)
+    for params, result in old.values_list("params", "result"):
+        for path in (params.get("path"), (result or {}).get("path")):
+            if path:
+                job_file(path).unlink(missing_ok=True)
+    deleted, _ = old.delete()
+    return deleted
+
+
+def run_pending(worker=None):
+    """Run due jobs in this process until none are left; for tests and --burst."""
+    worker = worker or worker_name()
+    ran = 0
+    while (job := claim(worker)) is not None:
+        execute(job.pk)
+        ran += 1
+    return ran
+
+
+def job_file(name):
+    """Path of a file kept for a job, e.g. an upload or an export."""
+    directory = Path(settings.EXPENSES_JOB_FILES_DIR)
+    directory.mkdir(parents=True, exist_ok=True)
+    return directory / Path(name).name
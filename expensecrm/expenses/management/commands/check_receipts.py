@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from expenses import jobs, receipts
+
+
+class Command(BaseCommand):
+    help = "Fetch receipt links that are due for a check and store the receipts"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--limit", type=int, help="Check at most this many links")
+        parser.add_argument("--background", action="store_true", help="Queue the check for run_workers")
+
+    def handle(self, *args, **options):
+        if options["background"]:
+            job = jobs.enqueue("check_receipts", limit=options["limit"])
+            self.stdout.write(self.style.SUCCESS(f"Queued {job}."))
+            return
+        counts = receipts.check_due(options["limit"])
+        self.stdout.write(
+            self.style.SUCCESS(f"Checked {sum(counts.values())} receipt links: {counts['ok']} ok, {counts['broken']} broken.")
+        )
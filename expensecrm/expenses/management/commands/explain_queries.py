@@ -0,0 +1,121 @@
+import re
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+from expenses.export import EXPORT_COLUMNS
+from expenses.models import Category, Expense, ExpenseRollup
+from expenses.search import search
+
+# SQLite reports "SCAN <table>" without "USING ... INDEX" for a full scan
+# ("VIRTUAL TABLE INDEX" is a full-text index lookup); PostgreSQL reports
+# "Seq Scan on <table>".
+FULL_SCAN_PATTERNS = {
+    "sqlite": re.compile(r"\bSCAN (?:TABLE )?(\w+)(?! USING| VIRTUAL TABLE)(?:\s|$)"),
+    "postgresql": re.compile(r"\bSeq Scan on (\w+)"),
+}
+
+
+def hot_queries():
+    """The query shapes issued by the list, search, summary, charts, export and admin pages."""
+    category_id = Category.objects.values_list("id", flat=True).first() or 0
+    user_id = Expense.objects.exclude(user=None).values_list("user_id", flat=True).first() or 0
+    latest = Expense.objects.order_by("-date", "-id").first()
+    day = latest.date if latest else timezone.localdate()
+    last_pk = latest.pk if latest else 0
+    start = day - timedelta(days=30)
+    page_size = settings.EXPENSE_LIST_PAGE_SIZE + 1
+
+    year, next_year = day.replace(month=1, day=1), day.replace(year=day.year + 1, month=1, day=1)
+
+    page = Expense.objects.select_related("category", "user").order_by("-date", "-id").filter(user_id=user_id)
+    admin_list = Expense.objects.select_related("category").order_by("-date", "-id")
+    return [
+        ("expense_list first page", page[:page_size]),
+        (
+            "expense_list next page",
+            page.filter(Q(date__lt=day) | Q(date=day, pk__lt=last_pk), date__lte=day)[:page_size],
+        ),
+        ("expense_list by category", page.filter(category_id=category_id)[:page_size]),
+        (
+            "expense_list search",
+            search(page.filter(user_id=user_id), "lunch", user=User(pk=user_id))[:page_size],
+        ),
+        (
+            "expense_list total",
+            Expense.objects.filter(user_id=user_id).values("user_id").annotate(total=Sum("amount")),
+        ),
+        (
+            "expense_list category total",
+            Expense.objects.filter(user_id=user_id, category_id=category_id)
+            .values("category_id")
+            .annotate(total=Sum("amount")),
+        ),
+        (
+            "expense_summary date range",
+            ExpenseRollup.objects.filter(user_id=user_id, day__gte=start, day__lte=day)
+            .values("category__name")
+            .annotate(cents=Sum("total_cents"), count=Sum("count")),
+        ),
+        (
+            "aggregate monthly by category",
+            ExpenseRollup.objects.filter(user_id=user_id, day__gte=start, day__lte=day)
+            .values(period=TruncMonth("day"), key=F("category_id"))
+            .annotate(cents=Sum("total_cents"), n=Sum("count")),
+        ),
+        (
+            "export date range",
+            Expense.objects.filter(user_id=user_id, date__gte=start, date__lte=day)
+            .order_by("date", "id")
+            .values_list(*(lookup for _, lookup in EXPORT_COLUMNS)),
+        ),
+        ("admin list", admin_list[:100]),
+        ("admin category filter", admin_list.filter(category_id=category_id)[:100]),
+        ("admin payment method filter", admin_list.filter(payment_method="Card")[:100]),
+        ("admin date hierarchy year", admin_list.filter(date__gte=year, date__lt=next_year)[:100]),
+        (
+            "admin date hierarchy seek",
+            (Expense.objects.filter(date__gte=start) & Expense.objects.filter(date__gte=year, date__lt=next_year))
+            .order_by("date")
+            .values_list("date", flat=True)[:1],
+        ),
+        (
+            "admin category facet counts",
+            Expense.objects.filter(category_id=category_id)
+            .values("payment_method")
+            .annotate(n=Count("id")),
+        ),
+    ]
+
+
+def full_scans(plan, vendor=None):
+    pattern = FULL_SCAN_PATTERNS.get(vendor or connection.vendor)
+    if pattern is None:
+        return []
+    return sorted({table for table in pattern.findall(plan) if table.startswith("expenses_")})
+
+
+class Command(BaseCommand):
+    help = "EXPLAIN the hot expense queries and fail if any needs a full table scan"
+
+    def handle(self, *args, **options):
+        if connection.vendor not in FULL_SCAN_PATTERNS:
+            raise CommandError(f"Query plans cannot be checked on {connection.vendor}")
+        failures = []
+        for name, queryset in hot_queries():
+            plan = queryset.explain()
+            scans = full_scans(plan)
+            status = self.style.ERROR("FULL SCAN") if scans else self.style.SUCCESS("ok")
+            self.stdout.write(f"{name}: {status}")
+            if scans or options["verbosity"] > 1:
+                self.stdout.write("    " + plan.replace("\n", "\n    "))
+            if scans:
+                failures.append(f"{name} ({', '.join(scans)})")
+        if failures:
+            raise CommandError("Full table scans in: " + "; ".join(failures))
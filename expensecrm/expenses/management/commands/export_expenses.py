@@ -0,0 +1,42 @@
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from expenses.export import DEFAULT_CHUNK_SIZE, FORMATS, export_chunks
+from expenses.filters import filter_expenses, parse_expense_filters
+from expenses.models import Expense
+
+
+class Command(BaseCommand):
+    help = "Stream expenses to a CSV or JSON-lines file"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--format", choices=sorted(FORMATS), default="csv")
+        parser.add_argument("--output", "-o", help="Output file (defaults to stdout)")
+        parser.add_argument("--user", help="Only export expenses owned by this username")
+        parser.add_argument("--category", help="Only export this category id")
+        parser.add_argument("--start-date", help="YYYY-MM-DD, inclusive")
+        parser.add_argument("--end-date", help="YYYY-MM-DD, inclusive")
+        parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        try:
+            filters = parse_expense_filters(options)
+        except ValidationError as exc:
+            raise CommandError(exc.messages[0])
+        expenses = Expense.objects.all()
+        if options["user"]:
+            try:
+                user = User.objects.get(username=options["user"])
+            except User.DoesNotExist:
+                raise CommandError(f"Unknown user {options['user']!r}")
+            expenses = Expense.objects.for_user(user)
+        expenses = filter_expenses(expenses, filters)
+        chunks = export_chunks(expenses, options["format"], options["chunk_size"])
+
+        if options["output"]:
+            with open(options["output"], "w", newline="", encoding="utf-8") as out:
+                out.writelines(chunks)
+        else:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending="")
@@ -0,0 +1,37 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from expenses.importer import DEFAULT_BATCH_SIZE, ExpenseImporter, ImportFormatError, write_error_report
+
+
+class Command(BaseCommand):
+    help = "Import expenses from a CSV file"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="CSV file with date, category, description, amount, payment_method columns")
+        parser.add_argument("--user", help="Username that will own the imported expenses")
+        parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+        parser.add_argument("--errors", help="Write rejected rows to this CSV file")
+
+    def handle(self, *args, **options):
+        user = None
+        if options["user"]:
+            try:
+                user = User.objects.get(username=options["user"])
+            except User.DoesNotExist:
+                raise CommandError(f"Unknown user {options['user']!r}")
+
+        importer = ExpenseImporter(user=user, batch_size=options["batch_size"])
+        try:
+            with open(options["path"], newline="", encoding="utf-8-sig") as lines:
+                result = importer.run(lines)
+        except (OSError, ImportFormatError) as exc:
+            raise CommandError(str(exc))
+
+        if options["errors"] and result.rejected:
+            with open(options["errors"], "w", newline="", encoding="utf-8") as out:
+                write_error_report(result.rejected, out)
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {result.created} expenses, created {result.categories_created} categories, "
+            f"rejected {len(result.rejected)} rows."
+        ))
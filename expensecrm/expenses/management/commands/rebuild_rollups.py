@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+
+from expenses import jobs, rollups
+
+
+class Command(BaseCommand):
+    help = "Rebuild the expense rollup table from the raw expenses"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--database", default=DEFAULT_DB_ALIAS)
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument("--background", action="store_true", help="Queue the rebuild for run_workers")
+
+    def handle(self, *args, **options):
+        if options["background"]:
+            job = jobs.enqueue("rebuild_rollups", database=options["database"])
+            self.stdout.write(self.style.SUCCESS(f"Queued {job}."))
+            return
+        buckets = rollups.rebuild(using=options["database"], batch_size=options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {buckets} rollup rows."))
@@ -0,0 +1,106 @@
+import multiprocessing
+import signal
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from expenses import jobs, receipts, worker
+
+
+class Command(BaseCommand):
+    help = "Run queued background jobs (exports, imports, bulk actions, rollup rebuilds)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--processes", type=int, default=settings.EXPENSES_JOB_PROCESSES,
+            help="Worker processes; 0 runs jobs in this process",
+        )
+        parser.add_argument("--burst", action="store_true", help="Exit once the queue is empty")
+        parser.add_argument("--poll-interval", type=float, default=1.0, help="Seconds between queue checks")
+
+    def handle(self, *args, **options):
+        if options["processes"] < 0:
+            raise CommandError("--processes must be 0 or more")
+        self.stopping = False
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        self.worker = jobs.worker_name()
+        self.last_stale_check = 0
+        self.last_receipt_check = 0
+        if options["processes"] == 0:
+            self.run_inline(options["burst"], options["poll_interval"])
+        else:
+            self.run_pool(options["processes"], options["burst"], options["poll_interval"])
+
+    def stop(self, signum, frame):
+        self.stdout.write("Stopping after the running jobs finish...")
+        self.stopping = True
+
+    def housekeeping(self):
+        close_old_connections()
+        now = time.monotonic()
+        if now - self.last_stale_check >= settings.EXPENSES_JOB_TIMEOUT / 2:
+            self.last_stale_check = now
+            jobs.requeue_stale()
+            jobs.purge()
+        interval = settings.EXPENSES_RECEIPT_CHECK_INTERVAL
+        if interval and now - self.last_receipt_check >= interval:
+            self.last_receipt_check = now
+            receipts.schedule()
+
+    def report(self, job, status):
+        self.stdout.write(f"{job} -> {status}")
+
+    def run_inline(self, burst, poll_interval):
+        while not self.stopping:
+            self.housekeeping()
+            job = jobs.claim(self.worker)
+            if job is not None:
+                self.report(job, jobs.execute(job.pk))
+                continue
+            if burst:
+                return
+            time.sleep(poll_interval)
+
+    def run_pool(self, processes, burst, poll_interval):
+        # Spawned children set Django up from scratch instead of sharing
+        # the parent's database connections across fork().
+        context = multiprocessing.get_context("spawn")
+        pool = ProcessPoolExecutor(processes, mp_context=context, initializer=worker.setup)
+        running = {}
+        try:
+            while running or not self.stopping:
+                self.housekeeping()
+                jobs.heartbeat([job.pk for job in running.values()])
+                while not self.stopping and len(running) < processes:
+                    job = jobs.claim(self.worker)
+                    if job is None:
+                        break
+                    running[pool.submit(jobs.execute, job.pk)] = job
+                if not running:
+                    if burst:
+                        return
+                    time.sleep(poll_interval)
+                    continue
+                done, _ = wait(running, timeout=poll_interval, return_when=FIRST_COMPLETED)
+                for future in done:
+                    job = running.pop(future)
+                    try:
+                        self.report(job, future.result())
+                    except BrokenProcessPool:
+                        # A child died, taking the pool with it. Its jobs
+                        # stop getting heartbeats and are requeued.
+                        for job in [job, *running.values()]:
+                            self.stderr.write(f"{job}: worker process died")
+                        running.clear()
+                        pool.shutdown(wait=False, cancel_futures=True)
+                        pool = ProcessPoolExecutor(processes, mp_context=context, initializer=worker.setup)
+                        break
+                    except Exception as exc:
+                        self.stderr.write(f"{job}: {exc!r}")
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
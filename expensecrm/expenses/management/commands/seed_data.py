@@ -1,47 +1,114 @@
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth.hashers import make_password
 from django.contrib.auth.models import User
+from django.utils import timezone
 from expenses.models import Category, Expense
 from faker import Faker
+from datetime import date, timedelta
 from decimal import Decimal
 import random
+import time
+
+CATEGORY_NAMES = [
+    "Food",
+    "Travel",
+    "Office",
+    "Utilities",
+    "Entertainment",
+]
+# Where seeded runs end unless told otherwise, so the same --seed gives the
+# same rows whatever the day.
+SEED_END_DATE = date(2024, 12, 31)
+
 
 class Command(BaseCommand):
     help = "Seed the database with demo data"
 
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=10)
+        parser.add_argument("--username-prefix", default="user", help="Users are named <prefix>1, <prefix>2, ...")
+        parser.add_argument("--categories", type=int, default=len(CATEGORY_NAMES))
+        parser.add_argument("--expenses", type=int, default=50)
+        parser.add_argument("--days", type=int, default=365, help="Spread expenses over this many days")
+        parser.add_argument(
+            "--end-date", type=date.fromisoformat,
+            help=f"Last day of the spread (default: today, or {SEED_END_DATE} with --seed)",
+        )
+        parser.add_argument("--seed", type=int, help="Random seed for reproducible data")
+        parser.add_argument("--batch-size", type=int, default=5000)
+        parser.add_argument(
+            "--pool-size", type=int, default=1000,
+            help="Number of distinct Faker sentences and URLs to draw from",
+        )
+
     def handle(self, *args, **options):
+        if min(options["users"], options["categories"], options["days"], options["batch_size"]) < 1:
+            raise CommandError("--users, --categories, --days and --batch-size must be positive")
+        rng = random.Random(options["seed"])
         faker = Faker()
-        categories = [
-            "Food",
-            "Travel",
-            "Office",
-            "Utilities",
-            "Entertainment",
-        ]
-        category_objs = []
-        for name in categories:
-            obj, _ = Category.objects.get_or_create(name=name)
-            category_objs.append(obj)
-
-        users = []
-        for i in range(10):
-            username = f"user{i+1}"
-            user, created = User.objects.get_or_create(username=username)
-            if created:
-                user.set_password("password")
-                user.save()
-            users.append(user)
+        if options["seed"] is not None:
+            faker.seed_instance(options["seed"])
+
+        category_ids = self.seed_categories(options["categories"])
+        user_ids = self.seed_users(options["users"], options["username_prefix"])
 
+        pool_size = max(1, options["pool_size"])
+        descriptions = [faker.sentence() for _ in range(pool_size)]
+        receipt_links = [faker.url() for _ in range(pool_size)]
+        end_date = options["end_date"]
+        if end_date is None:
+            end_date = SEED_END_DATE if options["seed"] is not None else timezone.localdate()
+        dates = [end_date - timedelta(days=offset) for offset in range(options["days"])]
         payment_methods = [choice[0] for choice in Expense.PAYMENT_METHOD_CHOICES]
 
-        for _ in range(50):
-            Expense.objects.create(
-                user=random.choice(users),
-                date=faker.date_between(start_date="-1y", end_date="today"),
-                category=random.choice(category_objs),
-                description=faker.sentence(),
-                amount=Decimal(f"{random.uniform(5, 500):.2f}"),
-                payment_method=random.choice(payment_methods),
-                receipt_link=faker.url(),
+        total, batch_size = options["expenses"], options["batch_size"]
+        started = time.perf_counter()
+        for offset in range(0, total, batch_size):
+            k = min(batch_size, total - offset)
+            # Draw each column for the whole batch at once.
+            columns = zip(
+                rng.choices(user_ids, k=k),
+                rng.choices(dates, k=k),
+                rng.choices(category_ids, k=k),
+                rng.choices(descriptions, k=k),
+                (Decimal(cents) / 100 for cents in rng.choices(range(500, 50001), k=k)),
+                rng.choices(payment_methods, k=k),
+                rng.choices(receipt_links, k=k),
             )
+            Expense.objects.bulk_create(
+                [
+                    Expense(
+                        user_id=user_id,
+                        date=day,
+                        category_id=category_id,
+                        description=description,
+                        amount=amount,
+                        payment_method=payment_method,
+                        receipt_link=receipt_link,
+                    )
+                    for user_id, day, category_id, description, amount, payment_method, receipt_link in columns
+                ]
+            )
+            if options["verbosity"] > 1:
+                done = offset + k
+                rate = done / (time.perf_counter() - started)
+                self.stdout.write(f"{done}/{total} expenses ({rate:.0f}/s)")
 
         self.stdout.write(self.style.SUCCESS("Database successfully seeded."))
+
+    def seed_categories(self, count):
+        names = CATEGORY_NAMES[:count] + [
+            f"Category {i + 1}" for i in range(len(CATEGORY_NAMES), count)
+        ]
+        Category.objects.bulk_create([Category(name=name) for name in names], ignore_conflicts=True)
+        return list(Category.objects.filter(name__in=names).order_by("pk").values_list("id", flat=True))
+
+    def seed_users(self, count, prefix):
+        usernames = [f"{prefix}{i + 1}" for i in range(count)]
+        existing = set(User.objects.filter(username__in=usernames).values_list("username", flat=True))
+        # Hashing is deliberately slow, so every new user shares one hash.
+        password = make_password("password")
+        User.objects.bulk_create(
+            [User(username=name, password=password) for name in usernames if name not in existing]
+        )
+        return list(User.objects.filter(username__in=usernames).order_by("pk").values_list("id", flat=True))
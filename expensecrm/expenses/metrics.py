@@ -0,0 +1,212 @@
+"""Per-process request metrics in the Prometheus text format.
+
+``middleware.MetricsMiddleware`` opens a :class:`RequestStats` for every
+request. Queries are timed by a wrapper installed once on each database
+connection and templates by the ``TimedTemplates`` backend; both report to
+the request in progress through a context variable, so they cost one
+lookup when no request is being measured. Each process keeps its own
+counters: scrape every worker, or sum them in Prometheus.
+"""
+import heapq
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from itertools import count
+
+from django.conf import settings
+from django.template.backends.django import DjangoTemplates
+
+# Seconds; the last bucket is +Inf.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_current = ContextVar("expenses_request_stats", default=None)
+
+
+class RequestStats:
+    __slots__ = ("queries", "sql_seconds", "template_seconds", "slowest", "_seq")
+
+    def __init__(self):
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.template_seconds = 0.0
+        # Min-heap of (seconds, seq, sql) holding the slowest queries.
+        self.slowest = []
+        self._seq = count()
+
+    def add_query(self, sql, seconds):
+        self.queries += 1
+        self.sql_seconds += seconds
+        item = (seconds, next(self._seq), sql)
+        if len(self.slowest) < settings.EXPENSES_SLOW_REQUEST_QUERIES:
+            heapq.heappush(self.slowest, item)
+        elif self.slowest and seconds > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, item)
+
+    def slowest_queries(self):
+        return [(seconds, sql) for seconds, _, sql in sorted(self.slowest, reverse=True)]
+
+
+def start():
+    stats = RequestStats()
+    return stats, _current.set(stats)
+
+
+def stop(token):
+    _current.reset(token)
+
+
+def record_query(execute, sql, params, many, context):
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.add_query(sql, time.perf_counter() - started)
+
+
+def install_query_timer(sender, connection, **kwargs):
+    """``connection_created`` hook: time every query on ``connection``."""
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, record_query)
+
+
+class TimedTemplate:
+    def __init__(self, template):
+        self.template = template
+
+    def __getattr__(self, name):
+        return getattr(self.template, name)
+
+    def render(self, context=None, request=None):
+        stats = _current.get()
+        if stats is None:
+            return self.template.render(context, request)
+        started = time.perf_counter()
+        try:
+            return self.template.render(context, request)
+        finally:
+            stats.template_seconds += time.perf_counter() - started
+
+
+class TimedTemplates(DjangoTemplates):
+    """The Django template backend, timing renders for the metrics."""
+
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name))
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = {}  # (view, method, status) -> count
+        self.latency = {}  # (view, method) -> [bucket counts..., +Inf, sum]
+        self.totals = {}  # (metric, view) -> value
+
+    def observe(self, view, method, status, seconds, stats, size):
+        bucket = bisect_left(LATENCY_BUCKETS, seconds)
+        with self._lock:
+            key = (view, method, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            histogram = self.latency.get((view, method))
+            if histogram is None:
+                histogram = self.latency[(view, method)] = [0] * (len(LATENCY_BUCKETS) + 1) + [0.0]
+            histogram[bucket] += 1
+            histogram[-1] += seconds
+            for metric, value in (
+                ("sql_queries", stats.queries),
+                ("sql_seconds", stats.sql_seconds),
+                ("template_seconds", stats.template_seconds),
+                ("response_bytes", size),
+            ):
+                self.totals[(metric, view)] = self.totals.get((metric, view), 0) + value
+
+    def add(self, metric, view, value):
+        with self._lock:
+            self.totals[(metric, view)] = self.totals.get((metric, view), 0) + value
+
+    def reset(self):
+        with self._lock:
+            self.requests.clear()
+            self.latency.clear()
+            self.totals.clear()
+
+    def render(self, extra=()):
+        with self._lock:
+            requests = sorted(self.requests.items())
+            latency = sorted((key, list(values)) for key, values in self.latency.items())
+            totals = sorted(self.totals.items())
+        lines = [
+            "# HELP expenses_requests_total Requests by view, method and status.",
+            "# TYPE expenses_requests_total counter",
+        ]
+        for (view, method, status), value in requests:
+            lines.append(
+                f'expenses_requests_total{{view="{view}",method="{method}",status="{status}"}} {value}'
+            )
+        lines += [
+            "# HELP expenses_request_seconds Time until the response was returned.",
+            "# TYPE expenses_request_seconds histogram",
+        ]
+        for (view, method), values in latency:
+            labels = f'view="{view}",method="{method}"'
+            cumulative = 0
+            for bound, observed in zip(LATENCY_BUCKETS + ("+Inf",), values):
+                cumulative += observed
+                lines.append(f'expenses_request_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f"expenses_request_seconds_sum{{{labels}}} {values[-1]:.6f}")
+            lines.append(f"expenses_request_seconds_count{{{labels}}} {cumulative}")
+        descriptions = {
+            "sql_queries": "SQL queries issued.",
+            "sql_seconds": "Time spent in SQL queries.",
+            "template_seconds": "Time spent rendering templates.",
+            "response_bytes": "Bytes of response body.",
+        }
+        for metric, description in descriptions.items():
+            lines += [
+                f"# HELP expenses_{metric}_total {description}",
+                f"# TYPE expenses_{metric}_total counter",
+            ]
+            for (name, view), value in totals:
+                if name == metric:
+                    value = f"{value:.6f}" if isinstance(value, float) else value
+                    lines.append(f'expenses_{metric}_total{{view="{view}"}} {value}')
+        for name, kind, description, samples in extra:
+            lines += [f"# HELP {name} {description}", f"# TYPE {name} {kind}"]
+            for labels, value in samples:
+                label_text = ",".join(f'{key}="{val}"' for key, val in labels.items())
+                lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+def cache_metrics():
+    """Hit/miss counters and sizes of the in-process caches."""
+    from .cache import category_cache, token_cache
+
+    caches = {"categories": category_cache.stats(), "tokens": token_cache.stats()}
+    return [
+        (
+            "expenses_cache_requests_total",
+            "counter",
+            "In-process cache lookups by result.",
+            [
+                ({"cache": name, "result": result}, stats[key])
+                for name, stats in caches.items()
+                for result, key in (("hit", "hits"), ("miss", "misses"))
+            ],
+        ),
+        (
+            "expenses_cache_entries",
+            "gauge",
+            "Entries held by in-process caches.",
+            [({"cache": name}, stats["size"]) for name, stats in caches.items()],
+        ),
+    ]
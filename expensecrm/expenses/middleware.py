@@ -0,0 +1,98 @@
+import logging
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from . import metrics
+
+logger = logging.getLogger("expenses.slow_requests")
+
+
+class MetricsMiddleware:
+    """Record latency, SQL, template time and response size per view.
+
+    Put it first in ``MIDDLEWARE`` so the other middleware's queries count
+    too. Requests slower than ``EXPENSES_SLOW_REQUEST_SECONDS`` are logged
+    with their slowest queries.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        stats, token = metrics.start()
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            metrics.stop(token)
+        self.finish(request, response, stats, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        stats, token = metrics.start()
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            metrics.stop(token)
+        self.finish(request, response, stats, time.perf_counter() - started)
+        return response
+
+    def finish(self, request, response, stats, seconds):
+        match = request.resolver_match
+        view = match.view_name if match is not None else "unmatched"
+        if response.streaming:
+            # Latency covers the time to the first byte; the body is counted
+            # as it is sent.
+            size = 0
+            response.streaming_content = count_bytes(view, response)
+        else:
+            size = len(response.content)
+        metrics.registry.observe(view, request.method, response.status_code, seconds, stats, size)
+        if seconds >= settings.EXPENSES_SLOW_REQUEST_SECONDS:
+            logger.warning(
+                "Slow request: %s %s took %.3fs (%d queries, %.3fs SQL, %.3fs templates)%s",
+                request.method,
+                request.path,
+                seconds,
+                stats.queries,
+                stats.sql_seconds,
+                stats.template_seconds,
+                "".join(f"\n  {sql_seconds:.3f}s {sql}" for sql_seconds, sql in stats.slowest_queries()),
+            )
+
+
+def count_bytes(view, response):
+    if response.is_async:
+        return _acount_bytes(view, response.streaming_content)
+    return _count_bytes(view, response.streaming_content)
+
+
+def _count_bytes(view, chunks):
+    size = 0
+    try:
+        for chunk in chunks:
+            size += len(chunk)
+            yield chunk
+    finally:
+        metrics.registry.add("response_bytes", view, size)
+
+
+async def _acount_bytes(view, chunks):
+    size = 0
+    try:
+        async for chunk in chunks:
+            size += len(chunk)
+            yield chunk
+    finally:
+        metrics.registry.add("response_bytes", view, size)
@@ -0,0 +1,86 @@
+# Generated by Django 4.2 on 2026-10-18 12:13
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def populate_rollups(apps, schema_editor):
+    Expense = apps.get_model("expenses", "Expense")
+    ExpenseRollup = apps.get_model("expenses", "ExpenseRollup")
+    db = schema_editor.connection.alias
+    rows = (
+        Expense.objects.using(db)
+        .order_by()
+        .values("date", "category_id", "user_id", "payment_method")
+        .annotate(total=models.Sum("amount"), count=models.Count("pk"))
+    )
+    ExpenseRollup.objects.using(db).bulk_create(
+        (
+            ExpenseRollup(
+                day=row["date"],
+                category_id=row["category_id"],
+                user_id=row["user_id"],
+                payment_method=row["payment_method"],
+                total_cents=int(row["total"] * 100),
+                count=row["count"],
+            )
+            for row in rows.iterator()
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("expenses", "0003_expense_user"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ExpenseRollup",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("day", models.DateField()),
+                ("payment_method", models.CharField(max_length=20)),
+                ("total_cents", models.BigIntegerField(default=0)),
+                ("count", models.IntegerField(default=0)),
+                (
+                    "category",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="expenses.category",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="expenserollup",
+            constraint=models.UniqueConstraint(
+                fields=("day", "category", "user", "payment_method"),
+                name="expense_rollup_bucket_unique",
+            ),
+        ),
+        migrations.RunPython(populate_rollups, migrations.RunPython.noop),
+    ]
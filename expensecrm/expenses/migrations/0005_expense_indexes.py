@@ -0,0 +1,36 @@
+# Generated by Django 4.2 on 2026-10-18 12:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("expenses", "0004_expenserollup"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="expense",
+            index=models.Index(fields=["-date", "-id"], name="expense_date_id_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="expense",
+            index=models.Index(
+                fields=["category", "-date", "-id"], name="expense_category_date_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="expense",
+            index=models.Index(
+                fields=["user", "-date", "-id"], name="expense_user_date_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="expense",
+            index=models.Index(
+                fields=["payment_method", "-date", "-id"],
+                name="expense_payment_date_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 4.2 on 2026-10-18 12:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("expenses", "0005_expense_indexes"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="expense",
+            index=models.Index(
+                fields=["user", "category", "-date", "-id"],
+                name="expense_user_category_date_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="expenserollup",
+            index=models.Index(fields=["user", "day"], name="rollup_user_day_idx"),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2 on 2026-10-18 12:30
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("auth", "0012_alter_user_first_name_max_length"),
+        ("expenses", "0006_owner_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DataGeneration",
+            fields=[
+                (
+                    "user",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="+",
+                        serialize=False,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                ("generation", models.BigIntegerField(default=0)),
+                ("updated_at", models.DateTimeField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,22 @@
+from django.db import migrations
+
+from expenses import search
+
+
+def install_search(apps, schema_editor):
+    search.install(schema_editor, apps.get_model("expenses", "Expense"))
+
+
+def uninstall_search(apps, schema_editor):
+    search.uninstall(schema_editor, apps.get_model("expenses", "Expense"))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("expenses", "0007_datageneration"),
+    ]
+
+    operations = [
+        migrations.RunPython(install_search, uninstall_search),
+    ]
@@ -0,0 +1,87 @@
+# Generated by Django 4.2 on 2026-10-18 13:38
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("expenses", "0009_job"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Receipt",
+            fields=[
+                (
+                    "sha256",
+                    models.CharField(max_length=64, primary_key=True, serialize=False),
+                ),
+                ("content_type", models.CharField(max_length=100)),
+                ("size", models.PositiveBigIntegerField()),
+                ("has_thumbnail", models.BooleanField(default=False)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name="ReceiptLink",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("url", models.URLField(unique=True)),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("pending", "Not checked yet"),
+                            ("ok", "OK"),
+                            ("broken", "Broken"),
+                        ],
+                        default="pending",
+                        max_length=10,
+                    ),
+                ),
+                (
+                    "http_status",
+                    models.PositiveSmallIntegerField(blank=True, null=True),
+                ),
+                ("error", models.CharField(blank=True, max_length=255)),
+                ("etag", models.CharField(blank=True, max_length=255)),
+                ("last_modified", models.CharField(blank=True, max_length=100)),
+                ("failures", models.PositiveIntegerField(default=0)),
+                ("checked_at", models.DateTimeField(blank=True, null=True)),
+                ("next_check_at", models.DateTimeField()),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="expense",
+            index=models.Index(
+                fields=["receipt_link"], name="expense_receipt_link_idx"
+            ),
+        ),
+        migrations.AddField(
+            model_name="receiptlink",
+            name="receipt",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="links",
+                to="expenses.receipt",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="receiptlink",
+            index=models.Index(
+                fields=["next_check_at"], name="receipt_link_next_check_idx"
+            ),
+        ),
+    ]
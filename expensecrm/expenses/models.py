@@ -1,10 +1,45 @@
-from django.db import models
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models, router, transaction
 from django.contrib.auth.models import User
 
+from .cache import category_cache
+
+
+class CategoryQuerySet(models.QuerySet):
+    """Invalidates the category cache on writes that send no signals."""
+
+    def _invalidate(self):
+        from . import generations
+
+        category_cache.invalidate()
+        # Another request may have refilled the cache before this commit.
+        transaction.on_commit(category_cache.invalidate, using=self.db)
+        # Cached summaries show category names.
+        generations.bump_all(using=self.db)
+
+    def bulk_create(self, *args, **kwargs):
+        objs = super().bulk_create(*args, **kwargs)
+        self._invalidate()
+        return objs
+
+    def bulk_update(self, *args, **kwargs):
+        rows = super().bulk_update(*args, **kwargs)
+        self._invalidate()
+        return rows
+
+    def update(self, **kwargs):
+        rows = super().update(**kwargs)
+        self._invalidate()
+        return rows
+
+    update.alters_data = True
+
 
 class Category(models.Model):
     name = models.CharField(max_length=50, unique=True)
 
+    objects = CategoryQuerySet.as_manager()
+
     class Meta:
         ordering = ["name"]
 
@@ -12,6 +47,105 @@ class Category(models.Model):
         return self.name
 
 
+class OwnedQuerySet(models.QuerySet):
+    def for_user(self, user):
+        """Rows owned by ``user``; page cost then tracks that user's data only."""
+        if not user.is_authenticated:
+            return self.none()
+        return self.filter(user=user)
+
+
+class ExpenseQuerySet(OwnedQuerySet):
+    """Keeps ``ExpenseRollup`` in step with bulk writes.
+
+    Each bulk operation applies one grouped delta per rollup bucket instead
+    of touching the rollup once per expense row.
+    """
+
+    def bulk_create(self, objs, *args, **kwargs):
+        from . import generations, rollups
+
+        with transaction.atomic(using=self.db):
+            objs = super().bulk_create(objs, *args, **kwargs)
+            if not (kwargs.get("ignore_conflicts") or kwargs.get("update_conflicts")):
+                rollups.apply_deltas(rollups.deltas_from_instances(objs), using=self.db)
+            generations.bump({obj.user_id for obj in objs}, using=self.db)
+        return objs
+
+    def bulk_update(self, objs, fields, batch_size=None):
+        # Each batch is an update() with CASE expressions, which re-reads
+        # the batch's buckets; the transaction keeps the batches together.
+        with transaction.atomic(using=self.db):
+            return super().bulk_update(objs, fields, batch_size=batch_size)
+
+    def update(self, **kwargs):
+        from . import generations, rollups
+
+        with transaction.atomic(using=self.db):
+            rows, deltas, users = self.update_deltas(**kwargs)
+            rollups.apply_deltas(deltas, using=self.db)
+            generations.bump(users, using=self.db)
+        return rows
+
+    update.alters_data = True
+
+    def update_deltas(self, **kwargs):
+        """Run the UPDATE only; return ``(rows, rollup deltas, user ids)``.
+
+        The caller applies the deltas and bumps the users in the same
+        transaction, which lets chunked bulk actions do that once.
+        """
+        from . import generations, rollups
+
+        if not rollups.ROLLUP_FIELDS.intersection(kwargs):
+            users = set(self.order_by().values_list("user_id", flat=True).distinct())
+            return super().update(**kwargs), rollups.new_deltas(), users
+        values = rollups.constant_values(self.model, kwargs)
+        if values is not None:
+            # Constants move whole buckets: group once, update once.
+            before = rollups.deltas_from_queryset(self)
+            rows = super().update(**kwargs)
+            deltas = rollups.reassigned_deltas(before, values)
+        else:
+            # The new values are only known after the UPDATE, and the
+            # updated rows may no longer match this queryset's filters.
+            pks = list(self.values_list("pk", flat=True))
+            base = self.model._base_manager.using(self.db)
+            deltas = rollups.deltas_from_pks(base, pks, sign=-1)
+            rows = super().update(**kwargs)
+            rollups.merge_deltas(deltas, rollups.deltas_from_pks(base, pks))
+        return rows, deltas, generations.users_in(deltas)
+
+    update_deltas.alters_data = True
+    update_deltas.queryset_only = True
+
+    def delete(self):
+        from . import generations, rollups
+
+        with transaction.atomic(using=self.db):
+            deleted, deltas = self.delete_deltas()
+            rollups.apply_deltas(deltas, using=self.db)
+            generations.bump(generations.users_in(deltas), using=self.db)
+        return deleted, {self.model._meta.label: deleted}
+
+    delete.alters_data = True
+    delete.queryset_only = True
+
+    def delete_deltas(self):
+        """Run the DELETE only; return ``(rows, rollup deltas)``, as :meth:`update_deltas`."""
+        from . import rollups
+
+        if self.query.is_sliced:
+            raise TypeError("Cannot use 'limit' or 'offset' with delete().")
+        # Nothing references Expense, so the collector (which would load and
+        # signal every row) can be skipped in favour of one DELETE.
+        deltas = rollups.deltas_from_queryset(self, sign=-1)
+        return self._chain()._raw_delete(using=self.db), deltas
+
+    delete_deltas.alters_data = True
+    delete_deltas.queryset_only = True
+
+
 class Expense(models.Model):
     PAYMENT_METHOD_CHOICES = [
         ("Cash", "Cash"),
@@ -27,5 +161,188 @@ class Expense(models.Model):
     payment_method = models.CharField(max_length=20, choices=PAYMENT_METHOD_CHOICES)
     receipt_link = models.URLField(blank=True, null=True)
 
+    objects = ExpenseQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Expense list: newest first, keyset-paginated on (date, id).
+            models.Index(fields=["-date", "-id"], name="expense_date_id_idx"),
+            # Expense list filtered by category, admin category filter.
+            models.Index(fields=["category", "-date", "-id"], name="expense_category_date_idx"),
+            # Per-user scoping of every page, with and without a category.
+            models.Index(fields=["user", "-date", "-id"], name="expense_user_date_idx"),
+            models.Index(
+                fields=["user", "category", "-date", "-id"], name="expense_user_category_date_idx"
+            ),
+            # Admin payment method filter.
+            models.Index(fields=["payment_method", "-date", "-id"], name="expense_payment_date_idx"),
+            # Distinct receipt links, and the expenses behind a checked link.
+            models.Index(fields=["receipt_link"], name="expense_receipt_link_idx"),
+        ]
+
+    def __str__(self):
+        name = category_cache.name(self.category_id)
+        if name is None:
+            name = self.category.name
+        return f"{self.date} - {name} - {self.amount:.2f}"
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored values so a later save() can tell which
+        # rollup bucket the row is leaving.
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def save(self, *args, **kwargs):
+        using = kwargs.get("using") or router.db_for_write(type(self), instance=self)
+        with transaction.atomic(using=using):
+            super().save(*args, **kwargs)
+
+
+class ExpenseRollup(models.Model):
+    """Expense totals per (day, category, user, payment method).
+
+    Amounts are kept as integer cents so repeated incremental updates stay
+    exact on backends without a native decimal type.
+    """
+
+    day = models.DateField()
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name="+")
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="+", null=True, blank=True)
+    payment_method = models.CharField(max_length=20)
+    total_cents = models.BigIntegerField(default=0)
+    count = models.IntegerField(default=0)
+
+    objects = OwnedQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["day", "category", "user", "payment_method"],
+                name="expense_rollup_bucket_unique",
+            ),
+        ]
+        indexes = [
+            models.Index(fields=["user", "day"], name="rollup_user_day_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.day} - {self.category_id} - {self.user_id} - {self.payment_method}"
+
+
+class DataGeneration(models.Model):
+    """Per-user counter that moves forward whenever the user's expenses change.
+
+    Cached aggregates are keyed on it, see ``expenses.generations``.
+    """
+
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name="+")
+    generation = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.user_id} - {self.generation}"
+
+
+class Job(models.Model):
+    """Work queued for ``manage.py run_workers``, see ``expenses.jobs``."""
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (QUEUED, "Queued"),
+        (RUNNING, "Running"),
+        (SUCCEEDED, "Succeeded"),
+        (FAILED, "Failed"),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="+", null=True, blank=True)
+    kind = models.CharField(max_length=50)
+    params = models.JSONField(default=dict, encoder=DjangoJSONEncoder)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    # Run no earlier than this; pushed back after a failed attempt.
+    run_after = models.DateTimeField()
+    progress = models.PositiveBigIntegerField(default=0)
+    total = models.PositiveBigIntegerField(null=True, blank=True)
+    result = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    error = models.TextField(blank=True)
+    worker = models.CharField(max_length=100, blank=True)
+    # Refreshed while the job runs; a stale one means its worker died.
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    objects = OwnedQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Workers claiming the next due job.
+            models.Index(fields=["status", "run_after"], name="job_status_run_after_idx"),
+            # A user's recent jobs in the status API.
+            models.Index(fields=["user", "-created_at"], name="job_user_created_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} #{self.pk} ({self.status})"
+
+    @property
+    def error_message(self):
+        """The last line of ``error``; the rest of a traceback is for the logs."""
+        lines = self.error.strip().splitlines()
+        return lines[-1] if lines else ""
+
+
+class Receipt(models.Model):
+    """A fetched receipt file, stored once per content hash, see ``expenses.receipts``."""
+
+    sha256 = models.CharField(max_length=64, primary_key=True)
+    content_type = models.CharField(max_length=100)
+    size = models.PositiveBigIntegerField()
+    has_thumbnail = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.sha256[:12]} ({self.content_type}, {self.size} bytes)"
+
+
+class ReceiptLink(models.Model):
+    """The last check of a receipt URL, shared by every expense linking to it."""
+
+    PENDING = "pending"
+    OK = "ok"
+    BROKEN = "broken"
+    STATUS_CHOICES = [
+        (PENDING, "Not checked yet"),
+        (OK, "OK"),
+        (BROKEN, "Broken"),
+    ]
+
+    url = models.URLField(unique=True)
+    # The last file fetched from the URL; kept when a later check fails.
+    receipt = models.ForeignKey(
+        Receipt, on_delete=models.SET_NULL, related_name="links", null=True, blank=True
+    )
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    http_status = models.PositiveSmallIntegerField(null=True, blank=True)
+    error = models.CharField(max_length=255, blank=True)
+    # Validators sent back on the next check, so unchanged files aren't downloaded again.
+    etag = models.CharField(max_length=255, blank=True)
+    last_modified = models.CharField(max_length=100, blank=True)
+    failures = models.PositiveIntegerField(default=0)
+    checked_at = models.DateTimeField(null=True, blank=True)
+    next_check_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            # Links due for a check.
+            models.Index(fields=["next_check_at"], name="receipt_link_next_check_idx"),
+        ]
+
     def __str__(self):
-        return f"{self.date} - {self.category.name} - {self.amount:.2f}"
+        return f"{self.url} ({self.status})"
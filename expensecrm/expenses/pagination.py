@@ -0,0 +1,201 @@
+import base64
+from datetime import date
+
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(expense):
+    raw = f"{expense.date.isoformat()}|{expense.pk}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode()).decode()
+        day, pk = raw.split("|")
+        return date.fromisoformat(day), int(pk)
+    except (ValueError, UnicodeDecodeError) as exc:
+        raise InvalidCursor(cursor) from exc
+
+
+def encode_offset(offset):
+    return base64.urlsafe_b64encode(f"o|{offset}".encode()).decode().rstrip("=")
+
+
+def decode_offset(cursor):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        kind, offset = base64.urlsafe_b64decode(padded.encode()).decode().split("|")
+        if kind != "o" or int(offset) < 0:
+            raise ValueError(cursor)
+        return int(offset)
+    except (ValueError, UnicodeDecodeError) as exc:
+        raise InvalidCursor(cursor) from exc
+
+
+def get_page_size(request):
+    default = settings.EXPENSE_LIST_PAGE_SIZE
+    try:
+        size = int(request.GET.get("page_size", default))
+    except (TypeError, ValueError):
+        size = default
+    return max(1, min(size, settings.EXPENSE_LIST_MAX_PAGE_SIZE))
+
+
+class KeysetPage:
+    """One page of expenses and the cursor of the next one.
+
+    ``object_list`` is a plain list so templates can loop over it more than
+    once without hitting the database again.
+    """
+
+    def __init__(self, object_list, next_cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+
+def _keyset_slice(queryset, cursor, page_size):
+    if cursor:
+        day, pk = decode_cursor(cursor)
+        # The redundant date__lte bound lets the planner seek the (date, id)
+        # index instead of walking it from the newest row.
+        queryset = queryset.filter(Q(date__lt=day) | Q(date=day, pk__lt=pk), date__lte=day)
+    # Fetch one extra row to find out whether another page exists.
+    return queryset.order_by("-date", "-id")[: page_size + 1]
+
+
+def _keyset_result(rows, page_size):
+    next_cursor = encode_cursor(rows[page_size - 1]) if len(rows) > page_size else None
+    return KeysetPage(rows[:page_size], next_cursor)
+
+
+def keyset_page(queryset, cursor=None, page_size=None):
+    if page_size is None:
+        page_size = settings.EXPENSE_LIST_PAGE_SIZE
+    return _keyset_result(list(_keyset_slice(queryset, cursor, page_size)), page_size)
+
+
+async def akeyset_page(queryset, cursor=None, page_size=None):
+    if page_size is None:
+        page_size = settings.EXPENSE_LIST_PAGE_SIZE
+    rows = [row async for row in _keyset_slice(queryset, cursor, page_size)]
+    return _keyset_result(rows, page_size)
+
+
+def _ranked_slice(queryset, cursor, page_size):
+    offset = decode_offset(cursor) if cursor else 0
+    return offset, queryset[offset : offset + page_size + 1]
+
+
+def _ranked_result(rows, offset, page_size):
+    next_cursor = encode_offset(offset + page_size) if len(rows) > page_size else None
+    return KeysetPage(rows[:page_size], next_cursor)
+
+
+def ranked_page(queryset, cursor=None, page_size=None):
+    """One page of search results, kept in the queryset's relevance order.
+
+    Relevance is not a stable key to seek on, so these cursors hold an offset.
+    """
+    if page_size is None:
+        page_size = settings.EXPENSE_LIST_PAGE_SIZE
+    offset, rows = _ranked_slice(queryset, cursor, page_size)
+    return _ranked_result(list(rows), offset, page_size)
+
+
+async def aranked_page(queryset, cursor=None, page_size=None):
+    if page_size is None:
+        page_size = settings.EXPENSE_LIST_PAGE_SIZE
+    offset, rows = _ranked_slice(queryset, cursor, page_size)
+    return _ranked_result([row async for row in rows], offset, page_size)
+
+
+class ExpenseKeysetPagination(BasePagination):
+    """REST framework adapter for :func:`keyset_page`.
+
+    Views that set a ``search_text`` are paged with :func:`ranked_page`.
+    """
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        paginate = ranked_page if getattr(view, "search_text", None) else keyset_page
+        try:
+            self.page = paginate(
+                queryset, request.query_params.get("cursor"), get_page_size(request)
+            )
+        except InvalidCursor:
+            raise NotFound("Invalid cursor.")
+        return self.page.object_list
+
+    def get_next_link(self):
+        if not self.page.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, "cursor", self.page.next_cursor)
+
+    def get_paginated_response(self, data):
+        return Response({"next": self.get_next_link(), "results": data})
+
+
+def estimated_count(model, using="default"):
+    """A cheap approximation of the number of rows in ``model``'s table.
+
+    PostgreSQL's planner statistics (kept current by autovacuum), or on
+    SQLite the span of the integer primary key, which two index seeks find
+    and which overcounts only by the rows deleted since. ``None`` where
+    neither is available.
+    """
+    connection = connections[using]
+    table = connection.ops.quote_name(model._meta.db_table)
+    with connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass", [table])
+        elif connection.vendor == "sqlite":
+            # Apart, each of max() and min() is one seek; together they scan.
+            cursor.execute(f"SELECT (SELECT max(rowid) FROM {table}) - (SELECT min(rowid) FROM {table}) + 1")
+        else:
+            return None
+        row = cursor.fetchone()
+    # reltuples is -1 before the first ANALYZE, max() NULL on an empty table.
+    if row is None or row[0] is None or row[0] < 0:
+        return None
+    return row[0]
+
+
+class EstimatedCountPaginator(Paginator):
+    """Django paginator that does not ``COUNT(*)`` a whole large table.
+
+    An unfiltered queryset is counted with :func:`estimated_count` once the
+    estimate passes ``EXPENSE_ADMIN_EXACT_COUNT_LIMIT``; ``estimated`` then
+    tells templates the count is approximate. Filtered querysets are counted
+    exactly, through whichever index their filter uses.
+    """
+
+    estimated = False
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = estimated_count(queryset.model, queryset.db)
+            if estimate is not None and estimate > settings.EXPENSE_ADMIN_EXACT_COUNT_LIMIT:
+                self.estimated = True
+                return estimate
+        return super().count
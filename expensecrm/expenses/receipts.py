@@ -0,0 +1,434 @@
+"""Receipt link checks, a content-addressed receipt store and thumbnails.
+
+Every distinct ``Expense.receipt_link`` gets a :class:`~expenses.models.ReceiptLink`
+row. :func:`check_due` fetches the links due for a check concurrently: an
+asyncio loop hands the blocking downloads to a thread pool of
+``EXPENSES_RECEIPT_CONCURRENCY`` connections, at most
+``EXPENSES_RECEIPT_PER_HOST`` of them to one host. Files are stored under
+their SHA-256, so the same receipt behind many links is stored, and
+thumbnailed, once. Links are checked again after
+``EXPENSES_RECEIPT_RECHECK_DAYS`` with the ETag and Last-Modified of the
+previous response, and broken ones are retried with backoff.
+
+Thumbnails need Pillow (``pip install Pillow``); without it receipts are
+stored and checked but not previewed.
+"""
+import asyncio
+import hashlib
+import http.client
+import ipaddress
+import mimetypes
+import os
+import socket
+import tempfile
+import urllib.error
+import urllib.request
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import timedelta
+from pathlib import Path
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.db.models import Exists, OuterRef
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+
+from .models import Expense, Job, Receipt, ReceiptLink
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+USER_AGENT = "expensecrm-receipt-checker/1.0"
+READ_SIZE = 64 * 1024
+THUMBNAIL_SUFFIX = ".thumb.jpg"
+# Sniffed from the first bytes; servers often send application/octet-stream.
+SIGNATURES = (
+    (b"%PDF-", "application/pdf"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+)
+# Served inline; anything else, HTML included, is only offered as a download.
+INLINE_TYPES = {"application/pdf", "image/png", "image/jpeg", "image/gif", "image/webp"}
+
+
+class FetchError(Exception):
+    def __init__(self, message, http_status=None):
+        super().__init__(message)
+        self.http_status = http_status
+
+
+@dataclass
+class Fetched:
+    """The outcome of one download; ``path`` is a temporary file to store."""
+
+    http_status: int
+    not_modified: bool = False
+    path: str = ""
+    sha256: str = ""
+    size: int = 0
+    content_type: str = ""
+    etag: str = ""
+    last_modified: str = ""
+
+
+def store_dir():
+    return Path(settings.EXPENSES_RECEIPT_DIR)
+
+
+def receipt_path(sha256, thumbnail=False):
+    return store_dir() / sha256[:2] / (sha256 + (THUMBNAIL_SUFFIX if thumbnail else ""))
+
+
+def check_url(url):
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        raise FetchError("Only http and https links can be checked.")
+
+
+def resolve(host, port):
+    """The addresses of ``host``; refused if any is loopback, private or link-local."""
+    try:
+        addresses = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    except (socket.gaierror, ValueError, UnicodeError):
+        raise FetchError("The host name could not be resolved.")
+    if not settings.EXPENSES_RECEIPT_ALLOW_PRIVATE:
+        for *_, sockaddr in addresses:
+            if not ipaddress.ip_address(sockaddr[0].split("%")[0]).is_global:
+                raise FetchError("The link points to a private address.")
+    return addresses
+
+
+def create_checked_connection(address, timeout=socket._GLOBAL_DEFAULT_TIMEOUT, source_address=None):
+    """``socket.create_connection`` to the addresses :func:`resolve` accepted.
+
+    Checking the host and then letting the connection look it up again would
+    let a DNS answer that changes in between point the download at the
+    internal network.
+    """
+    error = None
+    for *_, sockaddr in resolve(*address):
+        try:
+            return socket.create_connection(sockaddr[:2], timeout, source_address)
+        except OSError as exc:
+            error = exc
+    raise error
+
+
+class CheckedHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._create_connection = create_checked_connection
+
+
+class CheckedHTTPSConnection(http.client.HTTPSConnection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._create_connection = create_checked_connection
+
+
+class CheckedHTTPHandler(urllib.request.HTTPHandler):
+    def http_open(self, req):
+        return self.do_open(CheckedHTTPConnection, req)
+
+
+class CheckedHTTPSHandler(urllib.request.HTTPSHandler):
+    def https_open(self, req):
+        return self.do_open(CheckedHTTPSConnection, req, context=self._context)
+
+
+class CheckedRedirectHandler(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        check_url(newurl)
+        return super().redirect_request(req, fp, code, msg, headers, newurl)
+
+
+# No proxies: a proxy would look the host up again itself.
+_opener = urllib.request.build_opener(
+    urllib.request.ProxyHandler({}), CheckedHTTPHandler, CheckedHTTPSHandler, CheckedRedirectHandler
+)
+
+
+def sniff(head, header_type, url):
+    for signature, content_type in SIGNATURES:
+        if head.startswith(signature):
+            return content_type
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    header_type = header_type.split(";")[0].strip().lower()
+    if header_type and header_type != "application/octet-stream":
+        return header_type
+    return mimetypes.guess_type(urlsplit(url).path)[0] or "application/octet-stream"
+
+
+def fetch(url, etag="", last_modified=""):
+    """Download ``url`` into a temporary file in the store, hashing as it goes."""
+    check_url(url)
+    request = urllib.request.Request(url, headers={"User-Agent": USER_AGENT})
+    if etag:
+        request.add_header("If-None-Match", etag)
+    if last_modified:
+        request.add_header("If-Modified-Since", last_modified)
+    try:
+        response = _opener.open(request, timeout=settings.EXPENSES_RECEIPT_TIMEOUT)
+    except urllib.error.HTTPError as exc:
+        exc.close()
+        if exc.code == 304:
+            return Fetched(http_status=304, not_modified=True, etag=etag, last_modified=last_modified)
+        raise FetchError(f"The server answered {exc.code} {exc.reason}.", exc.code)
+    except (urllib.error.URLError, OSError) as exc:
+        raise FetchError(f"The link could not be fetched: {getattr(exc, 'reason', exc)}")
+
+    limit = settings.EXPENSES_RECEIPT_MAX_BYTES
+    tmp_dir = store_dir() / "tmp"
+    tmp_dir.mkdir(parents=True, exist_ok=True)
+    digest, size, head = hashlib.sha256(), 0, b""
+    with response, tempfile.NamedTemporaryFile(dir=tmp_dir, delete=False) as out:
+        try:
+            while chunk := response.read(READ_SIZE):
+                size += len(chunk)
+                if size > limit:
+                    raise FetchError(f"The receipt is larger than {limit} bytes.", response.status)
+                head = head or chunk[:16]
+                digest.update(chunk)
+                out.write(chunk)
+        except BaseException as exc:
+            out.close()
+            os.unlink(out.name)
+            if isinstance(exc, OSError):
+                raise FetchError(f"The download failed: {exc}", response.status)
+            raise
+    return Fetched(
+        http_status=response.status,
+        path=out.name,
+        sha256=digest.hexdigest(),
+        size=size,
+        content_type=sniff(head, response.headers.get("Content-Type", ""), response.url),
+        etag=response.headers.get("ETag", ""),
+        last_modified=response.headers.get("Last-Modified", ""),
+    )
+
+
+async def fetch_all(links):
+    """``[(link, Fetched or FetchError)]`` for ``links``, downloaded concurrently."""
+    loop = asyncio.get_running_loop()
+    hosts = defaultdict(lambda: asyncio.Semaphore(settings.EXPENSES_RECEIPT_PER_HOST))
+    with ThreadPoolExecutor(settings.EXPENSES_RECEIPT_CONCURRENCY) as pool:
+
+        async def one(link):
+            async with hosts[urlsplit(link.url).hostname]:
+                # Without a stored copy a "304 Not Modified" would be no use.
+                validators = (link.etag, link.last_modified) if link.receipt_id else ("", "")
+                try:
+                    return link, await loop.run_in_executor(pool, fetch, link.url, *validators)
+                except FetchError as exc:
+                    return link, exc
+
+        return await asyncio.gather(*(one(link) for link in links))
+
+
+def make_thumbnail(source, target):
+    """Write a JPEG preview of the image ``source``; False if it can't be read."""
+    if Image is None:
+        return False
+    size = settings.EXPENSES_RECEIPT_THUMBNAIL_SIZE
+    try:
+        with Image.open(source) as image:
+            # Lets the JPEG decoder skip most of the pixels of a large photo.
+            image.draft("RGB", size)
+            image.thumbnail(size)
+            image.convert("RGB").save(target, "JPEG", quality=80, optimize=True)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        Path(target).unlink(missing_ok=True)
+        return False
+    return True
+
+
+def store(fetched):
+    """Move a download into the store and return its ``Receipt``."""
+    path = receipt_path(fetched.sha256)
+    receipt = Receipt.objects.filter(pk=fetched.sha256).first()
+    if receipt is not None and path.exists():
+        os.unlink(fetched.path)
+        return receipt
+    path.parent.mkdir(parents=True, exist_ok=True)
+    os.replace(fetched.path, path)
+    has_thumbnail = fetched.content_type.startswith("image/") and make_thumbnail(
+        path, receipt_path(fetched.sha256, thumbnail=True)
+    )
+    receipt, _ = Receipt.objects.update_or_create(
+        pk=fetched.sha256,
+        defaults={
+            "content_type": fetched.content_type,
+            "size": fetched.size,
+            "has_thumbnail": has_thumbnail,
+        },
+    )
+    return receipt
+
+
+def record(link, outcome, now):
+    link.checked_at = now
+    if isinstance(outcome, FetchError):
+        link.status = ReceiptLink.BROKEN
+        link.http_status = outcome.http_status
+        link.error = str(outcome)[:255]
+        link.failures += 1
+        delay = min(
+            settings.EXPENSES_RECEIPT_RETRY_DELAY * 2 ** (link.failures - 1),
+            settings.EXPENSES_RECEIPT_RECHECK_DAYS * 86400,
+        )
+        link.next_check_at = now + timedelta(seconds=delay)
+        return
+    if not outcome.not_modified:
+        link.receipt = store(outcome)
+    link.status = ReceiptLink.OK
+    link.http_status = outcome.http_status
+    link.error = ""
+    link.etag, link.last_modified = outcome.etag[:255], outcome.last_modified[:100]
+    link.failures = 0
+    link.next_check_at = now + timedelta(days=settings.EXPENSES_RECEIPT_RECHECK_DAYS)
+
+
+def sync_links():
+    """Add links for new receipt URLs and drop those no expense uses any more."""
+    used = Expense.objects.filter(receipt_link=OuterRef("url"))
+    ReceiptLink.objects.filter(~Exists(used)).delete()
+    known = ReceiptLink.objects.filter(url=OuterRef("receipt_link"))
+    urls = (
+        Expense.objects.exclude(receipt_link__isnull=True)
+        .exclude(receipt_link="")
+        .filter(~Exists(known))
+        .order_by()
+        .values_list("receipt_link", flat=True)
+        .distinct()
+    )
+    now = timezone.now()
+    created = ReceiptLink.objects.bulk_create(
+        [ReceiptLink(url=url, next_check_at=now) for url in urls.iterator()],
+        batch_size=500,
+        ignore_conflicts=True,
+    )
+    for receipt in Receipt.objects.filter(links__isnull=True):
+        receipt_path(receipt.pk).unlink(missing_ok=True)
+        receipt_path(receipt.pk, thumbnail=True).unlink(missing_ok=True)
+        receipt.delete()
+    return len(created)
+
+
+def due_links(now=None):
+    return ReceiptLink.objects.filter(next_check_at__lte=now or timezone.now()).order_by("next_check_at", "pk")
+
+
+def check(links):
+    """Fetch ``links`` and record the outcome of each."""
+    outcomes = asyncio.run(fetch_all(links))
+    now = timezone.now()
+    # Files are stored and thumbnailed outside the transaction that
+    # updates the links, so it holds the write lock only briefly.
+    for link, outcome in outcomes:
+        record(link, outcome, now)
+    ReceiptLink.objects.bulk_update(
+        [link for link, _ in outcomes],
+        [
+            "receipt", "status", "http_status", "error", "etag", "last_modified",
+            "failures", "checked_at", "next_check_at",
+        ],
+    )
+    return outcomes
+
+
+def check_due(limit=None, progress=None):
+    """Check due links a batch at a time; returns how many ended up ok and broken."""
+    sync_links()
+    started = timezone.now()
+    counts = {ReceiptLink.OK: 0, ReceiptLink.BROKEN: 0}
+    total = due_links(started).count()
+    if limit is not None:
+        total = min(total, limit)
+    while sum(counts.values()) < total:
+        batch_size = min(settings.EXPENSES_RECEIPT_BATCH_SIZE, total - sum(counts.values()))
+        links = list(due_links(started)[:batch_size])
+        if not links:
+            break
+        for link, _ in check(links):
+            counts[link.status] += 1
+        if progress:
+            progress(sum(counts.values()), total)
+    return counts
+
+
+def schedule():
+    """Queue a ``check_receipts`` job unless one is already waiting or running."""
+    from . import jobs
+
+    pending = Job.objects.filter(kind="check_receipts", status__in=[Job.QUEUED, Job.RUNNING])
+    if not pending.exists():
+        return jobs.enqueue("check_receipts")
+    return None
+
+
+def link_for(url):
+    if not url:
+        return None
+    return ReceiptLink.objects.select_related("receipt").filter(url=url).first()
+
+
+def visible_to(user, sha256):
+    if user.is_staff:
+        return True
+    urls = ReceiptLink.objects.filter(receipt=sha256).values("url")
+    return Expense.objects.for_user(user).filter(receipt_link__in=urls).exists()
+
+
+def receipt_response(request, sha256, thumbnail=False):
+    """Serve receipt ``sha256`` to ``request.user``, or raise ``Http404``.
+
+    ``If-None-Match`` is only answered once the user may see the receipt, so
+    a 304 can't reveal that some hash is stored.
+    """
+    receipt = Receipt.objects.filter(pk=sha256).first()
+    if receipt is None or (thumbnail and not receipt.has_thumbnail) or not visible_to(request.user, sha256):
+        raise Http404
+    etag = quote_etag(f"{sha256}-thumbnail" if thumbnail else sha256)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        try:
+            response = serve(receipt, thumbnail)
+        except FileNotFoundError:
+            raise Http404
+    response["ETag"] = etag
+    return response
+
+
+def serve(receipt, thumbnail=False):
+    """A response for a stored receipt, handed to the web server when possible.
+
+    With ``EXPENSES_RECEIPT_ACCEL_REDIRECT`` set to an internal nginx location
+    aliasing ``EXPENSES_RECEIPT_DIR``, only headers leave Django.
+    """
+    path = receipt_path(receipt.pk, thumbnail)
+    content_type = "image/jpeg" if thumbnail else receipt.content_type
+    inline = content_type in INLINE_TYPES
+    if not inline:
+        content_type = "application/octet-stream"
+    prefix = settings.EXPENSES_RECEIPT_ACCEL_REDIRECT
+    if prefix:
+        response = HttpResponse(content_type=content_type)
+        response["X-Accel-Redirect"] = prefix.rstrip("/") + "/" + path.relative_to(store_dir()).as_posix()
+    else:
+        response = FileResponse(open(path, "rb"), content_type=content_type)
+    extension = mimetypes.guess_extension(content_type) or ""
+    disposition = "inline" if inline else "attachment"
+    response["Content-Disposition"] = f'{disposition}; filename="receipt-{receipt.pk[:12]}{extension}"'
+    response["Content-Security-Policy"] = "sandbox"
+    # The content never changes under a given hash.
+    response["Cache-Control"] = "private, max-age=31536000, immutable"
+    return response
@@ -0,0 +1,220 @@
+"""Incremental maintenance of the ``ExpenseRollup`` table.
+
+A delta maps a rollup bucket ``(day, category_id, user_id, payment_method)``
+to ``[cents, count]``. Writers build deltas for the rows they touch and
+apply them in one go; ``rebuild()`` recomputes the table from scratch.
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import connections, models, transaction
+from django.db.models import Count, Sum
+
+from . import generations
+from .models import Expense, ExpenseRollup
+
+BUCKET_FIELDS = ("date", "category_id", "user_id", "payment_method")
+ROLLUP_FIELDS = frozenset(BUCKET_FIELDS + ("category", "user", "amount"))
+
+# Six parameters per row keeps each upsert well under SQLite's variable limit.
+UPSERT_BATCH_SIZE = 150
+# Primary keys per IN (...) list when re-reading rows by id.
+PK_BATCH_SIZE = 500
+
+
+def to_cents(amount):
+    return int((Decimal(str(amount)) * 100).to_integral_value())
+
+
+def from_cents(cents):
+    return (Decimal(cents or 0) / 100).quantize(Decimal("0.01"))
+
+
+def new_deltas():
+    return defaultdict(lambda: [0, 0])
+
+
+def merge_deltas(deltas, other):
+    for bucket, (cents, count) in other.items():
+        deltas[bucket][0] += cents
+        deltas[bucket][1] += count
+    return deltas
+
+
+def add_values(deltas, values, sign=1):
+    """Add one expense, given as a mapping of attnames, to ``deltas``."""
+    bucket = tuple(values[field] for field in BUCKET_FIELDS)
+    deltas[bucket][0] += sign * to_cents(values["amount"])
+    deltas[bucket][1] += sign
+    return deltas
+
+
+def instance_values(expense):
+    return {field: getattr(expense, field) for field in BUCKET_FIELDS + ("amount",)}
+
+
+def deltas_from_instances(expenses, sign=1):
+    deltas = new_deltas()
+    for expense in expenses:
+        add_values(deltas, instance_values(expense), sign)
+    return deltas
+
+
+def deltas_from_queryset(queryset, sign=1):
+    """Group ``queryset`` by bucket in the database, one query in total."""
+    deltas = new_deltas()
+    rows = (
+        queryset.order_by()
+        .values(*BUCKET_FIELDS)
+        .annotate(amount_sum=Sum("amount"), row_count=Count("pk"))
+    )
+    for row in rows:
+        bucket = tuple(row[field] for field in BUCKET_FIELDS)
+        deltas[bucket][0] += sign * to_cents(row["amount_sum"])
+        deltas[bucket][1] += sign * row["row_count"]
+    return deltas
+
+
+def deltas_from_pks(queryset, pks, sign=1):
+    deltas = new_deltas()
+    for start in range(0, len(pks), PK_BATCH_SIZE):
+        chunk = queryset.filter(pk__in=pks[start : start + PK_BATCH_SIZE])
+        merge_deltas(deltas, deltas_from_queryset(chunk, sign))
+    return deltas
+
+
+def constant_values(model, values):
+    """``update()`` keyword arguments that move rollup buckets, by attname.
+
+    Returns ``None`` when one of them is an expression whose result is only
+    known to the database.
+    """
+    constants = {}
+    for name, value in values.items():
+        if name not in ROLLUP_FIELDS:
+            continue
+        if hasattr(value, "resolve_expression"):
+            return None
+        field = model._meta.get_field(name)
+        if isinstance(value, models.Model):
+            value = value.pk
+        constants[field.attname] = field.to_python(value)
+    return constants
+
+
+def reassigned_deltas(before, values):
+    """The change from moving the rows grouped in ``before`` to ``values``.
+
+    ``before`` holds the (positive) deltas of the rows being updated and
+    ``values`` the constants they are set to, as from :func:`constant_values`.
+    """
+    deltas = new_deltas()
+    for bucket, (cents, count) in before.items():
+        moved = tuple(values.get(field, old) for field, old in zip(BUCKET_FIELDS, bucket))
+        if "amount" in values:
+            cents_after = count * to_cents(values["amount"])
+        else:
+            cents_after = cents
+        deltas[bucket][0] -= cents
+        deltas[bucket][1] -= count
+        deltas[moved][0] += cents_after
+        deltas[moved][1] += count
+    return deltas
+
+
+def category_totals(rollups):
+    """``rollups`` summed per category name, as a ``values()`` queryset."""
+    return (
+        rollups.values("category__name")
+        .annotate(cents=Sum("total_cents"), count=Sum("count"))
+        .filter(count__gt=0)
+        .order_by("category__name")
+    )
+
+
+def apply_deltas(deltas, using="default"):
+    changed = [(bucket, delta) for bucket, delta in deltas.items() if delta != [0, 0]]
+    if not changed:
+        return
+    with transaction.atomic(using=using):
+        keyed, anonymous = [], []
+        for bucket, delta in changed:
+            (anonymous if bucket[2] is None else keyed).append((bucket, delta))
+        for start in range(0, len(keyed), UPSERT_BATCH_SIZE):
+            _upsert(keyed[start : start + UPSERT_BATCH_SIZE], using)
+        # NULL never conflicts in a unique index, so buckets without a user
+        # are read, adjusted and written back in bulk instead.
+        for start in range(0, len(anonymous), UPSERT_BATCH_SIZE):
+            _update_anonymous(anonymous[start : start + UPSERT_BATCH_SIZE], using)
+
+
+def _update_anonymous(items, using):
+    days = {day for (day, _, _, _), _ in items}
+    existing = {
+        (row.day, row.category_id, row.payment_method): row
+        for row in ExpenseRollup.objects.using(using).filter(user=None, day__in=days)
+    }
+    changed, created = {}, []
+    for (day, category_id, _, payment_method), (cents, count) in items:
+        key = (day, category_id, payment_method)
+        row = existing.get(key)
+        if row is None:
+            if count <= 0:
+                continue
+            row = existing[key] = ExpenseRollup(
+                day=day, category_id=category_id, payment_method=payment_method
+            )
+            created.append(row)
+        elif row.pk is not None:
+            changed[row.pk] = row
+        row.total_cents += cents
+        row.count += count
+    ExpenseRollup.objects.using(using).bulk_update(changed.values(), ["total_cents", "count"])
+    ExpenseRollup.objects.using(using).bulk_create(created)
+
+
+def _upsert(items, using):
+    connection = connections[using]
+    qn = connection.ops.quote_name
+    table = qn(ExpenseRollup._meta.db_table)
+    columns = ", ".join(
+        qn(ExpenseRollup._meta.get_field(name).column)
+        for name in ("day", "category", "user", "payment_method", "total_cents", "count")
+    )
+    placeholders = ", ".join(["(%s, %s, %s, %s, %s, %s)"] * len(items))
+    params = []
+    for (day, category_id, user_id, payment_method), (cents, count) in items:
+        params.extend([day, category_id, user_id, payment_method, cents, count])
+    conflict = ", ".join(qn(c) for c in ("day", "category_id", "user_id", "payment_method"))
+    sql = (
+        f"INSERT INTO {table} ({columns}) VALUES {placeholders} "
+        f"ON CONFLICT ({conflict}) DO UPDATE SET "
+        f"{qn('total_cents')} = {table}.{qn('total_cents')} + excluded.{qn('total_cents')}, "
+        f"{qn('count')} = {table}.{qn('count')} + excluded.{qn('count')}"
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+
+
+def rebuild(using="default", batch_size=1000):
+    """Recompute every rollup row from the ``Expense`` table."""
+    with transaction.atomic(using=using):
+        ExpenseRollup.objects.using(using).all().delete()
+        deltas = deltas_from_queryset(Expense.objects.using(using).all())
+        ExpenseRollup.objects.using(using).bulk_create(
+            (
+                ExpenseRollup(
+                    day=day,
+                    category_id=category_id,
+                    user_id=user_id,
+                    payment_method=payment_method,
+                    total_cents=cents,
+                    count=count,
+                )
+                for (day, category_id, user_id, payment_method), (cents, count) in deltas.items()
+            ),
+            batch_size=batch_size,
+        )
+        generations.bump_all(using=using)
+        generations.bump(generations.users_in(deltas), using=using)
+    return len(deltas)
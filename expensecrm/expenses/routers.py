@@ -0,0 +1,89 @@
+"""Send the read-only hot paths to a replica and everything else to the primary.
+
+Views opt in with :func:`replica_reads` (or ``async_views.async_api_view``):
+their ORM reads go to one of ``settings.EXPENSES_REPLICA_DATABASES`` while
+the view runs. A user whose data generation moved within the last
+``EXPENSES_REPLICA_STICKY_SECONDS`` stays on the primary, so they see their
+own writes even while the replica lags. Writes, and reads outside those
+views, always use the primary.
+"""
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.utils import timezone
+
+from . import generations
+
+_read_database = ContextVar("expenses_read_database", default=None)
+
+# Read on every request to decide what is fresh; a stale copy would hide writes.
+PRIMARY_ONLY = {"expenses.category", "expenses.datageneration"}
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if model._meta.label_lower in PRIMARY_ONLY:
+            return None
+        return _read_database.get()
+
+    def db_for_write(self, model, **hints):
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in settings.EXPENSES_REPLICA_DATABASES:
+            return False
+        return None
+
+
+@contextmanager
+def reads_from(alias):
+    """Route reads in this context to ``alias`` (``None`` for the primary)."""
+    token = _read_database.set(alias)
+    try:
+        yield
+    finally:
+        _read_database.reset(token)
+
+
+def _choose(request, updated_at):
+    replicas = settings.EXPENSES_REPLICA_DATABASES
+    if not replicas or request.method not in ("GET", "HEAD"):
+        return None
+    window = timedelta(seconds=settings.EXPENSES_REPLICA_STICKY_SECONDS)
+    if updated_at is not None and timezone.now() - updated_at < window:
+        return None
+    return random.choice(replicas)
+
+
+def read_database(request):
+    """The alias ``request`` may read from, or ``None`` for the primary."""
+    return _choose(request, generations.current(request)[1])
+
+
+async def aread_database(request):
+    return _choose(request, (await generations.acurrent(request))[1])
+
+
+def replica_reads(view):
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        with reads_from(read_database(request)):
+            return view(request, *args, **kwargs)
+
+    return wrapper
+
+
+def pin(queryset):
+    """Bind ``queryset`` to the database routed to now.
+
+    Streaming responses evaluate their queryset after the view has returned
+    and left :func:`reads_from`.
+    """
+    return queryset.using(queryset.db)
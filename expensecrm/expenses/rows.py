@@ -0,0 +1,27 @@
+"""Read-only expense rows for the expense list and the list APIs.
+
+:func:`expense_rows` reads just the columns those pages show, with the
+category name and the owner's username joined in, through
+``values_list(named=True)``. Each row is a named tuple, so a page costs no
+model instances, ``from_db`` hooks or related-object caches.
+"""
+from django.db.models import F
+
+FIELDS = (
+    "pk",
+    "date",
+    "category_id",
+    "category_name",
+    "username",
+    "description",
+    "amount",
+    "payment_method",
+    "receipt_link",
+)
+
+
+def expense_rows(queryset):
+    """``queryset`` as named tuples of :data:`FIELDS`, keeping its filters and order."""
+    return queryset.annotate(
+        category_name=F("category__name"), username=F("user__username")
+    ).values_list(*FIELDS, named=True)
@@ -0,0 +1,148 @@
+"""Indexed full-text search over ``Expense.description``.
+
+SQLite keeps an external-content FTS5 table in step with ``expenses_expense``
+through triggers, so bulk writes and raw deletes are indexed too. PostgreSQL
+uses a GIN index on the same ``to_tsvector`` expression that queries filter
+on. Every search term matches as a prefix and results come back best match
+first. Other backends fall back to ``icontains``.
+"""
+import re
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Q
+
+FTS_TABLE = "expenses_expense_fts"
+GIN_INDEX = "expense_description_search"
+
+# Single characters match almost every row and only slow the index down.
+TERM_RE = re.compile(r"\w{2,}")
+
+
+def terms(text):
+    return TERM_RE.findall(text or "")[:16]
+
+
+def _sqlite_statements(table, pk):
+    fts = FTS_TABLE
+    # user_id is indexed as a token so per-user searches intersect posting
+    # lists instead of filtering every user's matches.
+    columns = "description, user_id"
+    new = "new.description, new.user_id"
+    old = "old.description, old.user_id"
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+        f"{columns}, content='{table}', content_rowid='{pk}', "
+        f"tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN "
+        f"INSERT INTO {fts}(rowid, {columns}) VALUES (new.{pk}, {new}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, {columns}) VALUES ('delete', old.{pk}, {old}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {columns} ON {table} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, {columns}) VALUES ('delete', old.{pk}, {old}); "
+        f"INSERT INTO {fts}(rowid, {columns}) VALUES (new.{pk}, {new}); END",
+    ]
+
+
+def _install_sqlite(connection, model):
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT count(*) FROM sqlite_master WHERE name IN (%s, %s, %s, %s)",
+            [FTS_TABLE] + [f"{FTS_TABLE}_{suffix}" for suffix in ("ai", "ad", "au")],
+        )
+        complete = cursor.fetchone()[0] == 4
+        for statement in _sqlite_statements(table, model._meta.pk.column):
+            cursor.execute(statement)
+        if not complete:
+            # Rows may have changed while the triggers were missing.
+            cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+
+
+def install(schema_editor, model):
+    """Create the search index for ``model`` (an ``Expense`` class) if missing.
+
+    Safe to call repeatedly. On SQLite a table rebuild by a later migration
+    drops the triggers, so ``post_migrate`` calls :func:`repair` as well.
+    """
+    connection = schema_editor.connection
+    if connection.vendor == "sqlite":
+        _install_sqlite(connection, model)
+    elif connection.vendor == "postgresql":
+        from django.contrib.postgres.indexes import GinIndex
+        from django.contrib.postgres.search import SearchVector
+
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM pg_indexes WHERE indexname = %s", [GIN_INDEX])
+            if cursor.fetchone() is None:
+                index = GinIndex(
+                    SearchVector("description", config=settings.EXPENSE_SEARCH_CONFIG),
+                    name=GIN_INDEX,
+                )
+                schema_editor.add_index(model, index)
+
+
+def repair(using="default", **kwargs):
+    """``post_migrate`` hook: restore SQLite triggers dropped by a table rebuild."""
+    from .models import Expense
+
+    connection = connections[using]
+    if connection.vendor != "sqlite" or FTS_TABLE not in connection.introspection.table_names():
+        return
+    _install_sqlite(connection, Expense)
+
+
+def uninstall(schema_editor, model):
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        if connection.vendor == "sqlite":
+            for suffix in ("ai", "ad", "au"):
+                cursor.execute(f"DROP TRIGGER IF EXISTS {FTS_TABLE}_{suffix}")
+            cursor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+        elif connection.vendor == "postgresql":
+            cursor.execute(f"DROP INDEX IF EXISTS {GIN_INDEX}")
+
+
+def search(queryset, text, user=None):
+    """Expenses in ``queryset`` matching every term of ``text``, best first.
+
+    Matching rows are annotated with ``rank`` (lower is better) and ordered
+    by it, newest first among equal ranks. Pass the ``user`` the queryset is
+    scoped to so the index can narrow to their rows first.
+    """
+    words = terms(text)
+    if not words:
+        return queryset.none()
+    vendor = connections[queryset.db].vendor
+    if vendor == "sqlite":
+        match = " ".join(f'description : "{word}"*' for word in words)
+        if user is not None:
+            match = f"user_id : {int(user.pk)} AND {match}"
+        table = queryset.model._meta.db_table
+        pk = queryset.model._meta.pk.column
+        # A join lets SQLite drive the query from the FTS matches; ranking
+        # through a correlated subquery re-runs the match once per row.
+        return queryset.extra(
+            tables=[FTS_TABLE],
+            where=[f"{FTS_TABLE}.rowid = {table}.{pk}", f"{FTS_TABLE} MATCH %s"],
+            params=[match],
+            select={"rank": f"bm25({FTS_TABLE}, 1.0, 0.0)"},
+        ).order_by("rank", "-date", "-id")
+    if vendor == "postgresql":
+        from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+        from django.db.models import F
+
+        config = settings.EXPENSE_SEARCH_CONFIG
+        query = SearchQuery(
+            " & ".join(f"{word}:*" for word in words), search_type="raw", config=config
+        )
+        return (
+            queryset.annotate(document=SearchVector("description", config=config))
+            .filter(document=query)
+            .annotate(rank=-SearchRank(F("document"), query))
+            .order_by("rank", "-date", "-id")
+        )
+    condition = Q()
+    for word in words:
+        condition &= Q(description__icontains=word)
+    return queryset.filter(condition).order_by("-date", "-id")
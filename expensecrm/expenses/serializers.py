@@ -0,0 +1,221 @@
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.urls import reverse
+from rest_framework import serializers
+
+from .cache import CategoryGone, category_cache, category_writes
+from .export import FORMATS
+from .filters import parse_expense_filters
+from .models import Category, Expense, Job, ReceiptLink
+
+
+@contextmanager
+def category_errors():
+    """:func:`expenses.cache.category_writes`, failing with a 400 on the category."""
+    try:
+        with category_writes():
+            yield
+    except CategoryGone as exc:
+        raise serializers.ValidationError({"category": [str(exc)]})
+
+
+class DynamicFieldsModelSerializer(serializers.ModelSerializer):
+    """Serializer that can be restricted to a subset of its fields."""
+
+    def __init__(self, *args, **kwargs):
+        fields = kwargs.pop("fields", None)
+        super().__init__(*args, **kwargs)
+        if fields:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+
+class CategoryField(serializers.PrimaryKeyRelatedField):
+    """Resolve categories from a preloaded ``categories`` map when available.
+
+    Bulk requests put ``{pk: Category}`` into the serializer context so that
+    validating hundreds of rows does not cost one lookup per row. Ids missing
+    from the map go through ``category_cache.get``, which checks the database.
+    """
+
+    def to_internal_value(self, data):
+        categories = self.context.get("categories")
+        if categories is None:
+            return super().to_internal_value(data)
+        try:
+            pk = int(data)
+        except (TypeError, ValueError):
+            self.fail("incorrect_type", data_type=type(data).__name__)
+        category = categories.get(pk) or category_cache.get(pk)
+        if category is None:
+            self.fail("does_not_exist", pk_value=data)
+        return category
+
+
+class CategorySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Category
+        fields = ["id", "name"]
+
+
+class ExpenseSerializer(DynamicFieldsModelSerializer):
+    category = CategoryField(queryset=Category.objects.all())
+    category_name = serializers.CharField(source="category.name", read_only=True)
+
+    class Meta:
+        model = Expense
+        fields = [
+            "id",
+            "date",
+            "category",
+            "category_name",
+            "description",
+            "amount",
+            "payment_method",
+            "receipt_link",
+        ]
+
+    def create(self, validated_data):
+        with category_errors():
+            return super().create(validated_data)
+
+    def update(self, instance, validated_data):
+        with category_errors():
+            return super().update(instance, validated_data)
+
+
+class ExpenseRowSerializer(ExpenseSerializer):
+    """Read-only :class:`ExpenseSerializer` for rows from :func:`expenses.rows.expense_rows`."""
+
+    id = serializers.IntegerField(source="pk", read_only=True)
+    category = serializers.IntegerField(source="category_id", read_only=True)
+    category_name = serializers.CharField(read_only=True)
+
+
+class BulkTargetSerializer(serializers.Serializer):
+    """One of ``ids``, a ``filter`` of the usual expense filters, or ``"all": true``.
+
+    A filter must narrow something down, so a client that sends ``{}`` by
+    mistake can't touch every expense of the account.
+    """
+
+    ids = serializers.ListField(
+        child=serializers.IntegerField(),
+        allow_empty=False,
+        required=False,
+        max_length=settings.EXPENSE_BULK_MAX_IDS,
+    )
+    filter = serializers.DictField(required=False)
+    all = serializers.BooleanField(required=False, default=False)
+    background = serializers.BooleanField(required=False, default=False)
+
+    def validate_filter(self, value):
+        try:
+            filters = parse_expense_filters(value)
+        except DjangoValidationError as exc:
+            raise serializers.ValidationError(exc.messages)
+        if not filters:
+            raise serializers.ValidationError('An empty filter matches every expense; pass "all": true for that.')
+        return filters
+
+    def validate(self, data):
+        if ("ids" in data) + ("filter" in data) + data["all"] != 1:
+            raise serializers.ValidationError('Pass one of ids, filter or "all": true')
+        return data
+
+
+class BulkDeleteSerializer(BulkTargetSerializer):
+    pass
+
+
+class BulkEditValuesSerializer(serializers.Serializer):
+    category = CategoryField(queryset=Category.objects.all(), required=False)
+    payment_method = serializers.ChoiceField(choices=Expense.PAYMENT_METHOD_CHOICES, required=False)
+    date = serializers.DateField(required=False)
+
+    def validate(self, data):
+        if not data:
+            raise serializers.ValidationError("Nothing to change")
+        return data
+
+
+class BulkEditSerializer(BulkTargetSerializer):
+    values = BulkEditValuesSerializer()
+
+
+class ExportJobSerializer(serializers.Serializer):
+    format = serializers.ChoiceField(choices=sorted(FORMATS), default="csv")
+    filter = serializers.DictField(required=False, default=dict)
+
+    def validate_filter(self, value):
+        try:
+            return parse_expense_filters(value)
+        except DjangoValidationError as exc:
+            raise serializers.ValidationError(exc.messages)
+
+
+class ReceiptLinkSerializer(serializers.ModelSerializer):
+    sha256 = serializers.CharField(source="receipt.sha256", default=None, read_only=True)
+    content_type = serializers.CharField(source="receipt.content_type", default=None, read_only=True)
+    size = serializers.IntegerField(source="receipt.size", default=None, read_only=True)
+    file_url = serializers.SerializerMethodField()
+    thumbnail_url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ReceiptLink
+        fields = [
+            "url",
+            "status",
+            "http_status",
+            "error",
+            "checked_at",
+            "next_check_at",
+            "sha256",
+            "content_type",
+            "size",
+            "file_url",
+            "thumbnail_url",
+        ]
+
+    def get_file_url(self, link):
+        return reverse("api_receipt_file", args=[link.receipt_id]) if link.receipt_id else None
+
+    def get_thumbnail_url(self, link):
+        if link.receipt_id and link.receipt.has_thumbnail:
+            return reverse("api_receipt_thumbnail", args=[link.receipt_id])
+        return None
+
+
+class JobSerializer(serializers.ModelSerializer):
+    error = serializers.CharField(source="error_message", read_only=True)
+    status_url = serializers.SerializerMethodField()
+    download_url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Job
+        fields = [
+            "id",
+            "kind",
+            "status",
+            "progress",
+            "total",
+            "attempts",
+            "max_attempts",
+            "result",
+            "error",
+            "created_at",
+            "started_at",
+            "finished_at",
+            "status_url",
+            "download_url",
+        ]
+
+    def get_status_url(self, job):
+        return reverse("api_job_detail", args=[job.pk])
+
+    def get_download_url(self, job):
+        if job.status == Job.SUCCEEDED and (job.result or {}).get("path"):
+            return reverse("api_job_download", args=[job.pk])
+        return None
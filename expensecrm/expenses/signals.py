@@ -0,0 +1,78 @@
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from . import generations, rollups
+from .cache import category_cache, token_cache
+from .models import Category, Expense
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_category_cache(sender, using, **kwargs):
+    category_cache.invalidate()
+    # Another request may have refilled the cache before this commit.
+    transaction.on_commit(category_cache.invalidate, using=using)
+    # Cached summaries show category names.
+    generations.bump_all(using=using)
+
+
+@receiver(post_save, sender=Token)
+@receiver(post_delete, sender=Token)
+def invalidate_cached_token(sender, instance, using, **kwargs):
+    token_cache.invalidate(instance.key)
+    transaction.on_commit(lambda: token_cache.invalidate(instance.key), using=using)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_cached_user_tokens(sender, instance, using, created=False, **kwargs):
+    if created:
+        return
+    # Deactivation, a new password or a deletion all end cached sessions.
+    token_cache.invalidate_user(instance.pk, using=using)
+    transaction.on_commit(lambda: token_cache.invalidate_user(instance.pk, using=using), using=using)
+
+
+@receiver(pre_save, sender=Expense)
+def remember_stored_expense(sender, instance, raw, using, **kwargs):
+    if raw or instance._state.adding:
+        return
+    loaded = getattr(instance, "_loaded_values", {})
+    if not all(field in loaded for field in rollups.BUCKET_FIELDS + ("amount",)):
+        # Instance was built by hand or loaded with deferred fields.
+        loaded = (
+            Expense._base_manager.using(using)
+            .filter(pk=instance.pk)
+            .values(*rollups.BUCKET_FIELDS, "amount")
+            .first()
+        )
+    instance._stored_values = loaded
+
+
+@receiver(post_save, sender=Expense)
+def update_rollup_on_save(sender, instance, created, raw, using, **kwargs):
+    if raw:
+        return
+    deltas = rollups.new_deltas()
+    stored = getattr(instance, "_stored_values", None)
+    if stored:
+        rollups.add_values(deltas, stored, sign=-1)
+    rollups.add_values(deltas, rollups.instance_values(instance))
+    rollups.apply_deltas(deltas, using=using)
+    generations.bump({instance.user_id, (stored or {}).get("user_id")}, using=using)
+    instance._loaded_values = {
+        field.attname: getattr(instance, field.attname) for field in instance._meta.concrete_fields
+    }
+    instance._stored_values = None
+
+
+@receiver(post_delete, sender=Expense)
+def update_rollup_on_delete(sender, instance, using, origin=None, **kwargs):
+    # Deleting a category or user cascades to its rollup rows as well.
+    if not isinstance(origin, Expense):
+        return
+    rollups.apply_deltas(rollups.deltas_from_instances([instance], sign=-1), using=using)
+    generations.bump({instance.user_id}, using=using)
@@ -0,0 +1,126 @@
+"""Jobs that ``manage.py run_workers`` knows how to run."""
+from django.core.exceptions import ValidationError
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import Q
+
+from . import bulk, receipts, rollups
+from .export import DEFAULT_CHUNK_SIZE, EXPORT_COLUMNS, FORMATS
+from .filters import filter_expenses, parse_expense_filters
+from .importer import ExpenseImporter, ImportFormatError
+from .jobs import JobFailed, job_file, report_progress, task
+from .models import Expense
+
+# Ids handled per transaction by background bulk actions. Each step commits
+# on its own, which lets pollers see progress and keeps other writers from
+# waiting on one long transaction; repeating a step is harmless.
+STEP_SIZE = 5000
+# Rejected import rows kept in the job result.
+REJECTED_ROWS_SHOWN = 100
+
+
+def expenses_of(job):
+    if job.user is None:
+        raise JobFailed("This job has no user.")
+    return Expense.objects.for_user(job.user)
+
+
+def parse_filters(filters):
+    try:
+        return parse_expense_filters(filters or {})
+    except ValidationError as exc:
+        raise JobFailed(exc.messages[0])
+
+
+def in_steps(job, action, ids=None, filter=None):
+    """Apply ``action`` to ``ids`` a step at a time, or to ``filter`` at once."""
+    if ids is None:
+        report_progress(job, 0, 1, force=True)
+        return action(filters=parse_filters(filter))
+    ids = sorted(set(ids))
+    affected = 0
+    for start in range(0, len(ids), STEP_SIZE):
+        affected += action(ids=ids[start : start + STEP_SIZE])
+        report_progress(job, min(start + STEP_SIZE, len(ids)), len(ids))
+    return affected
+
+
+@task("bulk_delete")
+def bulk_delete(job, ids=None, filter=None):
+    queryset = expenses_of(job)
+    deleted = in_steps(job, lambda **target: bulk.bulk_delete(queryset, **target), ids, filter)
+    return {"deleted": deleted}
+
+
+@task("bulk_edit")
+def bulk_edit(job, values, ids=None, filter=None):
+    queryset = expenses_of(job)
+    updated = in_steps(job, lambda **target: bulk.bulk_edit(queryset, values, **target), ids, filter)
+    return {"updated": updated}
+
+
+def export_batches(queryset, size=DEFAULT_CHUNK_SIZE):
+    """Export rows in ``(date, id)`` order, one fully read batch at a time.
+
+    Unlike a single ``iterator()``, no cursor stays open while progress is
+    written: SQLite refuses that write with "database is locked" once
+    another process has committed since the read began.
+    """
+    queryset = queryset.order_by("date", "id").values_list(*(lookup for _, lookup in EXPORT_COLUMNS))
+    after = Q()
+    while rows := list(queryset.filter(after)[:size]):
+        yield rows
+        last_id, last_date = rows[-1][0], rows[-1][1]
+        after = Q(date__gt=last_date) | Q(date=last_date, id__gt=last_id)
+
+
+@task("export")
+def export(job, format="csv", filter=None):
+    if format not in FORMATS:
+        raise JobFailed(f"Unsupported export format {format!r}")
+    encode, content_type, extension = FORMATS[format]
+    queryset = filter_expenses(expenses_of(job), parse_filters(filter))
+    total = queryset.count()
+    report_progress(job, 0, total, force=True)
+
+    def counted(batches):
+        done = 0
+        for rows in batches:
+            yield from rows
+            done += len(rows)
+            report_progress(job, done, total)
+
+    name = f"export-{job.pk}.{extension}"
+    with open(job_file(name), "w", newline="", encoding="utf-8") as out:
+        for chunk in encode(counted(export_batches(queryset))):
+            out.write(chunk)
+    return {"path": name, "content_type": content_type, "rows": total}
+
+
+@task("import")
+def import_expenses(job, path):
+    try:
+        with open(job_file(path), newline="", encoding="utf-8-sig") as lines:
+            result = ExpenseImporter(user=job.user).run(lines)
+    except FileNotFoundError:
+        raise JobFailed("The uploaded file is no longer available.")
+    except (ImportFormatError, UnicodeDecodeError) as exc:
+        raise JobFailed(str(exc))
+    job_file(path).unlink(missing_ok=True)
+    return {
+        "created": result.created,
+        "categories_created": result.categories_created,
+        "rejected": len(result.rejected),
+        "rejected_rows": [
+            {"line": row.line, "errors": row.errors} for row in result.rejected[:REJECTED_ROWS_SHOWN]
+        ],
+    }
+
+
+@task("rebuild_rollups")
+def rebuild_rollups(job, database=DEFAULT_DB_ALIAS):
+    return {"buckets": rollups.rebuild(using=database)}
+
+
+@task("check_receipts")
+def check_receipts(job, limit=None):
+    return receipts.check_due(limit, progress=lambda done, total: report_progress(job, done, total))
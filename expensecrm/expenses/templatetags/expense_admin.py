@@ -0,0 +1,58 @@
+"""Template tags for the expense admin.
+
+Django's system checks import every app's tag libraries, including under
+``expensecrm.settings_api`` where the admin is not installed, so the admin
+is only imported once a tag is used.
+"""
+import copy
+
+from django import template
+
+register = template.Library()
+
+
+class SeekingDates:
+    """Changelist queryset whose ``dates()`` is :func:`distinct_dates`.
+
+    Full-text matches are found by a scan, not a seek, so a searched
+    changelist keeps to one scan per query instead.
+    """
+
+    def __init__(self, queryset):
+        self.queryset = queryset
+        self.searched = bool(queryset.query.extra_tables)
+
+    def aggregate(self, **aggregates):
+        if self.searched:
+            return self.queryset.aggregate(**aggregates)
+        # The tag asks for Min() and Max() of the date together, which
+        # SQLite answers with a scan; one at a time, each is an index seek.
+        result = {}
+        for name, aggregate in aggregates.items():
+            result.update(self.queryset.aggregate(**{name: aggregate}))
+        return result
+
+    def dates(self, field_name, kind):
+        from ..admin import distinct_dates
+
+        if self.searched:
+            return self.queryset.dates(field_name, kind)
+        return distinct_dates(self.queryset, field_name, kind)
+
+
+def indexed_date_hierarchy(cl):
+    """Django's ``date_hierarchy`` with the date choices found by index seeks."""
+    from django.contrib.admin.templatetags.admin_list import date_hierarchy
+
+    cl = copy.copy(cl)
+    cl.queryset = SeekingDates(cl.queryset)
+    return date_hierarchy(cl)
+
+
+@register.tag(name="indexed_date_hierarchy")
+def indexed_date_hierarchy_tag(parser, token):
+    from django.contrib.admin.templatetags.base import InclusionAdminNode
+
+    return InclusionAdminNode(
+        parser, token, func=indexed_date_hierarchy, template_name="date_hierarchy.html", takes_context=False
+    )
@@ -1,9 +1,49 @@
-from django.test import TestCase
-from .models import Expense, Category
+from django.core.files.uploadedfile import SimpleUploadedFile
+from asgiref.sync import async_to_sync
+from django.test import AsyncClient, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.core.exceptions import ImproperlyConfigured
+from django.db import OperationalError, connection, connections, transaction
+from django.core.cache import caches
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db.models import Count, F, Max, Min, Sum
+from .cache import CategoryCache, TokenCache, category_cache, token_cache
+from .generations import bump
+from .models import DataGeneration, Expense, Category, ExpenseRollup, Job, Receipt, ReceiptLink
+from .export import HEADER
+from .fragments import fragment_key
+from .management.commands.explain_queries import full_scans
+from .importer import ExpenseImporter, ImportFormatError
+from .rollups import from_cents
+from .rows import expense_rows
+from . import jobs, metrics, receipts, routers
+from .search import repair as repair_search, search
 from django.urls import reverse
-from django.contrib.auth.models import User
+from django.contrib.auth.models import AnonymousUser, User
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
 from datetime import date
+import csv
+import gzip
+import io
+import hashlib
+import json
+import os
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 from decimal import Decimal
+from io import StringIO
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from datetime import timedelta
+from unittest import mock, skipUnless
+from django.utils import timezone
+from django.conf import settings
 
 class ExpenseModelTest(TestCase):
     def test_create_expense(self):
@@ -32,6 +72,7 @@ class ExpenseViewsTest(TestCase):
         category2 = Category.objects.create(name='Travel')
 
         Expense.objects.create(
+            user=user,
             date=date(2023, 1, 1),
             category=category1,
             description='Lunch',
@@ -39,6 +80,7 @@ class ExpenseViewsTest(TestCase):
             payment_method='Cash',
         )
         Expense.objects.create(
+            user=user,
             date=date(2023, 2, 1),
             category=category2,
             description='Taxi',
@@ -52,3 +94,1881 @@ class ExpenseViewsTest(TestCase):
         )
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.context['overall'], Decimal('20.00'))
+
+
+class QueryBudgetMixin:
+    """Fail a test when a block issues more SQL queries than allowed."""
+
+    def assertQueryBudget(self, budget, func, *args, **kwargs):
+        with CaptureQueriesContext(connection) as ctx:
+            result = func(*args, **kwargs)
+        queries = "\n".join(q["sql"] for q in ctx.captured_queries)
+        self.assertLessEqual(
+            len(ctx), budget,
+            f"{len(ctx)} queries issued, budget is {budget}:\n{queries}",
+        )
+        return result
+
+
+@override_settings(EXPENSE_LIST_PAGE_SIZE=10)
+class ExpenseListPaginationTest(QueryBudgetMixin, TestCase):
+    # session, user, data generation, page, total; categories come from
+    # the cache
+    LIST_QUERY_BUDGET = 5
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.client.login(username='testuser', password='testpass')
+        self.food = Category.objects.create(name='Food')
+        self.travel = Category.objects.create(name='Travel')
+
+    def create_expenses(self, count, category=None, day=date(2023, 1, 1)):
+        Expense.objects.bulk_create(
+            Expense(
+                user=self.user,
+                date=day,
+                category=category or self.food,
+                description=f'Expense {i}',
+                amount=Decimal('1.00'),
+                payment_method='Cash',
+            )
+            for i in range(count)
+        )
+
+    def test_query_count_independent_of_table_size(self):
+        category_cache.categories()
+        for count in (0, 5, 50):
+            self.create_expenses(count)
+            response = self.assertQueryBudget(
+                self.LIST_QUERY_BUDGET, self.client.get, reverse('expense_list')
+            )
+            self.assertEqual(response.status_code, 200)
+            self.assertContains(response, 'testuser')
+
+    def test_cursor_walks_every_row_once(self):
+        self.create_expenses(12, day=date(2023, 1, 1))
+        self.create_expenses(13, day=date(2023, 2, 1))
+        seen = []
+        url = reverse('expense_list')
+        while url:
+            response = self.client.get(url)
+            page = response.context['expenses']
+            self.assertLessEqual(len(page), 10)
+            seen.extend(e.pk for e in page)
+            next_url = response.context['next_url']
+            url = reverse('expense_list') + next_url if next_url else None
+        expected = list(Expense.objects.order_by('-date', '-id').values_list('pk', flat=True))
+        self.assertEqual(seen, expected)
+        self.assertEqual(response.context['total'], Decimal('25.00'))
+
+    def test_page_size_and_category_filter(self):
+        self.create_expenses(4, category=self.food)
+        self.create_expenses(6, category=self.travel)
+        response = self.client.get(
+            reverse('expense_list'), {'category': self.travel.pk, 'page_size': 4}
+        )
+        page = response.context['expenses']
+        self.assertEqual(len(page), 4)
+        self.assertTrue(all(e.category_id == self.travel.pk for e in page))
+        self.assertIn(f'category={self.travel.pk}', response.context['next_url'])
+
+    def test_invalid_cursor_falls_back_to_first_page(self):
+        self.create_expenses(3)
+        response = self.client.get(reverse('expense_list'), {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['expenses']), 3)
+
+
+class ExpenseListFragmentTest(TestCase):
+    def setUp(self):
+        caches['fragments'].clear()
+        self.addCleanup(caches['fragments'].clear)
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.client.login(username='testuser', password='testpass')
+        self.food = Category.objects.create(name='Food')
+        self.expense = Expense.objects.create(
+            user=self.user, date=date(2023, 1, 1), category=self.food,
+            description='Lunch', amount=Decimal('10.00'), payment_method='Cash',
+        )
+
+    def poison_cached_row(self):
+        version = DataGeneration.objects.get(user=self.user).generation
+        key = fragment_key(expense_rows(Expense.objects.filter(pk=self.expense.pk)).get(), version)
+        self.assertIsNotNone(caches['fragments'].get(key))
+        caches['fragments'].set(key, ('<tr>from cache</tr>', '<details>from cache</details>'))
+
+    def test_rows_are_served_from_the_cache(self):
+        response = self.client.get(reverse('expense_list'))
+        self.assertContains(response, 'Lunch', count=2)
+        self.poison_cached_row()
+        response = self.client.get(reverse('expense_list'))
+        self.assertContains(response, 'from cache', count=2)
+        self.assertNotContains(response, 'Lunch')
+
+    def test_writes_replace_cached_rows(self):
+        self.client.get(reverse('expense_list'))
+        self.poison_cached_row()
+        self.expense.description = 'Brunch'
+        self.expense.save()
+        response = self.client.get(reverse('expense_list'))
+        self.assertContains(response, 'Brunch', count=2)
+        self.assertNotContains(response, 'from cache')
+
+        self.poison_cached_row()
+        self.food.name = 'Groceries'
+        self.food.save()
+        response = self.client.get(reverse('expense_list'))
+        self.assertContains(response, 'Groceries')
+        self.assertNotContains(response, 'from cache')
+
+    def test_large_page_is_cached_without_evicting_aggregates(self):
+        caches['default'].set('sentinel', 1)
+        Expense.objects.bulk_create([
+            Expense(user=self.user, date=date(2023, 2, 1), category=self.food,
+                    description=f'Row {n}', amount=Decimal('1.00'), payment_method='Card')
+            for n in range(399)
+        ])
+        self.client.get(reverse('expense_list'), {'page_size': 400})
+        version = DataGeneration.objects.get(user=self.user).generation
+        keys = [fragment_key(row, version) for row in expense_rows(Expense.objects.all())]
+        self.assertEqual(len(caches['fragments'].get_many(keys)), 400)
+        self.assertEqual(caches['default'].get('sentinel'), 1)
+
+    def test_streamed_page_matches_the_rendered_one(self):
+        response = self.client.get(reverse('expense_list'))
+        with override_settings(EXPENSE_LIST_STREAMING=True):
+            streamed = self.client.get(reverse('expense_list'))
+        self.assertTrue(streamed.streaming)
+        body = b''.join(streamed.streaming_content)
+        # Only the CSRF token differs between the two pages.
+        token = re.compile(rb'name="csrfmiddlewaretoken" value="[^"]+"')
+        self.assertEqual(token.sub(b'', body), token.sub(b'', response.content))
+
+
+class ExpenseRollupTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.food = Category.objects.create(name='Food')
+        self.travel = Category.objects.create(name='Travel')
+
+    def expense(self, amount, day=date(2023, 1, 1), category=None, method='Cash', user=None):
+        return Expense.objects.create(
+            user=user or self.user,
+            date=day,
+            category=category or self.food,
+            description='Item',
+            amount=Decimal(amount),
+            payment_method=method,
+        )
+
+    def assertRollupMatchesExpenses(self):
+        raw = {
+            (row['date'], row['category_id'], row['user_id'], row['payment_method']): (row['total'], row['n'])
+            for row in Expense.objects.values('date', 'category_id', 'user_id', 'payment_method')
+            .annotate(total=Sum('amount'), n=Count('id'))
+        }
+        rolled = {
+            (r.day, r.category_id, r.user_id, r.payment_method): (from_cents(r.total_cents), r.count)
+            for r in ExpenseRollup.objects.filter(count__gt=0)
+        }
+        self.assertEqual(rolled, raw)
+
+    def test_save_update_and_delete_keep_rollup_in_sync(self):
+        first = self.expense('10.10')
+        self.expense('0.20')
+        self.expense('5.05', method='Card', user=None)
+        self.assertRollupMatchesExpenses()
+
+        first = Expense.objects.get(pk=first.pk)
+        first.category = self.travel
+        first.amount = Decimal('7.77')
+        first.date = date(2023, 3, 1)
+        first.save()
+        first.amount = Decimal('8.88')
+        first.save()
+        self.assertRollupMatchesExpenses()
+
+        first.delete()
+        self.assertRollupMatchesExpenses()
+
+    def test_bulk_operations_keep_rollup_in_sync(self):
+        created = Expense.objects.bulk_create(
+            Expense(user=self.user, date=date(2023, 1, i % 28 + 1), category=self.food,
+                    description='Bulk', amount=Decimal('0.10'), payment_method='Online')
+            for i in range(60)
+        )
+        self.assertRollupMatchesExpenses()
+        for expense in created[:20]:
+            expense.category = self.travel
+            expense.amount = Decimal('1.01')
+        Expense.objects.bulk_update(created[:20], ['category', 'amount'])
+        self.assertRollupMatchesExpenses()
+        Expense.objects.filter(category=self.travel).delete()
+        self.assertRollupMatchesExpenses()
+
+    def test_queryset_update_keeps_rollup_in_sync(self):
+        for i in range(12):
+            self.expense(f'{i}.25', day=date(2023, 1, i % 4 + 1), method='Card' if i % 2 else 'Cash')
+        self.expense('9.99', user=None)
+        Expense.objects.filter(payment_method='Card').update(category=self.travel)
+        self.assertRollupMatchesExpenses()
+        Expense.objects.filter(category=self.travel).update(date='2023-02-01', payment_method='Online')
+        self.assertRollupMatchesExpenses()
+        Expense.objects.filter(user=None).update(amount=Decimal('1.00'), category_id=self.travel.pk)
+        self.assertRollupMatchesExpenses()
+        Expense.objects.filter(date__lt=date(2023, 1, 3)).update(amount=F('amount') * 2, user=None)
+        self.assertRollupMatchesExpenses()
+        Expense.objects.update(description='Renamed')
+        self.assertRollupMatchesExpenses()
+
+    def test_bulk_edit_view(self):
+        self.client.login(username='testuser', password='testpass')
+        other = User.objects.create_user(username='other')
+        ids = [self.expense('1.00').pk, self.expense('2.00').pk, self.expense('3.00', user=other).pk]
+        response = self.client.post(reverse('expense_bulk_edit'), {
+            'selected_expenses': ids, 'category': self.travel.pk, 'payment_method': 'Card'})
+        self.assertRedirects(response, reverse('expense_list'))
+        self.assertEqual(
+            list(Expense.objects.order_by('pk').values_list('category__name', 'payment_method')),
+            [('Travel', 'Card'), ('Travel', 'Card'), ('Food', 'Cash')],
+        )
+        self.assertRollupMatchesExpenses()
+        for data in ({'payment_method': 'Cheque'}, {'date': 'yesterday'}, {}):
+            response = self.client.post(reverse('expense_bulk_edit'), dict(data, selected_expenses=ids))
+            self.assertEqual(response.status_code, 400, data)
+        self.assertEqual(Expense.objects.filter(payment_method='Card').count(), 2)
+
+    def test_bulk_delete_view_updates_rollup(self):
+        self.client.login(username='testuser', password='testpass')
+        ids = [self.expense('3.33').pk, self.expense('4.44').pk]
+        self.expense('5.55')
+        self.client.post(reverse('expense_bulk_delete'), {'selected_expenses': ids})
+        self.assertEqual(Expense.objects.count(), 1)
+        self.assertRollupMatchesExpenses()
+
+    def test_category_delete_cascades(self):
+        self.expense('1.00', category=self.travel)
+        self.expense('2.00')
+        self.travel.delete()
+        self.assertRollupMatchesExpenses()
+
+    def test_rebuild_command(self):
+        self.expense('1.11')
+        self.expense('2.22', category=self.travel)
+        ExpenseRollup.objects.update(total_cents=0)
+        call_command('rebuild_rollups', stdout=StringIO())
+        self.assertRollupMatchesExpenses()
+
+    def test_summary_matches_raw_aggregation(self):
+        self.client.login(username='testuser', password='testpass')
+        for i in range(30):
+            self.expense(f'{i}.{i:02d}', day=date(2023, 1, i % 28 + 1),
+                         category=self.food if i % 3 else self.travel)
+        params = {'start_date': '2023-01-05', 'end_date': '2023-01-20'}
+        response = self.client.get(reverse('expense_summary'), params)
+        raw = Expense.objects.filter(date__gte='2023-01-05', date__lte='2023-01-20')
+        expected = list(raw.values('category__name').annotate(total=Sum('amount')).order_by('category__name'))
+        self.assertEqual(list(response.context['summary']), expected)
+        self.assertEqual(response.context['overall'], raw.aggregate(total=Sum('amount'))['total'])
+
+
+class ExpenseAPITest(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='api@example.com', password='testpass')
+        self.other = User.objects.create_user(username='other@example.com', password='testpass')
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        self.food = Category.objects.create(name='Food')
+        self.travel = Category.objects.create(name='Travel')
+
+    def payload(self, i, **overrides):
+        data = {
+            'date': f'2023-01-{i % 28 + 1:02d}',
+            'category': self.food.pk,
+            'description': f'Synced {i}',
+            'amount': f'{i}.50',
+            'payment_method': 'Card',
+        }
+        data.update(overrides)
+        return data
+
+    def test_requires_token(self):
+        response = APIClient().get(reverse('api_expense_list'))
+        self.assertEqual(response.status_code, 401)
+
+    def test_bulk_create_update_delete(self):
+        response = self.assertQueryBudget(
+            12,
+            self.client.post,
+            reverse('api_expense_bulk'),
+            [self.payload(i) for i in range(200)],
+            format='json',
+        )
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(Expense.objects.filter(user=self.user).count(), 200)
+        ids = [row['id'] for row in response.data]
+
+        updates = [{'id': pk, 'category': self.travel.pk, 'amount': '1.00'} for pk in ids[:50]]
+        response = self.client.patch(reverse('api_expense_bulk'), updates, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(Expense.objects.filter(category=self.travel).count(), 50)
+        self.assertEqual(
+            ExpenseRollup.objects.filter(category=self.travel).aggregate(n=Sum('count'))['n'], 50
+        )
+
+        response = self.client.delete(reverse('api_expense_bulk'), {'ids': ids[:150]}, format='json')
+        self.assertEqual(response.data, {'deleted': 150})
+        self.assertEqual(Expense.objects.count(), 50)
+
+    @override_settings(EXPENSE_BULK_CHUNK_SIZE=7)
+    def test_bulk_edit_by_ids_and_filter(self):
+        Expense.objects.bulk_create(
+            Expense(user=self.user, **self.payload(i, category=self.food)) for i in range(40)
+        )
+        foreign = Expense.objects.create(user=self.other, **self.payload(1, category=self.food))
+        ids = list(Expense.objects.filter(user=self.user).values_list('pk', flat=True)[:20])
+        url = reverse('api_expense_bulk_edit')
+        response = self.client.post(url, {'ids': ids + [foreign.pk], 'values': {
+            'category': self.travel.pk, 'payment_method': 'Online'}}, format='json')
+        self.assertEqual(response.data, {'updated': 20})
+        self.assertEqual(Expense.objects.filter(category=self.travel, payment_method='Online').count(), 20)
+
+        matching = Expense.objects.filter(
+            user=self.user, category=self.food, date__lte=date(2023, 1, 10)).count()
+        # Grouping SELECT, UPDATE, rollup upsert, generation bump (+ savepoints).
+        response = self.assertQueryBudget(
+            10, self.client.post, url,
+            {'filter': {'category': self.food.pk, 'end_date': '2023-01-10'},
+             'values': {'date': '2024-06-30'}},
+            format='json',
+        )
+        self.assertEqual(response.data['updated'], matching)
+        self.assertEqual(Expense.objects.filter(date=date(2024, 6, 30)).count(), matching)
+        self.assertEqual(Expense.objects.get(pk=foreign.pk).category, self.food)
+        self.assertEqual(
+            ExpenseRollup.objects.filter(day=date(2024, 6, 30)).aggregate(n=Sum('count'))['n'], matching
+        )
+
+    def test_bulk_edit_validation(self):
+        url = reverse('api_expense_bulk_edit')
+        for data in (
+            {'values': {'payment_method': 'Card'}},
+            {'ids': [1], 'filter': {}, 'values': {'payment_method': 'Card'}},
+            {'ids': [1], 'values': {}},
+            {'ids': [1], 'values': {'payment_method': 'Cheque'}},
+            {'filter': {'start_date': 'yesterday'}, 'values': {'payment_method': 'Card'}},
+            {'filter': {}, 'values': {'payment_method': 'Card'}},
+            {'filter': {'category': self.food.pk}, 'all': True, 'values': {'payment_method': 'Card'}},
+            {'all': False, 'values': {'payment_method': 'Card'}},
+        ):
+            self.assertEqual(self.client.post(url, data, format='json').status_code, 400, data)
+
+    @override_settings(EXPENSE_BULK_CHUNK_SIZE=3)
+    def test_bulk_delete_by_filter_and_in_chunks(self):
+        Expense.objects.bulk_create(
+            Expense(user=user, **self.payload(i, category=self.food))
+            for i in range(10) for user in (self.user, self.other)
+        )
+        ids = list(Expense.objects.order_by('pk').values_list('pk', flat=True))
+        response = self.client.delete(reverse('api_expense_bulk'), {'ids': ids[:8]}, format='json')
+        self.assertEqual(response.data, {'deleted': 4})
+        response = self.client.delete(reverse('api_expense_bulk'), {'filter': {}}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Expense.objects.filter(user=self.user).count(), 6)
+        response = self.client.delete(reverse('api_expense_bulk'), {'all': True}, format='json')
+        self.assertEqual(response.data, {'deleted': 6})
+        self.assertEqual(Expense.objects.count(), 10)
+        self.assertFalse(Expense.objects.filter(user=self.user).exists())
+
+    def test_bulk_create_is_all_or_nothing(self):
+        items = [self.payload(1), self.payload(2, payment_method='Cheque')]
+        response = self.client.post(reverse('api_expense_bulk'), items, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('payment_method', response.data[1])
+        self.assertFalse(Expense.objects.exists())
+
+    def test_bulk_update_rejects_foreign_expenses(self):
+        foreign = Expense.objects.create(user=self.other, **self.payload(1, category=self.food))
+        response = self.client.patch(
+            reverse('api_expense_bulk'), [{'id': foreign.pk, 'amount': '0.01'}], format='json'
+        )
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.data['ids'], [foreign.pk])
+
+    def test_list_is_paginated_scoped_and_sparse(self):
+        self.client.post(reverse('api_expense_bulk'), [self.payload(i) for i in range(5)], format='json')
+        Expense.objects.create(user=self.other, **self.payload(9, category=self.food))
+        response = self.client.get(reverse('api_expense_list'), {'page_size': 3, 'fields': 'id,amount'})
+        self.assertEqual(len(response.data['results']), 3)
+        self.assertEqual(set(response.data['results'][0]), {'id', 'amount'})
+        response = self.client.get(response.data['next'])
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertIsNone(response.data['next'])
+
+    def test_single_expense_crud(self):
+        response = self.client.post(reverse('api_expense_list'), self.payload(3), format='json')
+        self.assertEqual(response.status_code, 201)
+        url = reverse('api_expense_detail', args=[response.data['id']])
+        response = self.client.patch(url, {'amount': '9.99'}, format='json')
+        self.assertEqual(response.data['amount'], '9.99')
+        self.assertEqual(response.data['category_name'], 'Food')
+        self.assertEqual(self.client.delete(url).status_code, 204)
+        self.assertFalse(Expense.objects.exists())
+
+    def test_categories(self):
+        response = self.client.post(reverse('api_category_list'), {'name': 'Office'}, format='json')
+        self.assertEqual(response.status_code, 201)
+        response = self.client.get(reverse('api_category_list'))
+        self.assertEqual([c['name'] for c in response.data], ['Food', 'Office', 'Travel'])
+
+
+class ExpenseExportTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.client.login(username='testuser', password='testpass')
+        self.food = Category.objects.create(name='Food')
+        self.travel = Category.objects.create(name='Travel')
+        for i, category in enumerate([self.food, self.travel, self.food]):
+            Expense.objects.create(
+                user=self.user, date=date(2023, 1, i + 1), category=category,
+                description=f'Item, "{i}"', amount=Decimal('1.50'), payment_method='Card',
+            )
+
+    def test_csv_export_streams_filtered_rows(self):
+        response = self.client.get(
+            reverse('expense_export'), {'category': self.food.pk, 'start_date': '2023-01-02'}
+        )
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        rows = list(csv.reader(b''.join(response.streaming_content).decode().splitlines()))
+        self.assertEqual(rows[0], list(HEADER))
+        self.assertEqual(rows[1][1:], ['2023-01-03', 'Food', 'testuser', 'Item, "2"', '1.50', 'Card', ''])
+        self.assertEqual(len(rows), 2)
+
+    def test_jsonl_export(self):
+        response = self.client.get(reverse('expense_export'), {'format': 'jsonl'})
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        records = [json.loads(line) for line in lines]
+        self.assertEqual([r['category'] for r in records], ['Food', 'Travel', 'Food'])
+        self.assertEqual(records[0]['amount'], '1.50')
+
+    def test_invalid_filters_rejected(self):
+        response = self.client.get(reverse('expense_export'), {'start_date': 'yesterday'})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(reverse('expense_export'), {'format': 'xml'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_export_command(self):
+        out = StringIO()
+        call_command('export_expenses', '--format', 'jsonl', '--end-date', '2023-01-02',
+                     '--chunk-size', '1', stdout=out)
+        self.assertEqual(len(out.getvalue().splitlines()), 2)
+        with self.assertRaises(CommandError):
+            call_command('export_expenses', '--category', 'food', stdout=StringIO())
+
+
+class ExpenseImportTest(QueryBudgetMixin, TestCase):
+    CSV = (
+        'Date,Category,Description,Amount,Payment_Method,Receipt_Link\n'
+        '2023-01-01,Food,Lunch,10.50,Cash,\n'
+        '2023-01-02,Rent,Office rent,900.00,Online,https://example.com/r/1\n'
+        'not-a-date,Food,Bad date,1.00,Cash,\n'
+        '2023-01-03,Food,Bad method,1.00,Cheque,\n'
+        '2023-01-04,,No category,1.234,Card,not a url\n'
+    )
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        Category.objects.create(name='Food')
+
+    def test_import_command_reports_rejected_rows(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            source = os.path.join(tmp, 'in.csv')
+            report = os.path.join(tmp, 'errors.csv')
+            with open(source, 'w') as f:
+                f.write(self.CSV)
+            out = StringIO()
+            call_command('import_expenses', source, '--user', 'testuser', '--errors', report, stdout=out)
+            with open(report) as f:
+                errors = list(csv.DictReader(f))
+        self.assertIn('Imported 2 expenses, created 1 categories, rejected 3 rows.', out.getvalue())
+        self.assertEqual([row['line'] for row in errors], ['4', '5', '6'])
+        self.assertIn('payment_method', errors[1]['errors'])
+        self.assertIn('category', errors[2]['errors'])
+        self.assertIn('receipt_link', errors[2]['errors'])
+        self.assertIn('amount', errors[2]['errors'])
+        self.assertEqual(Expense.objects.filter(user=self.user).count(), 2)
+        self.assertEqual(Expense.objects.get(category__name='Rent').amount, Decimal('900.00'))
+        self.assertEqual(ExpenseRollup.objects.aggregate(total=Sum('total_cents'))['total'], 91050)
+
+    def test_queries_do_not_grow_per_row(self):
+        rows = ''.join(f'2023-02-{i % 28 + 1:02d},Cat {i % 7},Row {i},{i}.25,Card,\n' for i in range(2000))
+        lines = StringIO('date,category,description,amount,payment_method\n' + rows)
+        importer = ExpenseImporter(user=self.user, batch_size=500)
+        result = self.assertQueryBudget(60, importer.run, lines)
+        self.assertEqual(result.created, 2000)
+        self.assertEqual(Category.objects.count(), 8)
+
+    def test_missing_columns(self):
+        with self.assertRaises(ImportFormatError):
+            ExpenseImporter().run(StringIO('date,amount\n2023-01-01,1\n'))
+
+    def test_upload_view(self):
+        self.client.login(username='testuser', password='testpass')
+        upload = SimpleUploadedFile('bank.csv', self.CSV.encode(), content_type='text/csv')
+        response = self.client.post(reverse('expense_import'), {'file': upload})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['result'].created, 2)
+        self.assertContains(response, '3 rows were rejected')
+
+
+class SeedDataCommandTest(TestCase):
+    def seed(self, **options):
+        call_command('seed_data', stdout=StringIO(), **options)
+        return list(Expense.objects.order_by('id').values_list(
+            'user__username', 'date', 'category__name', 'description', 'amount', 'payment_method'
+        ))
+
+    def test_defaults(self):
+        self.seed()
+        self.assertEqual(Category.objects.count(), 5)
+        self.assertEqual(User.objects.count(), 10)
+        self.assertEqual(Expense.objects.count(), 50)
+        self.assertTrue(User.objects.get(username='user1').check_password('password'))
+
+    def test_counts_span_and_rollups(self):
+        self.seed(users=3, categories=8, expenses=1234, days=30, batch_size=100, seed=7)
+        self.assertEqual(Category.objects.count(), 8)
+        self.assertEqual(Expense.objects.count(), 1234)
+        dates = Expense.objects.aggregate(first=Min('date'), last=Max('date'))
+        self.assertLessEqual((dates['last'] - dates['first']).days, 29)
+        self.assertEqual(ExpenseRollup.objects.aggregate(n=Sum('count'))['n'], 1234)
+
+    def test_seed_is_reproducible(self):
+        first = self.seed(expenses=200, seed=42)
+        self.assertEqual(max(row[1] for row in first), date(2024, 12, 31))
+        Expense.objects.all().delete()
+        tomorrow = timezone.localdate() + timedelta(days=1)
+        with mock.patch('django.utils.timezone.localdate', return_value=tomorrow):
+            self.assertEqual(self.seed(expenses=200, seed=42), first)
+
+    def test_end_date(self):
+        dates = {row[1] for row in self.seed(expenses=100, days=10, end_date=date(2023, 3, 31), seed=1)}
+        self.assertEqual((min(dates), max(dates)), (date(2023, 3, 22), date(2023, 3, 31)))
+
+
+class QueryPlanTest(TestCase):
+    def test_hot_queries_use_indexes(self):
+        call_command('seed_data', expenses=2000, users=5, stdout=StringIO())
+        out = StringIO()
+        call_command('explain_queries', stdout=out)
+        self.assertNotIn('FULL SCAN', out.getvalue())
+
+    def test_full_scan_detection(self):
+        self.assertEqual(full_scans('SCAN expenses_expense', 'sqlite'), ['expenses_expense'])
+        self.assertEqual(full_scans('SCAN TABLE expenses_expense\nSCAN CONSTANT ROW', 'sqlite'),
+                         ['expenses_expense'])
+        self.assertEqual(full_scans('SCAN expenses_expense USING INDEX expense_date_id_idx', 'sqlite'), [])
+        self.assertEqual(full_scans('SCAN expenses_expense_fts VIRTUAL TABLE INDEX 0:M2', 'sqlite'), [])
+        self.assertEqual(full_scans('Seq Scan on expenses_expense  (cost=0.00..1.01)', 'postgresql'),
+                         ['expenses_expense'])
+
+
+class PerUserScopingTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.other = User.objects.create_user(username='other', password='testpass')
+        self.client.login(username='testuser', password='testpass')
+        food = Category.objects.create(name='Food')
+        self.mine = Expense.objects.create(
+            user=self.user, date=date(2023, 1, 1), category=food,
+            description='Mine', amount=Decimal('1.00'), payment_method='Cash',
+        )
+        self.theirs = Expense.objects.create(
+            user=self.other, date=date(2023, 1, 1), category=food,
+            description='Theirs', amount=Decimal('50.00'), payment_method='Cash',
+        )
+
+    def test_for_user(self):
+        self.assertEqual(list(Expense.objects.for_user(self.user)), [self.mine])
+        self.assertFalse(Expense.objects.for_user(AnonymousUser()).exists())
+
+    def test_list_and_summary_only_show_own_expenses(self):
+        response = self.client.get(reverse('expense_list'))
+        self.assertEqual([row.pk for row in response.context['expenses']], [self.mine.pk])
+        self.assertEqual(response.context['total'], Decimal('1.00'))
+        response = self.client.get(reverse('expense_summary'))
+        self.assertEqual(response.context['overall'], Decimal('1.00'))
+
+    def test_cannot_touch_other_users_expenses(self):
+        self.assertEqual(self.client.get(reverse('expense_edit', args=[self.theirs.pk])).status_code, 404)
+        self.assertEqual(self.client.post(reverse('expense_delete', args=[self.theirs.pk])).status_code, 404)
+        self.client.post(reverse('expense_bulk_delete'), {'selected_expenses': [self.mine.pk, self.theirs.pk]})
+        self.assertEqual(list(Expense.objects.all()), [self.theirs])
+
+
+class CategoryCacheTest(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        category_cache.invalidate()
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.client.login(username='testuser', password='testpass')
+        self.food = Category.objects.create(name='Food')
+        self.travel = Category.objects.create(name='Travel')
+
+    def test_pages_read_categories_from_cache(self):
+        category_cache.categories()
+        misses = category_cache.misses
+        response = self.assertQueryBudget(2, self.client.get, reverse('expense_add'))
+        self.assertContains(response, f'<option value="{self.travel.pk}">Travel</option>', html=True)
+        expense = Expense.objects.create(
+            user=self.user, date=date(2023, 1, 1), category=self.food,
+            description='Lunch', amount=Decimal('10.00'), payment_method='Cash',
+        )
+        expense = Expense.objects.get(pk=expense.pk)
+        self.assertQueryBudget(0, str, expense)
+        self.assertEqual(category_cache.misses, misses)
+
+    def test_form_validates_against_cache(self):
+        data = {'date': '2023-01-01', 'description': 'Taxi', 'amount': '5.00', 'payment_method': 'Cash'}
+        response = self.client.post(reverse('expense_add'), dict(data, category=self.travel.pk))
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Expense.objects.get().category, self.travel)
+        response = self.client.post(reverse('expense_add'), dict(data, category=999999))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('category', response.context['form'].errors)
+
+    def test_writes_invalidate(self):
+        self.assertEqual(category_cache.name(self.food.pk), 'Food')
+        self.food.name = 'Groceries'
+        self.food.save()
+        self.assertEqual(category_cache.name(self.food.pk), 'Groceries')
+        self.food.delete()
+        self.assertIsNone(category_cache.get(self.food.pk))
+        Category.objects.bulk_create([Category(name='Office')])
+        self.assertIn('Office', [c.name for c in category_cache.categories()])
+        Category.objects.filter(name='Office').update(name='Rent')
+        self.assertEqual([c.name for c in category_cache.categories()], ['Rent', 'Travel'])
+
+    def test_categories_created_by_another_process_are_accepted(self):
+        category_cache.categories()
+        stale = category_cache._entry
+        office = Category.objects.create(name='Office')
+        category_cache._entry = stale
+        response = self.client.get(reverse('expense_add'), {'category': office.pk})
+        self.assertContains(response, f'<option value="{office.pk}" selected>Office</option>', html=True)
+        category_cache._entry = stale
+        data = {'date': '2023-01-01', 'description': 'Paper', 'amount': '5.00', 'payment_method': 'Cash'}
+        self.assertEqual(self.client.post(reverse('expense_add'), dict(data, category=office.pk)).status_code, 302)
+        category_cache._entry = stale
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.post(reverse('api_expense_bulk'), [dict(data, category=office.pk)], format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Expense.objects.filter(category=office).count(), 2)
+
+    @override_settings(
+        EXPENSES_CATEGORY_CACHE='default',
+        CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    )
+    def test_shared_backend_invalidates_other_processes(self):
+        other_process = CategoryCache()
+        self.assertEqual(other_process.name(self.food.pk), 'Food')
+        self.assertEqual(other_process.name(self.food.pk), 'Food')
+        self.assertEqual((other_process.hits, other_process.misses), (1, 1))
+        Category.objects.filter(pk=self.food.pk).update(name='Groceries')
+        self.assertEqual(other_process.name(self.food.pk), 'Groceries')
+
+    def test_stats_endpoint(self):
+        category_cache.categories()
+        category_cache.categories()
+        admin = User.objects.create_superuser(username='admin', password='testpass')
+        client = APIClient()
+        client.force_authenticate(self.user)
+        self.assertEqual(client.get(reverse('api_cache_stats')).status_code, 403)
+        client.force_authenticate(admin)
+        stats = client.get(reverse('api_cache_stats')).data['categories']
+        self.assertEqual(stats['size'], 2)
+        self.assertGreaterEqual(stats['hits'], 1)
+
+
+class DeletedCategoryTest(TransactionTestCase):
+    """A category deleted by another process after the cache validated it.
+
+    Foreign keys are checked when the transaction commits, which TestCase
+    never does.
+    """
+
+    def setUp(self):
+        category_cache.invalidate()
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.client.login(username='testuser', password='testpass')
+        self.food = Category.objects.create(name='Food')
+        category_cache.categories()
+        stale = category_cache._entry
+        Category.objects.filter(pk=self.food.pk).delete()
+        category_cache._entry = stale
+        self.data = {'date': '2023-01-01', 'description': 'Taxi', 'amount': '5.00',
+                     'payment_method': 'Cash', 'category': self.food.pk}
+
+    def test_form_reports_the_category(self):
+        response = self.client.post(reverse('expense_add'), self.data)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('category', response.context['form'].errors)
+        self.assertFalse(Expense.objects.exists())
+
+    def test_bulk_api_reports_the_category(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.post(reverse('api_expense_bulk'), [self.data], format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['category'], ['This category no longer exists.'])
+        self.assertFalse(Expense.objects.exists())
+
+
+class DataGenerationTest(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.other = User.objects.create_user(username='other', password='testpass')
+        self.client.login(username='testuser', password='testpass')
+        self.food = Category.objects.create(name='Food')
+
+    def generation(self, user=None):
+        row = DataGeneration.objects.filter(user=user or self.user).first()
+        return row.generation if row else 0
+
+    def add(self, user=None, amount='10.00'):
+        return Expense.objects.create(
+            user=user or self.user, date=date(2023, 1, 1), category=self.food,
+            description='Lunch', amount=Decimal(amount), payment_method='Cash',
+        )
+
+    def test_writes_bump_only_the_owner(self):
+        seen = [self.generation()]
+        expense = self.add()
+        seen.append(self.generation())
+        expense.amount = Decimal('12.00')
+        expense.save()
+        seen.append(self.generation())
+        Expense.objects.bulk_create([Expense(
+            user=self.user, date=date(2023, 1, 2), category=self.food,
+            description='Taxi', amount=Decimal('5.00'), payment_method='Card',
+        )])
+        seen.append(self.generation())
+        self.client.post(reverse('expense_bulk_delete'), {'selected_expenses': [expense.pk]})
+        seen.append(self.generation())
+        self.assertEqual(seen, sorted(set(seen)))
+        self.assertEqual(self.generation(self.other), 0)
+
+    def test_bump_never_reuses_a_rolled_back_generation(self):
+        bump([self.user.pk])
+        before = self.generation()
+        try:
+            with transaction.atomic():
+                bump([self.user.pk])
+                rolled_back = self.generation()
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        self.assertEqual(self.generation(), before)
+        bump([self.user.pk])
+        self.assertGreater(self.generation(), rolled_back)
+
+    def test_summary_is_cached_until_data_changes(self):
+        self.add()
+        url = reverse('expense_summary')
+        self.assertEqual(self.client.get(url).context['overall'], Decimal('10.00'))
+        # session, user, data generation
+        response = self.assertQueryBudget(3, self.client.get, url)
+        self.assertEqual(response.context['overall'], Decimal('10.00'))
+        self.add(user=self.other)
+        self.assertEqual(self.client.get(url).context['overall'], Decimal('10.00'))
+        self.add()
+        self.assertEqual(self.client.get(url).context['overall'], Decimal('20.00'))
+
+    def test_summary_cache_follows_category_renames(self):
+        self.add()
+        url = reverse('expense_summary')
+        self.client.get(url)
+        self.food.name = 'Groceries'
+        self.food.save()
+        response = self.client.get(url)
+        self.assertEqual(response.context['summary'][0]['category__name'], 'Groceries')
+
+    def test_conditional_get(self):
+        self.add()
+        url = reverse('expense_summary')
+        response = self.client.get(url)
+        self.assertTrue(response.has_header('Last-Modified'))
+        etag = response['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.add()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_list_total_is_cached(self):
+        self.add()
+        self.client.get(reverse('expense_list'))
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('expense_list'))
+        self.assertEqual(response.context['total'], Decimal('10.00'))
+        self.assertFalse(any('SUM(' in q['sql'].upper() for q in ctx.captured_queries))
+
+
+class ExpenseAggregateAPITest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='api@example.com', password='testpass')
+        self.other = User.objects.create_user(username='other@example.com', password='testpass')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.food = Category.objects.create(name='Food')
+        self.travel = Category.objects.create(name='Travel')
+        rows = [
+            (self.user, date(2023, 1, 2), self.food, '10.00', 'Cash'),
+            (self.user, date(2023, 1, 20), self.travel, '20.50', 'Card'),
+            (self.user, date(2023, 3, 5), self.food, '5.00', 'Card'),
+            (self.other, date(2023, 1, 2), self.food, '99.00', 'Cash'),
+        ]
+        Expense.objects.bulk_create(
+            Expense(user=user, date=day, category=category, description='x',
+                    amount=Decimal(amount), payment_method=method)
+            for user, day, category, amount, method in rows
+        )
+        self.url = reverse('api_expense_aggregate')
+        self.range = {'start_date': '2023-01-01', 'end_date': '2023-04-30'}
+
+    def get(self, **params):
+        response = self.client.get(self.url, dict(self.range, **params))
+        self.assertEqual(response.status_code, 200, getattr(response, 'data', None))
+        return response.data
+
+    def test_monthly_totals_with_empty_months(self):
+        data = self.get(interval='month')
+        self.assertEqual(data['periods'], ['2023-01-01', '2023-02-01', '2023-03-01', '2023-04-01'])
+        [series] = data['series']
+        self.assertEqual(series['totals'], ['30.50', '0.00', '5.00', '0.00'])
+        self.assertEqual(series['counts'], [2, 0, 1, 0])
+        self.assertEqual(series['total'], '35.50')
+
+    def test_group_by_category_and_payment_method(self):
+        data = self.get(group_by='category')
+        self.assertEqual(
+            [(s['label'], s['total']) for s in data['series']], [('Travel', '20.50'), ('Food', '15.00')]
+        )
+        self.assertNotIn('periods', data)
+        data = self.get(group_by='payment_method', interval='week', category=self.food.pk)
+        by_method = {s['key']: s for s in data['series']}
+        self.assertEqual(set(by_method), {'Cash', 'Card'})
+        self.assertEqual(data['periods'][0], '2022-12-26')
+        self.assertEqual(sum(map(Decimal, by_method['Cash']['totals'])), Decimal('10.00'))
+
+    def test_group_by_user_is_scoped_unless_staff_asks_for_all(self):
+        data = self.get(group_by='user', scope='all')
+        self.assertEqual([s['label'] for s in data['series']], ['api@example.com'])
+        self.user.is_staff = True
+        self.user.save()
+        data = self.get(group_by='user', scope='all')
+        self.assertEqual([s['label'] for s in data['series']], ['other@example.com', 'api@example.com'])
+
+    def test_empty_range_and_bad_params(self):
+        data = self.get(interval='day', start_date='2024-01-01', end_date='2024-01-03')
+        self.assertEqual(data['series'][0]['totals'], ['0.00', '0.00', '0.00'])
+        for params in ({'interval': 'hour'}, {'group_by': 'amount'}, {'start_date': '2023-05-01'},
+                       {'interval': 'day', 'start_date': '2000-01-01'}):
+            response = self.client.get(self.url, dict(self.range, **params))
+            self.assertEqual(response.status_code, 400, params)
+
+    def test_cached_and_conditional(self):
+        response = self.client.get(self.url, dict(self.range, interval='month'))
+        etag = response['ETag']
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(self.url, dict(self.range, interval='month'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(len(ctx), 1)
+        Expense.objects.create(user=self.user, date=date(2023, 2, 1), category=self.food,
+                               description='x', amount=Decimal('1.00'), payment_method='Cash')
+        data = self.get(interval='month')
+        self.assertEqual(data['series'][0]['totals'][1], '1.00')
+
+    def test_undated_range_is_not_modified_only_until_midnight(self):
+        today = timezone.localdate()
+        with mock.patch('django.utils.timezone.localdate', return_value=today):
+            response = self.client.get(self.url, {'interval': 'month'})
+            etag, modified = response['ETag'], response['Last-Modified']
+            response = self.client.get(self.url, {'interval': 'month'}, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+        with mock.patch('django.utils.timezone.localdate', return_value=today + timedelta(days=1)):
+            response = self.client.get(self.url, {'interval': 'month'}, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            response = self.client.get(self.url, {'interval': 'month'}, HTTP_IF_MODIFIED_SINCE=modified)
+            self.assertEqual(response.status_code, 200)
+
+
+class ExpenseSearchTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_superuser(username='testuser', password='testpass')
+        self.other = User.objects.create_user(username='other', password='testpass')
+        self.client.login(username='testuser', password='testpass')
+        self.food = Category.objects.create(name='Food')
+        descriptions = [
+            'Taxi to the airport', 'Airport parking', 'Lunch with the team',
+            'Airport lounge airport coffee', 'Café au lait',
+        ]
+        self.expenses = Expense.objects.bulk_create(
+            Expense(user=self.user, date=date(2023, 1, i + 1), category=self.food,
+                    description=text, amount=Decimal('1.00'), payment_method='Cash')
+            for i, text in enumerate(descriptions)
+        )
+        self.theirs = Expense.objects.create(
+            user=self.other, date=date(2023, 1, 1), category=self.food,
+            description='Airport shuttle', amount=Decimal('9.00'), payment_method='Cash',
+        )
+
+    def descriptions(self, queryset):
+        return [e.description for e in queryset]
+
+    def test_prefix_matching_and_ranking(self):
+        results = search(Expense.objects.for_user(self.user), 'AIRP', user=self.user)
+        self.assertEqual(self.descriptions(results)[0], 'Airport lounge airport coffee')
+        self.assertEqual(len(results), 3)
+        self.assertEqual(self.descriptions(search(Expense.objects.all(), 'airport park')), ['Airport parking'])
+        self.assertEqual(self.descriptions(search(Expense.objects.all(), 'cafe')), ['Café au lait'])
+        self.assertFalse(search(Expense.objects.all(), '"*) OR').exists())
+
+    def test_index_follows_writes(self):
+        lunch = self.expenses[2]
+        lunch.description = 'Dinner with the team'
+        lunch.save()
+        self.assertEqual(self.descriptions(search(Expense.objects.all(), 'dinner')), ['Dinner with the team'])
+        self.assertFalse(search(Expense.objects.all(), 'lunch').exists())
+        Expense.objects.filter(description__startswith='Airport').delete()
+        self.assertEqual(self.descriptions(search(Expense.objects.all(), 'airport')), ['Taxi to the airport'])
+
+    def test_list_view_search_is_scoped_and_paged(self):
+        response = self.client.get(reverse('expense_list'), {'q': 'airport', 'page_size': 2})
+        self.assertEqual(len(response.context['expenses']), 2)
+        self.assertEqual(response.context['total'], Decimal('3.00'))
+        response = self.client.get(reverse('expense_list') + response.context['next_url'])
+        self.assertEqual(self.descriptions(response.context['expenses']), ['Taxi to the airport'])
+        self.assertIsNone(response.context['next_url'])
+
+    def test_api_and_admin_search(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.get(reverse('api_expense_list'), {'q': 'airport', 'page_size': 2})
+        self.assertEqual(len(response.data['results']), 2)
+        response = client.get(response.data['next'])
+        self.assertEqual([row['description'] for row in response.data['results']], ['Taxi to the airport'])
+        response = self.client.get(reverse('admin:expenses_expense_changelist'), {'q': 'airport'})
+        self.assertEqual(response.context['cl'].result_count, 4)
+
+    @skipUnless(connection.vendor == 'sqlite', 'SQLite FTS5 triggers')
+    def test_repair_restores_dropped_triggers(self):
+        with connection.cursor() as cursor:
+            cursor.execute('DROP TRIGGER expenses_expense_fts_ai')
+        Expense.objects.create(user=self.user, date=date(2023, 2, 1), category=self.food,
+                               description='Ferry ticket', amount=Decimal('3.00'), payment_method='Card')
+        repair_search()
+        self.assertEqual(self.descriptions(search(Expense.objects.all(), 'ferry')), ['Ferry ticket'])
+
+
+class AsyncExpenseAPITest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='api@example.com', password='testpass')
+        self.other = User.objects.create_user(username='other@example.com', password='testpass')
+        self.token = Token.objects.create(user=self.user)
+        self.auth = {'HTTP_AUTHORIZATION': f'Token {self.token.key}'}
+        self.headers = {'Authorization': f'Token {self.token.key}'}
+        self.food = Category.objects.create(name='Food')
+        self.travel = Category.objects.create(name='Travel')
+        Expense.objects.bulk_create(
+            Expense(user=user, date=date(2023, 1, i % 28 + 1), category=category,
+                    description=f'Expense {i}', amount=Decimal('2.50'), payment_method='Card')
+            for i, (user, category) in enumerate(
+                [(self.user, self.food)] * 5 + [(self.user, self.travel)] * 2 + [(self.other, self.food)] * 3
+            )
+        )
+
+    async def test_list_with_token(self):
+        client = AsyncClient()
+        response = await client.get(reverse('api_async_expense_list'), {'page_size': 4}, headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(len(data['results']), 4)
+        response = await client.get(data['next'], headers=self.headers)
+        self.assertEqual(len(response.json()['results']), 3)
+        self.assertIsNone(response.json()['next'])
+
+    async def test_authentication(self):
+        client = AsyncClient()
+        url = reverse('api_async_expense_list')
+        self.assertEqual((await client.get(url)).status_code, 401)
+        self.assertEqual((await client.get(url, headers={'Authorization': 'Token nope'})).status_code, 401)
+        self.assertEqual((await client.post(url, headers=self.headers)).status_code, 405)
+
+    def test_session_auth_and_inactive_users(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('api_async_expense_list'))
+        self.assertEqual(len(response.json()['results']), 7)
+        self.user.is_active = False
+        self.user.save()
+        response = self.client.get(reverse('api_async_expense_list'), **self.auth)
+        self.assertEqual(response.status_code, 401)
+
+    async def test_summary_and_conditional_get(self):
+        client = AsyncClient()
+        response = await client.get(reverse('api_async_summary'), headers=self.headers)
+        data = response.json()
+        self.assertEqual(data['overall'], '17.50')
+        self.assertEqual([row['category'] for row in data['summary']], ['Food', 'Travel'])
+        response = await client.get(
+            reverse('api_async_summary'), headers=dict(self.headers, If_None_Match=response['ETag'])
+        )
+        self.assertEqual(response.status_code, 304)
+
+    async def test_undated_range_is_not_modified_only_until_midnight(self):
+        client = AsyncClient()
+        today = timezone.localdate()
+        for name in ('api_async_summary', 'api_async_aggregate'):
+            url = reverse(name)
+            with mock.patch('django.utils.timezone.localdate', return_value=today):
+                modified = (await client.get(url, headers=self.headers))['Last-Modified']
+                response = await client.get(url, headers=dict(self.headers, If_Modified_Since=modified))
+                self.assertEqual(response.status_code, 304, name)
+            with mock.patch('django.utils.timezone.localdate', return_value=today + timedelta(days=1)):
+                response = await client.get(url, headers=dict(self.headers, If_Modified_Since=modified))
+                self.assertEqual(response.status_code, 200, name)
+
+    def test_aggregate_matches_sync_api(self):
+        params = {'interval': 'month', 'group_by': 'category',
+                  'start_date': '2023-01-01', 'end_date': '2023-03-31'}
+        api = APIClient()
+        api.force_authenticate(self.user)
+        expected = api.get(reverse('api_expense_aggregate'), params).json()
+        response = self.client.get(reverse('api_async_aggregate'), params, **self.auth)
+        self.assertEqual(response.json(), expected)
+
+    def test_export_matches_sync_export(self):
+        self.client.force_login(self.user)
+        expected = b''.join(self.client.get(reverse('expense_export')).streaming_content)
+        response = self.client.get(reverse('api_async_export'), **self.auth)
+
+        async def collect():
+            return b''.join([chunk async for chunk in response.streaming_content])
+
+        content = async_to_sync(collect)()
+        self.assertEqual(content, expected)
+        self.assertEqual(len(content.splitlines()), 8)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'SQLite backend options')
+class SQLiteBackendTest(TestCase):
+    def open(self, path, **options):
+        settings_dict = dict(connection.settings_dict, NAME=path, OPTIONS=options)
+        wrapper = type(connections['default'])(settings_dict, alias='sqlite_backend_test')
+        self.addCleanup(wrapper.close)
+        return wrapper
+
+    def pragma(self, wrapper, name):
+        with wrapper.cursor() as cursor:
+            cursor.execute(f'PRAGMA {name}')
+            return cursor.fetchone()[0]
+
+    def test_pragmas_applied_to_new_connections(self):
+        path = os.path.join(tempfile.mkdtemp(), 'pragmas.sqlite3')
+        wrapper = self.open(path, pragmas={
+            'journal_mode': 'wal', 'synchronous': 'normal', 'busy_timeout': 1234,
+            'cache_size': -2048, 'mmap_size': None,
+        })
+        self.assertEqual(self.pragma(wrapper, 'journal_mode'), 'wal')
+        self.assertEqual(self.pragma(wrapper, 'synchronous'), 1)
+        self.assertEqual(self.pragma(wrapper, 'busy_timeout'), 1234)
+        self.assertEqual(self.pragma(wrapper, 'cache_size'), -2048)
+
+    def test_invalid_pragma_rejected(self):
+        wrapper = self.open(':memory:', pragmas={'journal_mode': 'wal; DROP TABLE x'})
+        with self.assertRaises(ImproperlyConfigured):
+            wrapper.ensure_connection()
+
+    def test_immediate_transactions_take_the_write_lock(self):
+        path = os.path.join(tempfile.mkdtemp(), 'locks.sqlite3')
+        first = self.open(path, transaction_mode='immediate', pragmas={'journal_mode': 'wal'})
+        second = self.open(path, pragmas={'busy_timeout': 0})
+        with first.cursor() as cursor:
+            cursor.execute('CREATE TABLE t (x integer)')
+        # What atomic() runs on entry, before any statement of the block.
+        first._start_transaction_under_autocommit()
+        try:
+            with self.assertRaises(OperationalError):
+                with second.cursor() as cursor:
+                    cursor.execute('INSERT INTO t VALUES (1)')
+        finally:
+            first.connection.rollback()
+
+
+@override_settings(EXPENSES_REPLICA_DATABASES=['replica'], EXPENSES_REPLICA_STICKY_SECONDS=10)
+class ReplicaRoutingTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='reader', password='testpass')
+        self.category = Category.objects.create(name='Food')
+
+    def get(self, method='get'):
+        request = getattr(RequestFactory(), method)('/')
+        request.user = self.user
+        return request
+
+    def test_router_only_sends_hot_path_reads_to_the_replica(self):
+        self.assertEqual(Expense.objects.all().db, 'default')
+        with routers.reads_from('replica'):
+            self.assertEqual(Expense.objects.all().db, 'replica')
+            self.assertEqual(ExpenseRollup.objects.all().db, 'replica')
+            self.assertEqual(Category.objects.all().db, 'default')
+            self.assertEqual(DataGeneration.objects.all().db, 'default')
+            self.assertEqual(Expense.objects.db_manager().select_for_update().db, 'default')
+        self.assertEqual(Expense.objects.all().db, 'default')
+
+    def test_recent_writer_sticks_to_primary(self):
+        self.assertEqual(routers.read_database(self.get()), 'replica')
+        self.assertIsNone(routers.read_database(self.get('post')))
+        Expense.objects.create(user=self.user, date=date(2023, 1, 1), category=self.category,
+                               description='Lunch', amount=Decimal('5.00'), payment_method='Cash')
+        self.assertIsNone(routers.read_database(self.get()))
+        DataGeneration.objects.filter(user=self.user).update(
+            updated_at=timezone.now() - timedelta(seconds=11))
+        self.assertEqual(routers.read_database(self.get()), 'replica')
+
+    def test_pin_keeps_the_routed_database(self):
+        with routers.reads_from('replica'):
+            expenses = routers.pin(Expense.objects.all())
+        self.assertEqual(expenses.db, 'replica')
+
+    @override_settings(EXPENSES_REPLICA_DATABASES=['default'])
+    def test_hot_path_views_route_reads(self):
+        # "default" stands in for a replica alias so the queries can run.
+        self.client.force_login(self.user)
+        token = Token.objects.create(user=self.user)
+        urls = [reverse('expense_list'), reverse('expense_summary'), reverse('expense_export'),
+                reverse('api_expense_list'), reverse('api_expense_aggregate')]
+        with mock.patch('expenses.routers.reads_from', wraps=routers.reads_from) as reads_from:
+            for url in urls:
+                response = self.client.get(url, HTTP_AUTHORIZATION=f'Token {token.key}')
+                self.assertEqual(response.status_code, 200, url)
+            self.assertEqual([c.args for c in reads_from.call_args_list], [('default',)] * len(urls))
+
+            reads_from.reset_mock()
+            self.client.post(reverse('expense_add'), {
+                'date': '2023-01-01', 'category': self.category.pk, 'description': 'Lunch',
+                'amount': '5.00', 'payment_method': 'Cash'})
+            self.client.get(reverse('expense_summary'))
+            self.assertEqual([c.args for c in reads_from.call_args_list], [(None,)])
+        with mock.patch('expenses.async_views.reads_from', wraps=routers.reads_from) as reads_from:
+            self.client.get(reverse('api_async_summary'), HTTP_AUTHORIZATION=f'Token {token.key}')
+            self.assertEqual([c.args for c in reads_from.call_args_list], [(None,)])
+
+
+class TokenCacheTest(TestCase):
+    def setUp(self):
+        token_cache.clear()
+        self.addCleanup(token_cache.clear)
+        self.user = User.objects.create_user(username='api@example.com', password='testpass')
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def token_queries(self, url=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url or reverse('api_expense_list'))
+        return response, [q['sql'] for q in queries if 'authtoken_token' in q['sql']]
+
+    def test_cached_token_skips_the_auth_query(self):
+        response, queries = self.token_queries()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(queries), 1)
+        response, queries = self.token_queries()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(queries, [])
+
+    @override_settings(EXPENSES_TOKEN_CACHE=None)
+    def test_local_cache_skips_the_auth_query(self):
+        self.token_queries()
+        response, queries = self.token_queries()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(queries, [])
+        self.assertEqual(token_cache.stats()['size'], 1)
+
+    def test_async_views_share_the_cache(self):
+        self.token_queries()
+        response, queries = self.token_queries(reverse('api_async_summary'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(queries, [])
+
+    def test_deleted_token_is_rejected(self):
+        self.token_queries()
+        self.token.delete()
+        self.assertEqual(self.token_queries()[0].status_code, 401)
+
+    def test_deactivated_user_is_rejected(self):
+        self.token_queries()
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.token_queries()[0].status_code, 401)
+        self.assertEqual(self.token_queries(reverse('api_async_summary'))[0].status_code, 401)
+
+    @override_settings(EXPENSES_TOKEN_CACHE=None, EXPENSES_TOKEN_CACHE_SIZE=2)
+    def test_least_recently_used_entries_are_evicted(self):
+        users = [User.objects.create_user(username=f'user{i}') for i in range(3)]
+        for user in users:
+            token_cache.set(f'key{user.pk}', user)
+        self.assertEqual(token_cache.stats()['size'], 2)
+        self.assertIsNone(token_cache.get(f'key{users[0].pk}'))
+        self.assertEqual(token_cache.get(f'key{users[2].pk}'), users[2])
+
+    @override_settings(EXPENSES_TOKEN_CACHE_TIMEOUT=0)
+    def test_entries_expire(self):
+        token_cache.set(self.token.key, self.user)
+        self.assertIsNone(token_cache.get(self.token.key))
+
+    def test_revocation_reaches_every_process(self):
+        self.token_queries()
+        other_process = TokenCache()
+        self.assertEqual(other_process.get(self.token.key), self.user)
+        self.user.is_active = False
+        self.user.save()
+        self.assertIsNone(other_process.get(self.token.key))
+
+    def test_token_deleted_in_another_process_is_rejected(self):
+        other_process = TokenCache()
+        other_process.set(self.token.key, self.user)
+        self.assertEqual(self.token_queries()[1], [])
+        Token.objects.filter(pk=self.token.pk).delete()
+        self.assertEqual(self.token_queries()[0].status_code, 401)
+        self.assertIsNone(other_process.get(self.token.key))
+
+    def test_login_reuses_the_cached_token(self):
+        client = APIClient()
+        with CaptureQueriesContext(connection) as queries:
+            response = client.post(reverse('api_signup'), {'email': 'new@example.com', 'password': 'pw'})
+        key = response.data['token']
+        self.assertEqual(len([q for q in queries if 'authtoken_token' in q['sql']]), 1)
+        self.assertTrue(Token.objects.filter(key=key, user__username='new@example.com').exists())
+        with CaptureQueriesContext(connection) as queries:
+            response = client.post(reverse('api_login'), {'email': 'new@example.com', 'password': 'pw'})
+        self.assertEqual(response.data['token'], key)
+        self.assertEqual([q for q in queries if 'authtoken_token' in q['sql']], [])
+        client.credentials(HTTP_AUTHORIZATION=f'Token {key}')
+        self.assertEqual(client.get(reverse('api_expense_list')).status_code, 200)
+
+
+class MetricsTest(TestCase):
+    def setUp(self):
+        metrics.registry.reset()
+        self.addCleanup(metrics.registry.reset)
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.client.login(username='testuser', password='testpass')
+
+    def sample(self, text, line_start):
+        for line in text.splitlines():
+            if line.startswith(line_start):
+                return float(line.rsplit(' ', 1)[1])
+        self.fail(f'{line_start} not in metrics')
+
+    def scrape(self):
+        staff = User.objects.create_user(username='ops', password='testpass', is_staff=True)
+        client = self.client_class()
+        client.force_login(staff)
+        response = client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        return response.content.decode()
+
+    def test_records_queries_templates_latency_and_size(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('expense_list'))
+        self.assertEqual(response.status_code, 200)
+        query_count = len(queries)
+        text = self.scrape()
+        view = 'view="expense_list"'
+        self.assertEqual(self.sample(text, f'expenses_requests_total{{{view},method="GET",status="200"}}'), 1)
+        self.assertEqual(self.sample(text, f'expenses_request_seconds_bucket{{{view},method="GET",le="+Inf"}}'), 1)
+        self.assertEqual(self.sample(text, f'expenses_sql_queries_total{{{view}}}'), query_count)
+        self.assertGreater(self.sample(text, f'expenses_template_seconds_total{{{view}}}'), 0)
+        self.assertEqual(self.sample(text, f'expenses_response_bytes_total{{{view}}}'), len(response.content))
+        self.assertIn('expenses_cache_entries{cache="categories"}', text)
+
+    def test_streamed_bytes_are_counted(self):
+        response = self.client.get(reverse('expense_export'))
+        size = len(b''.join(response.streaming_content))
+        text = self.scrape()
+        self.assertEqual(self.sample(text, 'expenses_response_bytes_total{view="expense_export"}'), size)
+
+    def test_async_views_are_measured(self):
+        token = Token.objects.create(user=self.user)
+        response = async_to_sync(AsyncClient().get)(
+            reverse('api_async_summary'), headers={'Authorization': f'Token {token.key}'}
+        )
+        self.assertEqual(response.status_code, 200)
+        text = self.scrape()
+        view = 'view="api_async_summary"'
+        self.assertEqual(self.sample(text, f'expenses_requests_total{{{view},method="GET",status="200"}}'), 1)
+        self.assertGreater(self.sample(text, f'expenses_sql_queries_total{{{view}}}'), 0)
+
+    @override_settings(EXPENSES_METRICS_TOKEN='s3cret')
+    def test_metrics_require_staff_or_token(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        self.assertEqual(
+            self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer wrong').status_code, 403
+        )
+        self.client.logout()
+        response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer s3cret')
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(EXPENSES_SLOW_REQUEST_SECONDS=0, EXPENSES_SLOW_REQUEST_QUERIES=2)
+    def test_slow_requests_are_logged_with_their_queries(self):
+        with self.assertLogs('expenses.slow_requests', 'WARNING') as logs:
+            self.client.get(reverse('expense_list'))
+        message = logs.output[0]
+        self.assertIn('Slow request: GET /', message)
+        self.assertEqual(message.count('SELECT'), 2)
+
+    def test_queries_outside_requests_are_not_counted(self):
+        stats, token = metrics.start()
+        try:
+            User.objects.count()
+        finally:
+            metrics.stop(token)
+        User.objects.count()
+        self.assertEqual(stats.queries, 1)
+        self.assertEqual(len(stats.slowest_queries()), 1)
+
+
+class JobQueueTest(TestCase):
+    def setUp(self):
+        files = tempfile.TemporaryDirectory()
+        self.addCleanup(files.cleanup)
+        settings_override = override_settings(EXPENSES_JOB_FILES_DIR=files.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.user = User.objects.create_user(username='api@example.com', password='testpass')
+        self.food = Category.objects.create(name='Food')
+        Expense.objects.bulk_create(
+            Expense(user=self.user, date=date(2023, 1, i % 28 + 1), category=self.food,
+                    description=f'Expense {i}', amount=Decimal('1.00'), payment_method='Cash')
+            for i in range(12)
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def run_job(self, job):
+        jobs.run_pending()
+        job.refresh_from_db()
+        return job
+
+    def test_background_bulk_delete_reports_progress(self):
+        ids = list(Expense.objects.order_by('pk').values_list('pk', flat=True)[:10])
+        with mock.patch('expenses.tasks.STEP_SIZE', 4):
+            response = self.client.delete(
+                reverse('api_expense_bulk'), {'ids': ids, 'background': True}, format='json'
+            )
+            self.assertEqual(response.status_code, 202)
+            job = Job.objects.get(pk=response.json()['job']['id'])
+            self.assertEqual(response['Location'], reverse('api_job_detail', args=[job.pk]))
+            self.assertEqual(job.status, Job.QUEUED)
+            self.assertEqual(Expense.objects.count(), 12)
+            self.run_job(job)
+        data = self.client.get(reverse('api_job_detail', args=[job.pk])).json()
+        self.assertEqual(data['status'], 'succeeded')
+        self.assertEqual((data['progress'], data['total']), (10, 10))
+        self.assertEqual(data['result'], {'deleted': 10})
+        self.assertEqual(Expense.objects.count(), 2)
+        self.assertEqual(ExpenseRollup.objects.aggregate(n=Sum('count'))['n'], 2)
+
+    def test_background_bulk_edit_by_filter(self):
+        travel = Category.objects.create(name='Travel')
+        response = self.client.post(reverse('api_expense_bulk_edit'), {
+            'filter': {'start_date': '2023-01-01', 'end_date': '2023-01-05'},
+            'values': {'category': travel.pk, 'date': '2024-02-01'},
+            'background': True,
+        }, format='json')
+        self.assertEqual(response.status_code, 202)
+        job = self.run_job(Job.objects.get())
+        self.assertEqual(job.result, {'updated': 5})
+        self.assertEqual(Expense.objects.filter(category=travel, date=date(2024, 2, 1)).count(), 5)
+
+    def test_failed_jobs_are_retried_with_backoff(self):
+        flaky = mock.Mock(side_effect=[RuntimeError('database went away'), {'ok': True}])
+        with mock.patch.dict(jobs.TASKS, {'flaky': flaky}):
+            job = jobs.enqueue('flaky', self.user)
+            job = self.run_job(job)
+            self.assertEqual((job.status, job.attempts), (Job.QUEUED, 1))
+            self.assertGreater(job.run_after, timezone.now())
+            self.assertEqual(jobs.run_pending(), 0)
+            Job.objects.filter(pk=job.pk).update(run_after=timezone.now())
+            job = self.run_job(job)
+        self.assertEqual((job.status, job.attempts, job.result), (Job.SUCCEEDED, 2, {'ok': True}))
+
+    def test_jobs_fail_after_max_attempts_or_job_failed(self):
+        def broken(job):
+            raise RuntimeError('still broken')
+
+        def refused(job):
+            raise jobs.JobFailed('Nothing to do')
+
+        with mock.patch.dict(jobs.TASKS, {'broken': broken, 'refused': refused}):
+            job = self.run_job(jobs.enqueue('broken', self.user, max_attempts=1))
+            self.assertEqual(job.status, Job.FAILED)
+            self.assertEqual(job.error_message, 'RuntimeError: still broken')
+            job = self.run_job(jobs.enqueue('refused', self.user))
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, 1))
+        self.assertEqual(self.client.get(reverse('api_job_detail', args=[job.pk])).json()['error'], 'Nothing to do')
+
+    def test_a_job_is_claimed_once_and_abandoned_jobs_are_requeued(self):
+        job = jobs.enqueue('rebuild_rollups')
+        self.assertEqual(jobs.claim('one').pk, job.pk)
+        self.assertIsNone(jobs.claim('two'))
+        self.assertEqual(jobs.requeue_stale(), 0)
+        Job.objects.filter(pk=job.pk).update(heartbeat_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(jobs.requeue_stale(), 1)
+        self.assertEqual(jobs.claim('two').pk, job.pk)
+
+    def test_export_job_and_download(self):
+        response = self.client.post(reverse('api_expense_export'), {'format': 'csv'}, format='json')
+        job = self.run_job(Job.objects.get(pk=response.json()['job']['id']))
+        self.assertEqual(job.result['rows'], 12)
+        url = self.client.get(reverse('api_job_detail', args=[job.pk])).json()['download_url']
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        rows = list(csv.reader(b''.join(response.streaming_content).decode().splitlines()))
+        self.assertEqual(len(rows), 13)
+        other = APIClient()
+        other.force_authenticate(User.objects.create_user(username='other@example.com'))
+        self.assertEqual(other.get(url).status_code, 404)
+        self.assertEqual(other.get(reverse('api_job_list')).json(), [])
+
+    @override_settings(EXPENSE_IMPORT_BACKGROUND_BYTES=10)
+    def test_large_imports_run_in_the_background(self):
+        self.client.force_authenticate(None)
+        self.assertTrue(self.client.login(username='api@example.com', password='testpass'))
+        upload = SimpleUploadedFile('in.csv', ExpenseImportTest.CSV.encode(), content_type='text/csv')
+        response = self.client.post(reverse('expense_import'), {'file': upload})
+        job = Job.objects.get(kind='import')
+        self.assertContains(response, reverse('job_detail', args=[job.pk]))
+        out = StringIO()
+        call_command('run_workers', processes=0, burst=True, stdout=out)
+        self.assertIn(f'import #{job.pk}', out.getvalue())
+        job.refresh_from_db()
+        self.assertEqual((job.result['created'], job.result['rejected']), (2, 3))
+        self.assertEqual(os.listdir(settings.EXPENSES_JOB_FILES_DIR), [])
+        response = self.client.get(reverse('job_detail', args=[job.pk]))
+        self.assertContains(response, 'Succeeded')
+
+
+class ReceiptServer(BaseHTTPRequestHandler):
+    """Stand-in for the hosts receipts link to."""
+
+    PDF = b'%PDF-1.4 receipt for lunch'
+    routes = {
+        '/a.pdf': (200, 'application/octet-stream', PDF),
+        '/copy-of-a': (200, 'application/octet-stream', PDF),
+        '/page.html': (200, 'text/html; charset=utf-8', b'<script>alert(1)</script>'),
+        '/big': (200, 'application/pdf', b'%PDF' + b'x' * 2000),
+        '/slow': (200, 'application/pdf', PDF),
+    }
+    requests = []
+    active = max_active = 0
+    lock = threading.Lock()
+
+    def do_GET(self):
+        path = self.path.split('?')[0]
+        cls = type(self)
+        with cls.lock:
+            cls.requests.append((path, self.headers.get('If-None-Match')))
+            cls.active += 1
+            cls.max_active = max(cls.max_active, cls.active)
+        try:
+            if path == '/slow':
+                time.sleep(0.2)
+            if path not in self.routes:
+                self.send_error(404)
+                return
+            status, content_type, body = self.routes[path]
+            etag = '"%s"' % hashlib.md5(body).hexdigest()
+            if self.headers.get('If-None-Match') == etag:
+                self.send_response(304)
+                self.end_headers()
+                return
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('ETag', etag)
+            self.end_headers()
+            self.wfile.write(body)
+        finally:
+            with cls.lock:
+                cls.active -= 1
+
+    def log_message(self, *args):
+        pass
+
+
+class ReceiptCheckTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), ReceiptServer)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base = 'http://127.0.0.1:%d' % cls.server.server_port
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        store = tempfile.TemporaryDirectory()
+        self.addCleanup(store.cleanup)
+        settings_override = override_settings(
+            EXPENSES_RECEIPT_DIR=store.name, EXPENSES_RECEIPT_ALLOW_PRIVATE=True, EXPENSES_RECEIPT_MAX_BYTES=1000
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        ReceiptServer.requests = []
+        ReceiptServer.max_active = 0
+        self.user = User.objects.create_user(username='auditor', password='testpass')
+        self.food = Category.objects.create(name='Food')
+
+    def expense(self, path, user=None):
+        return Expense.objects.create(
+            user=user or self.user, date=date(2023, 1, 1), category=self.food, description='Lunch',
+            amount=Decimal('9.50'), payment_method='Card', receipt_link=self.base + path,
+        )
+
+    def link(self, path):
+        return ReceiptLink.objects.select_related('receipt').get(url=self.base + path)
+
+    def test_identical_receipts_are_stored_once(self):
+        for path in ('/a.pdf', '/a.pdf', '/copy-of-a', '/missing', '/big'):
+            self.expense(path)
+        self.assertEqual(receipts.check_due(), {'ok': 2, 'broken': 2})
+        digest = hashlib.sha256(ReceiptServer.PDF).hexdigest()
+        self.assertEqual(list(Receipt.objects.values_list('pk', 'content_type', 'size')),
+                         [(digest, 'application/pdf', len(ReceiptServer.PDF))])
+        self.assertEqual(self.link('/a.pdf').receipt_id, digest)
+        self.assertEqual(self.link('/copy-of-a').receipt_id, digest)
+        self.assertEqual(receipts.receipt_path(digest).read_bytes(), ReceiptServer.PDF)
+        missing = self.link('/missing')
+        self.assertEqual((missing.status, missing.http_status, missing.failures), ('broken', 404, 1))
+        self.assertGreater(missing.next_check_at, timezone.now() + timedelta(minutes=59))
+        self.assertIn('larger than 1000 bytes', self.link('/big').error)
+        self.assertEqual(os.listdir(receipts.store_dir() / 'tmp'), [])
+        self.assertEqual(sorted(path for path, _ in ReceiptServer.requests),
+                         ['/a.pdf', '/big', '/copy-of-a', '/missing'])
+
+    def test_recheck_skips_unchanged_receipts(self):
+        self.expense('/a.pdf')
+        receipts.check_due()
+        self.assertEqual(receipts.check_due(), {'ok': 0, 'broken': 0})
+        ReceiptLink.objects.update(next_check_at=timezone.now())
+        self.assertEqual(receipts.check_due(), {'ok': 1, 'broken': 0})
+        self.assertEqual(ReceiptServer.requests[-1][1], self.link('/a.pdf').etag)
+        self.assertEqual(self.link('/a.pdf').http_status, 304)
+        self.assertEqual(Receipt.objects.count(), 1)
+
+    @override_settings(EXPENSES_RECEIPT_PER_HOST=2)
+    def test_downloads_per_host_are_limited(self):
+        for _ in range(6):
+            ReceiptLink.objects.create(url=f'{self.base}/slow?{_}', next_check_at=timezone.now())
+        receipts.check(list(ReceiptLink.objects.all()))
+        self.assertEqual(len(ReceiptServer.requests), 6)
+        self.assertEqual(ReceiptServer.max_active, 2)
+
+    @override_settings(EXPENSES_RECEIPT_ALLOW_PRIVATE=False)
+    def test_private_addresses_are_refused(self):
+        self.expense('/a.pdf')
+        self.assertEqual(receipts.check_due(), {'ok': 0, 'broken': 1})
+        self.assertIn('private address', self.link('/a.pdf').error)
+        self.assertEqual(ReceiptServer.requests, [])
+
+    def test_receipts_are_served_to_their_owners(self):
+        expense = self.expense('/a.pdf')
+        page = self.expense('/page.html')
+        receipts.check_due()
+        digest = self.link('/a.pdf').receipt_id
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('expense_edit', args=[expense.pk]))
+        self.assertContains(response, reverse('receipt_file', args=[digest]))
+        response = self.client.get(reverse('receipt_file', args=[digest]))
+        self.assertEqual(b''.join(response.streaming_content), ReceiptServer.PDF)
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertIn('immutable', response['Cache-Control'])
+        response = self.client.get(reverse('receipt_file', args=[digest]), HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        html = self.client.get(reverse('receipt_file', args=[self.link('/page.html').receipt_id]))
+        self.assertEqual(html['Content-Type'], 'application/octet-stream')
+        self.assertTrue(html['Content-Disposition'].startswith('attachment'))
+
+        api = APIClient()
+        api.force_authenticate(self.user)
+        data = api.get(reverse('api_expense_receipt', args=[expense.pk])).json()
+        self.assertEqual((data['status'], data['sha256'], data['thumbnail_url']), ('ok', digest, None))
+        self.assertEqual(api.get(data['file_url']).status_code, 200)
+        other = User.objects.create_user(username='other', password='testpass')
+        api.force_authenticate(other)
+        self.assertEqual(api.get(data['file_url']).status_code, 404)
+        self.assertEqual(api.get(reverse('api_expense_receipt', args=[page.pk])).status_code, 404)
+
+    def test_etags_are_only_matched_for_visible_receipts(self):
+        self.expense('/a.pdf')
+        receipts.check_due()
+        digest = self.link('/a.pdf').receipt_id
+        url = reverse('receipt_file', args=[digest])
+        self.client.force_login(self.user)
+        etag = self.client.get(url)['ETag']
+        self.client.force_login(User.objects.create_user(username='other', password='testpass'))
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 404)
+        api = APIClient()
+        api.force_authenticate(self.user)
+        response = api.get(reverse('api_receipt_file', args=[digest]), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual((response.status_code, response['ETag']), (304, etag))
+
+    @override_settings(EXPENSES_RECEIPT_ALLOW_PRIVATE=False)
+    def test_downloads_connect_to_the_checked_address(self):
+        # A host that rebinds to loopback after its first, public, answer.
+        answers = ['203.0.114.7', '127.0.0.1']
+        getaddrinfo = socket.getaddrinfo
+
+        def resolver(host, *args, **kwargs):
+            if host == 'receipts.test':
+                host = answers.pop(0) if len(answers) > 1 else answers[0]
+            return getaddrinfo(host, *args, **kwargs)
+
+        def refuse(address, *args, **kwargs):
+            connected.append(address[0])
+            raise ConnectionRefusedError
+
+        connected = []
+        expense = self.expense('/a.pdf')
+        expense.receipt_link = expense.receipt_link.replace('127.0.0.1', 'receipts.test')
+        expense.save()
+        with mock.patch('socket.getaddrinfo', resolver), mock.patch('socket.create_connection', refuse):
+            self.assertEqual(receipts.check_due(), {'ok': 0, 'broken': 1})
+        self.assertEqual(connected, ['203.0.114.7'])
+
+    def test_unused_receipts_are_removed(self):
+        expense = self.expense('/a.pdf')
+        receipts.check_due()
+        path = receipts.receipt_path(self.link('/a.pdf').receipt_id)
+        expense.delete()
+        receipts.sync_links()
+        self.assertFalse(ReceiptLink.objects.exists())
+        self.assertFalse(Receipt.objects.exists())
+        self.assertFalse(path.exists())
+
+    @skipUnless(receipts.Image, 'Pillow is not installed')
+    def test_image_receipts_get_thumbnails(self):
+        image = io.BytesIO()
+        receipts.Image.new('RGB', (1200, 800), 'white').save(image, 'PNG')
+        ReceiptServer.routes['/photo.png'] = (200, 'image/png', image.getvalue())
+        self.addCleanup(ReceiptServer.routes.pop, '/photo.png')
+        self.expense('/photo.png')
+        with override_settings(EXPENSES_RECEIPT_MAX_BYTES=10 ** 6):
+            receipts.check_due()
+        receipt = self.link('/photo.png').receipt
+        self.assertTrue(receipt.has_thumbnail)
+        with receipts.Image.open(receipts.receipt_path(receipt.pk, thumbnail=True)) as thumbnail:
+            self.assertEqual(thumbnail.size, (320, 213))
+
+    def test_checks_are_scheduled_as_jobs(self):
+        self.expense('/a.pdf')
+        job = receipts.schedule()
+        self.assertIsNone(receipts.schedule())
+        jobs.run_pending()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.result), ('succeeded', {'ok': 1, 'broken': 0}))
+        self.assertEqual(job.progress, 1)
+
+
+class StaticFilesTest(TestCase):
+    CSS = 'body { color: #333; }\n' * 40
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.source = os.path.join(tmp.name, 'static')
+        self.dist = os.path.join(tmp.name, 'dist')
+        self.root = os.path.join(tmp.name, 'collected')
+        os.makedirs(os.path.join(self.source, 'css'))
+        os.makedirs(os.path.join(self.dist, 'assets'))
+        with open(os.path.join(self.source, 'css', 'site.css'), 'w') as f:
+            f.write(self.CSS)
+        with open(os.path.join(self.dist, 'assets', 'index-4f2a.js'), 'w') as f:
+            f.write('console.log("app");\n' * 40)
+        with open(os.path.join(self.dist, 'index.html'), 'w') as f:
+            f.write('<div id="root"></div><script type="module" src="/static/frontend/assets/index-4f2a.js"></script>')
+        settings_override = override_settings(
+            STATIC_ROOT=self.root,
+            STATICFILES_DIRS=[self.source, ('frontend', self.dist)],
+            FRONTEND_DIST_DIR=self.dist,
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        call_command('collectstatic', interactive=False, verbosity=0)
+
+    def get(self, path, **headers):
+        from django.http import HttpResponseNotFound
+        from expensecrm.staticfiles import StaticFilesMiddleware
+
+        middleware = StaticFilesMiddleware(lambda request: HttpResponseNotFound())
+        return middleware(RequestFactory().get(path, **headers))
+
+    def test_collected_files_are_fingerprinted_and_compressed(self):
+        from django.templatetags.static import static
+
+        url = static('css/site.css')
+        self.assertRegex(url, r'^/static/css/site\.[0-9a-f]{12}\.css$')
+        self.assertTrue(os.path.exists(os.path.join(self.root, url[len('/static/'):] + '.gz')))
+        response = self.get(url, HTTP_ACCEPT_ENCODING='br;q=0, gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)).decode(), self.CSS)
+        response = self.get(url, HTTP_ACCEPT_ENCODING='gzip;q=0')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(b''.join(response.streaming_content).decode(), self.CSS)
+        self.assertEqual(self.get('/static/css/site.css')['Cache-Control'], 'public, max-age=60')
+        self.assertEqual(self.get('/static/css/missing.css').status_code, 404)
+
+    def test_frontend_page_links_the_collected_bundle(self):
+        response = self.client.get('/app/expenses')
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+        script = re.search(r'src="([^"]+)"', response.content.decode())[1]
+        self.assertRegex(script, r'^/static/frontend/assets/index-4f2a\.[0-9a-f]{12}\.js$')
+        self.assertIn('immutable', self.get(script)['Cache-Control'])
+        self.assertIn('immutable', self.get('/static/frontend/assets/index-4f2a.js')['Cache-Control'])
+        with override_settings(FRONTEND_DIST_DIR=os.path.join(self.dist, 'missing')):
+            self.assertEqual(self.client.get('/app/').status_code, 404)
+
+
+class ApiProfileTest(TestCase):
+    def setUp(self):
+        from expensecrm import settings_api
+
+        settings_override = override_settings(
+            ROOT_URLCONF=settings_api.ROOT_URLCONF,
+            MIDDLEWARE=settings_api.MIDDLEWARE,
+            REST_FRAMEWORK=settings_api.REST_FRAMEWORK,
+            EXPENSES_METRICS_TOKEN='metrics-secret',
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.user = User.objects.create_user(username='api@example.com', password='testpass')
+        Expense.objects.create(
+            user=self.user, date=date(2023, 1, 1), category=Category.objects.create(name='Food'),
+            description='Lunch', amount=Decimal('9.50'), payment_method='Card',
+        )
+        self.token = Token.objects.create(user=self.user).key
+
+    def test_api_works_without_sessions(self):
+        auth = {'HTTP_AUTHORIZATION': f'Token {self.token}'}
+        response = self.client.get('/api/expenses/', **auth)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual([row['description'] for row in response.json()['results']], ['Lunch'])
+        self.assertEqual(self.client.get('/').status_code, 404)
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer metrics-secret').status_code, 200)
+
+    def test_system_checks_pass(self):
+        # A fresh process: tag libraries imported by earlier tests would hide
+        # one that needs an app this profile leaves out.
+        with tempfile.TemporaryDirectory() as tmp:
+            env = dict(
+                os.environ, DJANGO_SETTINGS_MODULE='expensecrm.settings_api',
+                EXPENSECRM_DB_NAME=os.path.join(tmp, 'db.sqlite3'),
+            )
+            result = subprocess.run(
+                [sys.executable, 'manage.py', 'check'], cwd=settings.BASE_DIR,
+                env=env, capture_output=True, text=True,
+            )
+        self.assertEqual(result.returncode, 0, result.stderr)
+
+    async def test_async_api_works_without_sessions(self):
+        client = AsyncClient()
+        response = await client.get('/api/async/expenses/', headers={'Authorization': f'Token {self.token}'})
+        self.assertEqual(len(response.json()['results']), 1)
+        self.assertEqual((await client.get('/api/async/expenses/')).status_code, 401)
+
+
+@override_settings(EXPENSE_ADMIN_EXACT_COUNT_LIMIT=5)
+class ExpenseAdminTest(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser(username='admin', password='testpass')
+        self.client.force_login(self.admin)
+        self.food = Category.objects.create(name='Food')
+        self.travel = Category.objects.create(name='Travel')
+        self.days = [date(2022, 12, 31), date(2023, 1, 5), date(2023, 1, 20), date(2023, 3, 1), date(2024, 2, 29)]
+        for index, day in enumerate(self.days * 2):
+            Expense.objects.create(
+                user=self.admin, date=day, category=self.food if index % 2 else self.travel,
+                description='Lunch' if index < 5 else 'Taxi', amount=Decimal('2.50'), payment_method='Card',
+            )
+        self.url = reverse('admin:expenses_expense_changelist')
+
+    def rollup_totals(self):
+        return dict(ExpenseRollup.objects.values_list('category__name').annotate(n=Sum('count')).filter(n__gt=0))
+
+    def test_changelist_estimates_count_and_joins_categories(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        self.assertEqual(response.context['cl'].result_count, 10)
+        self.assertContains(response, 'About 10 expenses')
+        self.assertFalse([q['sql'] for q in queries.captured_queries if 'COUNT(' in q['sql'].upper()])
+        self.assertQueryBudget(len(queries), self.client.get, self.url, {'payment_method__exact': 'Card'})
+        response = self.client.get(self.url, {'category__id__exact': self.food.pk})
+        self.assertEqual(response.context['cl'].result_count, 5)
+        self.assertNotContains(response, 'About')
+
+    def test_date_hierarchy_seeks_each_period(self):
+        from .admin import distinct_dates
+
+        expenses = Expense.objects.all()
+        for kind in ('year', 'month', 'day'):
+            self.assertEqual(distinct_dates(expenses, 'date', kind), list(expenses.dates('date', kind)))
+        self.assertEqual(distinct_dates(expenses.none(), 'date', 'year'), [])
+        response = self.client.get(self.url)
+        self.assertEqual([choice['title'] for choice in response.context['choices']], ['2022', '2023', '2024'])
+        response = self.client.get(self.url, {'date__year': 2023})
+        self.assertEqual(len(response.context['choices']), 2)
+        self.assertEqual(response.context['cl'].result_count, 6)
+        response = self.client.get(self.url, {'date__year': 2023, 'date__month': 1})
+        self.assertEqual(len(response.context['choices']), 2)
+
+    def test_recategorize_matching_search_in_one_statement(self):
+        selected = Expense.objects.filter(description='Lunch').first()
+        action = {'action': 'recategorize', 'select_across': '1', '_selected_action': [selected.pk]}
+        response = self.client.post(f'{self.url}?q=lunch', {**action, 'index': '0'})
+        self.assertContains(response, 'every expense matching the current filters')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(f'{self.url}?q=lunch', {**action, 'post': 'yes', 'category': self.food.pk})
+        self.assertEqual(response.status_code, 302)
+        updates = [q['sql'] for q in queries.captured_queries if q['sql'].startswith('UPDATE "expenses_expense"')]
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(Expense.objects.filter(description='Lunch', category=self.food).count(), 5)
+        self.assertEqual(Expense.objects.filter(description='Taxi', category=self.food).count(), 3)
+        self.assertEqual(self.rollup_totals(), {'Food': 8, 'Travel': 2})
+
+    def test_export_and_delete_selected(self):
+        selected = list(Expense.objects.filter(date__year=2023).values_list('pk', flat=True))
+        response = self.client.post(self.url, {'action': 'export_csv', 'index': '0', '_selected_action': selected})
+        rows = list(csv.reader(io.StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual(sorted(int(row[0]) for row in rows[1:]), sorted(selected))
+        action = {'action': 'delete_selected', '_selected_action': selected}
+        response = self.client.post(self.url, {**action, 'index': '0'})
+        self.assertContains(response, 'the 6 selected expenses')
+        self.client.post(self.url, {**action, 'post': 'yes'})
+        self.assertEqual(Expense.objects.count(), 4)
+        self.assertEqual(sum(self.rollup_totals().values()), 4)
+
+    def test_category_autocomplete(self):
+        response = self.client.get(reverse('admin:autocomplete'), {
+            'app_label': 'expenses', 'model_name': 'expense', 'field_name': 'category', 'term': 'tra',
+        })
+        self.assertEqual([result['text'] for result in response.json()['results']], ['Travel'])
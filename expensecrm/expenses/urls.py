@@ -1,17 +1,24 @@
-from django.urls import path
+from django.urls import include, path
 from django.contrib.auth import views as auth_views
 from . import views
-from . import api
 from .forms import LoginForm
 
 urlpatterns = [
     path('', views.expense_list, name='expense_list'),
     path('add/', views.expense_create, name='expense_add'),
+    path('import/', views.expense_import, name='expense_import'),
     path('categories/add/', views.category_create, name='category_add'),
     path('<int:pk>/edit/', views.expense_update, name='expense_edit'),
     path('<int:pk>/delete/', views.expense_delete, name='expense_delete'),
     path('bulk-delete/', views.expense_bulk_delete, name='expense_bulk_delete'),
+    path('bulk-edit/', views.expense_bulk_edit, name='expense_bulk_edit'),
+    path('jobs/<int:pk>/', views.job_detail, name='job_detail'),
+    path('receipts/<str:sha256>/', views.receipt_file, name='receipt_file'),
+    path('receipts/<str:sha256>/thumbnail/', views.receipt_file, {'thumbnail': True}, name='receipt_thumbnail'),
     path('summary/', views.expense_summary, name='expense_summary'),
+    path('app/', views.frontend, name='frontend'),
+    path('app/<path:route>', views.frontend),
+    path('export/', views.expense_export, name='expense_export'),
     path('register/', views.register, name='register'),
     path('login/', auth_views.LoginView.as_view(
         template_name='registration/login.html',
@@ -19,6 +26,5 @@ urlpatterns = [
     ), name='login'),
     path('logout/', auth_views.LogoutView.as_view(), name='logout'),
 
-    path('api/signup/', api.SignupAPIView.as_view(), name='api_signup'),
-    path('api/login/', api.LoginAPIView.as_view(), name='api_login'),
+    path('', include('expenses.api_urls')),
 ]
@@ -1,9 +1,37 @@
+import io
+import re
+import secrets
+import uuid
+from pathlib import Path
+
+from django.core.exceptions import ValidationError
+from django.conf import settings
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, StreamingHttpResponse
 from django.shortcuts import render, get_object_or_404, redirect
+from django.urls import reverse
 from django.db.models import Sum
 from django.contrib.auth.decorators import login_required
-from .models import Expense, Category
+from django.views.decorators.http import condition
+from django.template.loader import render_to_string
+from django.templatetags.static import static
+from django.utils.safestring import mark_safe
+from . import bulk, generations, jobs, metrics as request_metrics, receipts
+from .cache import CategoryGone, category_cache, category_writes
+from .models import Expense, ExpenseRollup, Job
 from django.contrib.auth import login
-from .forms import ExpenseForm, CategoryForm, RegisterForm
+from .fragments import fragment_chunks, render_fragments
+from .forms import ExpenseBulkEditForm, ExpenseForm, ExpenseImportForm, CategoryForm, RegisterForm
+from .export import FORMATS, export_chunks
+from .filters import filter_expenses, parse_expense_filters
+from .importer import ExpenseImporter, ImportFormatError
+from .pagination import InvalidCursor, get_page_size, keyset_page, ranked_page
+from .rollups import category_totals, from_cents
+from .routers import pin, replica_reads
+from .rows import expense_rows
+from .search import search
+
+ROWS_MARKER = mark_safe("<!--expense-rows-->")
+CARDS_MARKER = mark_safe("<!--expense-cards-->")
 
 
 def register(request):
@@ -19,47 +47,142 @@ def register(request):
 
 
 @login_required
+@replica_reads
 def expense_list(request):
-    expenses = Expense.objects.select_related("category").all().order_by("-date")
+    expenses = Expense.objects.for_user(request.user)
     category = request.GET.get("category")
     if category:
         expenses = expenses.filter(category_id=category)
-    total = expenses.aggregate(total=Sum("amount"))["total"] or 0
-    categories = Category.objects.all()
-    return render(
+    query = request.GET.get("q", "").strip()
+    paginate = keyset_page
+    if query:
+        expenses = search(expenses, query, user=request.user)
+        paginate = ranked_page
+    total = generations.cached(
         request,
+        "list_total",
+        {"category": category or "", "q": query},
+        lambda: expenses.aggregate(total=Sum("amount"))["total"] or 0,
+    )
+    try:
+        page = paginate(expense_rows(expenses), request.GET.get("cursor"), get_page_size(request))
+    except InvalidCursor:
+        page = paginate(expense_rows(expenses), None, get_page_size(request))
+    params = request.GET.copy()
+    first_url = None
+    if params.pop("cursor", None):
+        first_url = f"?{params.urlencode()}"
+    next_url = None
+    if page.has_next:
+        params["cursor"] = page.next_cursor
+        next_url = f"?{params.urlencode()}"
+    categories = category_cache.categories()
+    context = {
+        "expenses": page.object_list,
+        "total": total,
+        "categories": categories,
+        "query": query,
+        "first_url": first_url,
+        "next_url": next_url,
+        "bulk_edit_form": ExpenseBulkEditForm(),
+    }
+    version, _ = generations.current(request)
+    if settings.EXPENSE_LIST_STREAMING:
+        return StreamingHttpResponse(stream_expense_list(request, context, version))
+    context["expense_rows"], context["expense_cards"] = render_fragments(page.object_list, version)
+    return render(request, "expenses/expense_list.html", context)
+
+
+def stream_expense_list(request, context, version):
+    """Render the page around the rows up front, then send rows as they render."""
+    html = render_to_string(
         "expenses/expense_list.html",
-        {"expenses": expenses, "total": total, "categories": categories},
+        dict(context, expense_rows=ROWS_MARKER, expense_cards=CARDS_MARKER),
+        request,
     )
+    head, rest = html.split(ROWS_MARKER, 1)
+    middle, tail = rest.split(CARDS_MARKER, 1)
+
+    def chunks():
+        yield head
+        cards = []
+        for fragments in fragment_chunks(context["expenses"], version):
+            yield "".join(row for row, _ in fragments)
+            cards.extend(card for _, card in fragments)
+        yield middle
+        yield "".join(cards)
+        yield tail
+
+    return chunks()
+
+
+def save_expense(request, form):
+    """Save a valid ``ExpenseForm`` for the user; False if its category has gone."""
+    expense = form.save(commit=False)
+    expense.user = request.user
+    try:
+        with category_writes():
+            expense.save()
+    except CategoryGone as exc:
+        form.add_error('category', str(exc))
+        return False
+    return True
 
 
 @login_required
 def expense_create(request):
     if request.method == 'POST':
         form = ExpenseForm(request.POST)
-        if form.is_valid():
-            expense = form.save(commit=False)
-            expense.user = request.user
-            expense.save()
+        if form.is_valid() and save_expense(request, form):
             return redirect('expense_list')
     else:
-        form = ExpenseForm()
+        # category_create sends the new category along; looking it up also
+        # refreshes a category cache that predates it.
+        category = request.GET.get('category', '')
+        category = category_cache.get(int(category)) if category.isdigit() else None
+        form = ExpenseForm(initial={'category': category})
     return render(request, 'expenses/expense_form.html', {'form': form})
 
 
 @login_required
 def expense_update(request, pk):
-    expense = get_object_or_404(Expense, pk=pk)
+    expense = get_object_or_404(Expense.objects.for_user(request.user), pk=pk)
     if request.method == 'POST':
         form = ExpenseForm(request.POST, instance=expense)
-        if form.is_valid():
-            expense = form.save(commit=False)
-            expense.user = request.user
-            expense.save()
+        if form.is_valid() and save_expense(request, form):
             return redirect('expense_list')
     else:
         form = ExpenseForm(instance=expense)
-    return render(request, 'expenses/expense_form.html', {'form': form})
+    receipt_link = receipts.link_for(expense.receipt_link)
+    return render(request, 'expenses/expense_form.html', {'form': form, 'receipt_link': receipt_link})
+
+
+@login_required
+def expense_import(request):
+    result = job = None
+    if request.method == "POST":
+        form = ExpenseImportForm(request.POST, request.FILES)
+        if form.is_valid():
+            upload = form.cleaned_data["file"]
+            if upload.size > settings.EXPENSE_IMPORT_BACKGROUND_BYTES:
+                job = enqueue_import(request.user, upload)
+            else:
+                lines = io.TextIOWrapper(upload.file, encoding="utf-8-sig", newline="")
+                try:
+                    result = ExpenseImporter(user=request.user).run(lines)
+                except (ImportFormatError, UnicodeDecodeError) as exc:
+                    form.add_error("file", str(exc))
+    else:
+        form = ExpenseImportForm()
+    return render(request, "expenses/expense_import.html", {"form": form, "result": result, "job": job})
+
+
+def enqueue_import(user, upload):
+    name = f"import-{uuid.uuid4().hex}.csv"
+    with open(jobs.job_file(name), "wb") as out:
+        for chunk in upload.chunks():
+            out.write(chunk)
+    return jobs.enqueue("import", user, path=name)
 
 
 @login_required
@@ -67,8 +190,8 @@ def category_create(request):
     if request.method == "POST":
         form = CategoryForm(request.POST)
         if form.is_valid():
-            form.save()
-            return redirect("expense_add")
+            category = form.save()
+            return redirect(f"{reverse('expense_add')}?category={category.pk}")
     else:
         form = CategoryForm()
     return render(request, "expenses/category_form.html", {"form": form})
@@ -76,39 +199,115 @@ def category_create(request):
 
 @login_required
 def expense_delete(request, pk):
-    expense = get_object_or_404(Expense, pk=pk)
+    expense = get_object_or_404(Expense.objects.for_user(request.user), pk=pk)
     if request.method == 'POST':
         expense.delete()
         return redirect('expense_list')
     return render(request, 'expenses/expense_confirm_delete.html', {'expense': expense})
 
 
+@login_required
+def job_detail(request, pk):
+    job = get_object_or_404(Job.objects.for_user(request.user), pk=pk)
+    return render(request, "expenses/job_detail.html", {"job": job})
+
+
+@login_required
+def receipt_file(request, sha256, thumbnail=False):
+    return receipts.receipt_response(request, sha256, thumbnail)
+
+
+FRONTEND_ASSET_RE = re.compile(r'(?P<attribute>src|href)="/static/frontend/(?P<name>[^"]+)"')
+_frontend_index = {}
+
+
+def frontend_index():
+    """The built frontend's ``index.html``, linking to the collected asset names."""
+    path = Path(settings.FRONTEND_DIST_DIR) / "index.html"
+    try:
+        modified = path.stat().st_mtime
+    except FileNotFoundError:
+        raise Http404("The frontend has not been built.")
+    if _frontend_index.get("key") != (path, modified):
+        html = FRONTEND_ASSET_RE.sub(
+            lambda match: f'{match["attribute"]}="{static("frontend/" + match["name"])}"',
+            path.read_text(encoding="utf-8"),
+        )
+        _frontend_index.update(key=(path, modified), html=html)
+    return _frontend_index["html"]
+
+
+def frontend(request, route=""):
+    """The React app; its router handles every path below /app/."""
+    response = HttpResponse(frontend_index())
+    # The page names the current assets, so it is revalidated every time
+    # while the fingerprinted assets themselves are cached for good.
+    response["Cache-Control"] = "no-cache"
+    return response
+
+
+def selected_ids(request):
+    try:
+        return [int(pk) for pk in request.POST.getlist("selected_expenses")]
+    except ValueError:
+        return None
+
+
 @login_required
 def expense_bulk_delete(request):
     if request.method == "POST":
-        ids = request.POST.getlist("selected_expenses")
+        ids = selected_ids(request)
+        if ids is None:
+            return HttpResponseBadRequest("Invalid expense id")
+        if len(ids) > settings.EXPENSE_BULK_BACKGROUND_IDS:
+            job = jobs.enqueue("bulk_delete", request.user, ids=ids)
+            return redirect("job_detail", pk=job.pk)
         if ids:
-            Expense.objects.filter(id__in=ids).delete()
+            bulk.bulk_delete(Expense.objects.for_user(request.user), ids=ids)
     return redirect("expense_list")
 
 
 @login_required
+def expense_bulk_edit(request):
+    if request.method == "POST":
+        ids = selected_ids(request)
+        if ids is None:
+            return HttpResponseBadRequest("Invalid expense id")
+        form = ExpenseBulkEditForm(request.POST)
+        if not form.is_valid():
+            return HttpResponseBadRequest(form.errors.as_text())
+        if ids:
+            try:
+                with category_writes():
+                    bulk.bulk_edit(Expense.objects.for_user(request.user), form.values(), ids=ids)
+            except CategoryGone as exc:
+                return HttpResponseBadRequest(str(exc))
+    return redirect("expense_list")
+
+
+@login_required
+@replica_reads
+@condition(etag_func=generations.etag, last_modified_func=generations.last_modified)
 def expense_summary(request):
-    expenses = Expense.objects.select_related("category")
+    rollup = ExpenseRollup.objects.for_user(request.user)
     start_date = request.GET.get("start_date")
     end_date = request.GET.get("end_date")
 
     if start_date:
-        expenses = expenses.filter(date__gte=start_date)
+        rollup = rollup.filter(day__gte=start_date)
     if end_date:
-        expenses = expenses.filter(date__lte=end_date)
+        rollup = rollup.filter(day__lte=end_date)
 
-    summary = (
-        expenses.values("category__name")
-        .annotate(total=Sum("amount"))
-        .order_by("category__name")
+    def summarize():
+        return [
+            {"category__name": row["category__name"], "total": from_cents(row["cents"])}
+            for row in category_totals(rollup)
+        ]
+
+    summary = generations.cached(
+        request, "summary", {"start_date": start_date or "", "end_date": end_date or ""}, summarize
     )
-    overall = expenses.aggregate(total=Sum("amount"))["total"] or 0
+    overall = sum((row["total"] for row in summary), from_cents(0))
     return render(
         request,
         "expenses/summary.html",
@@ -119,3 +318,33 @@ def expense_summary(request):
             "end_date": end_date,
         },
     )
+
+
+@login_required
+@replica_reads
+def expense_export(request):
+    fmt = request.GET.get("format", "csv")
+    if fmt not in FORMATS:
+        return HttpResponseBadRequest("Unsupported export format")
+    try:
+        filters = parse_expense_filters(request.GET)
+    except ValidationError as exc:
+        return HttpResponseBadRequest(exc.messages[0])
+    expenses = pin(filter_expenses(Expense.objects.for_user(request.user), filters))
+    _, content_type, extension = FORMATS[fmt]
+    response = StreamingHttpResponse(export_chunks(expenses, fmt), content_type=content_type)
+    response["Content-Disposition"] = f'attachment; filename="expenses.{extension}"'
+    return response
+
+
+def metrics(request):
+    token = settings.EXPENSES_METRICS_TOKEN
+    header = request.headers.get("Authorization", "")
+    bearer = header[len("Bearer "):] if header.startswith("Bearer ") else ""
+    authorized = bool(token) and secrets.compare_digest(bearer.encode(), token.encode())
+    # The API-only profile has no sessions, so no request.user either.
+    user = getattr(request, "user", None)
+    if not authorized and not (user is not None and user.is_staff):
+        return HttpResponseForbidden()
+    body = request_metrics.registry.render(request_metrics.cache_metrics())
+    return HttpResponse(body, content_type="text/plain; version=0.0.4; charset=utf-8")
@@ -0,0 +1,15 @@
+"""Set-up for ``run_workers``' child processes.
+
+Kept free of model imports: a spawned child imports this before Django is
+configured.
+"""
+import signal
+
+import django
+
+
+def setup():
+    # Ctrl-C reaches the whole process group; let the parent decide when
+    # its children stop.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    django.setup()
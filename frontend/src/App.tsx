@@ -24,7 +24,7 @@ const App = () => {
       <LocalizationProvider dateAdapter={AdapterDayjs}>
         <AuthProvider>
           <ExpenseProvider>
-            <BrowserRouter>
+            <BrowserRouter basename={import.meta.env.VITE_APP_BASENAME}>
               <Routes>
                 <Route path="/login" element={<Login />} />
                 <Route path="/signup" element={<Signup />} />
@@ -5,6 +5,9 @@ import { componentTagger } from "lovable-tagger";
 
 // https://vitejs.dev/config/
 export default defineConfig(({ mode }) => ({
+  // "npm run build:django" builds the bundle that Django collects into
+  // STATIC_URL/frontend/ and serves at /app/ (see .env.django).
+  base: mode === "django" ? "/static/frontend/" : "/",
   server: {
     host: "::",
     port: 8080,